@@ -0,0 +1,236 @@
+"""
+Admission Control Module
+Bounded concurrency with a bounded wait queue for expensive endpoints and providers
+"""
+
+import asyncio
+import math
+import os
+import threading
+import time
+
+import metrics
+from ollama_lifecycle import parallel_slots
+
+# Defaults used when no BRANDBOOK_MAX_CONCURRENT_<NAME> / BRANDBOOK_MAX_QUEUE_<NAME> is set
+DEFAULT_LIMITS = {
+    "generate_brochure": (4, 8),
+    "find_url": (8, 16),
+    "background_refresh": (1, 0),
+    "provider_openai": (4, 8),
+    "provider_claude": (4, 8),
+    "provider_gemini": (4, 8),
+    "provider_ollama": (2, 8),
+}
+FALLBACK_LIMIT = (4, 8)
+DEFAULT_QUEUE_TIMEOUT = 30.0
+
+
+class AdmissionRejectedError(Exception):
+    """
+    Raised when a request cannot be admitted
+
+    Attributes:
+        status_code: 429 when the wait queue is full, 503 when the wait timed out
+        retry_after: Suggested client back-off in whole seconds
+    """
+
+    def __init__(self, name, status_code, retry_after, reason):
+        super().__init__(reason)
+        self.name = name
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class Ticket:
+    """
+    Granted slots; release() is idempotent
+
+    grants holds (controller, granted_at) pairs, so each slot's hold time is
+    measured from its own grant whatever order tickets are released in.
+    """
+
+    def __init__(self, grants):
+        self._grants = grants
+        self._lock = threading.Lock()
+        self._released = False
+
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        for controller, granted_at in reversed(self._grants):
+            controller.release(granted_at)
+
+
+class AdmissionController:
+    """
+    Limit concurrent work to max_concurrent slots with a FIFO wait queue
+
+    Requests arriving while all slots are busy wait up to queue_timeout seconds;
+    when max_queue requests are already waiting they are rejected immediately.
+    """
+
+    def __init__(self, name, max_concurrent, max_queue, queue_timeout=DEFAULT_QUEUE_TIMEOUT):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._active = 0
+        self._waiters = []
+        self._lock = threading.Lock()
+        # Moving average of how long a slot is held, used for Retry-After
+        self._avg_hold = 5.0
+        self._publish()
+
+    @property
+    def active(self):
+        return self._active
+
+    @property
+    def queued(self):
+        return len(self._waiters)
+
+    def retry_after(self):
+        """Estimate seconds until a slot frees up for a newly queued request"""
+        rounds = (len(self._waiters) + 1) / max(self.max_concurrent, 1)
+        return max(1, math.ceil(self._avg_hold * rounds))
+
+    async def acquire(self):
+        """
+        Wait for a slot
+
+        Returns:
+            float: time.monotonic() when the slot was granted, for release()
+
+        Raises:
+            AdmissionRejectedError: queue full (429) or wait timed out (503)
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._active < self.max_concurrent and not self._waiters:
+                return self._grant()
+            if len(self._waiters) >= self.max_queue:
+                metrics.increment(f"admission_{self.name}_rejected_total")
+                raise AdmissionRejectedError(
+                    self.name, 429, self.retry_after(),
+                    f"Too many requests for {self.name}, please retry later")
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+            self._publish()
+
+        future = waiter[1]
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if self._abandon(waiter):
+                metrics.increment(f"admission_{self.name}_timeout_total")
+                raise AdmissionRejectedError(
+                    self.name, 503, self.retry_after(),
+                    f"Timed out waiting for a free {self.name} slot")
+            # Granted just as the wait timed out; the grant time is on its way
+            return await future
+        except asyncio.CancelledError:
+            if not self._abandon(waiter):
+                self.release()
+            raise
+
+    def release(self, granted_at=None):
+        """
+        Free a slot, handing it straight to the oldest waiter if any
+
+        granted_at is what acquire() returned; without it the hold time is
+        not counted in the Retry-After estimate.
+        """
+        with self._lock:
+            if granted_at is not None:
+                held = time.monotonic() - granted_at
+                self._avg_hold = 0.8 * self._avg_hold + 0.2 * held
+            self._active -= 1
+            while self._waiters:
+                loop, future = self._waiters.pop(0)
+                if future.done():
+                    continue
+                loop.call_soon_threadsafe(_resolve, future, self._grant())
+                break
+            self._publish()
+
+    def _grant(self):
+        self._active += 1
+        metrics.increment(f"admission_{self.name}_admitted_total")
+        self._publish()
+        return time.monotonic()
+
+    def _abandon(self, waiter):
+        """Remove a waiter; return False if it was already granted a slot"""
+        with self._lock:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+                waiter[1].cancel()
+                self._publish()
+                return True
+            return False
+
+    def _publish(self):
+        metrics.set_gauge(f"admission_{self.name}_active", self._active)
+        metrics.set_gauge(f"admission_{self.name}_queued", len(self._waiters))
+
+
+def _resolve(future, granted_at):
+    if not future.done():
+        future.set_result(granted_at)
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+_controllers = {}
+_controllers_lock = threading.Lock()
+
+
+def get_controller(name):
+    """
+    Return the shared controller for name, configured from the environment
+
+    BRANDBOOK_MAX_CONCURRENT_<NAME>, BRANDBOOK_MAX_QUEUE_<NAME> and
+    BRANDBOOK_QUEUE_TIMEOUT override the defaults. provider_ollama defaults
+    to this worker's share of OLLAMA_NUM_PARALLEL when that is set.
+    """
+    with _controllers_lock:
+        if name not in _controllers:
+            concurrent, queue = DEFAULT_LIMITS.get(name, FALLBACK_LIMIT)
+            if name == "provider_ollama":
+                # Match the local server's parallel slots
+                concurrent = parallel_slots(concurrent)
+            suffix = name.upper()
+            timeout = os.getenv("BRANDBOOK_QUEUE_TIMEOUT")
+            _controllers[name] = AdmissionController(
+                name,
+                max_concurrent=_env_int(f"BRANDBOOK_MAX_CONCURRENT_{suffix}", concurrent),
+                max_queue=_env_int(f"BRANDBOOK_MAX_QUEUE_{suffix}", queue),
+                queue_timeout=float(timeout) if timeout else DEFAULT_QUEUE_TIMEOUT,
+            )
+        return _controllers[name]
+
+
+async def admit(*names):
+    """
+    Acquire slots on several controllers in order (e.g. endpoint then provider)
+
+    Returns:
+        Ticket: call release() when the work is finished
+    """
+    acquired = []
+    try:
+        for name in names:
+            controller = get_controller(name)
+            acquired.append((controller, await controller.acquire()))
+    except BaseException:
+        for controller, granted_at in reversed(acquired):
+            controller.release(granted_at)
+        raise
+    return Ticket(acquired)
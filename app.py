@@ -2,44 +2,166 @@
 FastAPI Web Application for BrandBook Generator
 """
 
-from fastapi import FastAPI, Request, Form
-from fastapi.responses import HTMLResponse, StreamingResponse
-from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
-from contextlib import asynccontextmanager
 import asyncio
 import json
+import os
+import tempfile
+import threading
+from contextlib import asynccontextmanager
 from typing import Optional
 
+from fastapi import FastAPI, Form, Request
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
+from fastapi.templating import Jinja2Templates
+
 # Import our existing modules
-from url_finder import find_company_url
-from generator import get_brochure_user_prompt, brochure_system_prompt
 import generator
+import metrics
+from admission import AdmissionRejectedError, admit
+from brochure_cache import get_brochure_cache, pages_fingerprint
+from generator import GenerationCancelledError, brochure_system_prompt
+from ollama_lifecycle import get_ollama_lifecycle
+from parse_pool import shutdown_parse_pool
+from provider_router import router_from_env
+from refresh_scheduler import scheduler_from_env
+from shared_state import get_shared_document
+from url_finder import find_company_url
+from web_assets import MIN_COMPRESS_BYTES, CompressedBody, FingerprintedStaticFiles, static_url
 
 # Global state for model configuration
 model_initialized = False
+_refresh_scheduler = None
+_provider_router = None
+_provider_router_loaded = False
+
+
+def refresh_cached_brochure(company_name, url, cancel_event):
+    """Background refresh job for one cached brochure"""
+    if generator.MODEL_PROVIDER is None:
+        raise RuntimeError("Model not initialized")
+    return generator.refresh_brochure(company_name, url, get_brochure_cache(), cancel_event)
+
+
+def get_provider_router():
+    """Return the shared provider router, or None when no fallbacks are configured"""
+    global _provider_router, _provider_router_loaded
+    if not _provider_router_loaded:
+        _provider_router = router_from_env()
+        _provider_router_loaded = True
+    return _provider_router
+
+
+def open_brochure_stream(messages):
+    """Start the brochure completion; returns an iterable of text pieces with close()"""
+    router = get_provider_router()
+    if router is not None:
+        return router.stream(messages)
+    return generator.stream_completion(messages)
+
+
+def get_refresh_scheduler():
+    """Return the shared stale-while-revalidate scheduler"""
+    global _refresh_scheduler
+    if _refresh_scheduler is None:
+        _refresh_scheduler = scheduler_from_env(
+            get_brochure_cache(),
+            refresh_cached_brochure,
+            admission_names=lambda: (
+                "background_refresh", f"provider_{generator.MODEL_PROVIDER}")
+        )
+    return _refresh_scheduler
+
+
+DEFAULT_PROVIDER = "openai"
+
+
+def apply_model(provider, model_name=None):
+    """Point this worker's generator at provider/model with a fresh client"""
+    global model_initialized
+    model_name, client = generator.create_client(provider, model_name)
+    generator.MODEL_PROVIDER = provider
+    generator.MODEL_NAME = model_name
+    generator.client = client
+    model_initialized = True
+
+
+def sync_model():
+    """
+    Adopt a model selection made on another worker
+
+    With several workers, /api/set-model lands on one of them; the choice is
+    stored in the shared "model" document and every worker switches its own
+    client when it sees a newer selection.
+    """
+    document = get_shared_document("model")
+    selection = document.read() if document is not None else None
+    if not selection:
+        return
+    current = (generator.MODEL_PROVIDER, generator.MODEL_NAME)
+    if (selection["provider"], selection["model"]) != current:
+        try:
+            apply_model(selection["provider"], selection["model"])
+        except Exception as e:
+            print(f"⚠️ Could not switch to {selection['provider']}: {e}")
+
+
+def selected_ollama_model():
+    """Model name when this worker uses Ollama, else None"""
+    return generator.MODEL_NAME if generator.MODEL_PROVIDER == "ollama" else None
+
+
+async def warm_up_ollama(model_name):
+    """Load model_name in Ollama before it is needed; failures only warn"""
+    try:
+        load_seconds = await asyncio.to_thread(get_ollama_lifecycle().warm_up, model_name)
+        print(f"✓ Ollama {model_name} loaded ({load_seconds:.1f}s)")
+    except Exception as e:
+        metrics.increment("ollama_warmup_failed_total")
+        print(f"⚠️ Ollama warm-up failed: {e}")
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Lifespan event handler for startup and shutdown"""
-    # Startup
-    global model_initialized
+    """Lifespan event handler for startup and shutdown (runs once per worker)"""
+    # Startup: every worker process builds its own client
     if not model_initialized:
+        document = get_shared_document("model")
+        selection = (document.read() if document is not None else None) or {
+            "provider": DEFAULT_PROVIDER, "model": generator.DEFAULT_MODELS[DEFAULT_PROVIDER]}
         try:
-            generator.MODEL_PROVIDER = "openai"
-            generator.MODEL_NAME = "gpt-5.1"
-            from openai import OpenAI
-            generator.client = OpenAI()
-            model_initialized = True
-            print("✓ Model initialized with OpenAI GPT-5.1")
+            apply_model(selection["provider"], selection["model"])
+            print(f"✓ Model initialized with {generator.MODEL_PROVIDER} {generator.MODEL_NAME}"
+                  f" (worker {os.getpid()})")
         except Exception as e:
             print(f"⚠️ Model initialization failed: {e}")
 
+    # Load local models now so the first brochure does not pay for it
+    router = get_provider_router()
+    fallbacks = router.fallbacks if router is not None else []
+    for model_name in dict.fromkeys(
+            [selected_ollama_model()]
+            + [route.model_name for route in fallbacks if route.provider == "ollama"]):
+        if model_name:
+            await warm_up_ollama(model_name)
+    keep_alive_task = asyncio.create_task(get_ollama_lifecycle().run(selected_ollama_model))
+
+    refresh_task = None
+    if os.getenv("BRANDBOOK_BACKGROUND_REFRESH", "1") != "0":
+        refresh_task = asyncio.create_task(get_refresh_scheduler().run())
+
     yield
 
     # Shutdown (if needed)
     print("Shutting down...")
+    keep_alive_task.cancel()
+    if refresh_task is not None:
+        refresh_task.cancel()
+        try:
+            await refresh_task
+        except asyncio.CancelledError:
+            pass
+    shutdown_parse_pool()
 
 
 app = FastAPI(
@@ -48,30 +170,85 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# JSON and HTML are gzipped; the SSE brochure stream is left uncompressed
+app.add_middleware(GZipMiddleware, minimum_size=MIN_COMPRESS_BYTES)
+
 # Mount static files and templates
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.mount("/static", FingerprintedStaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
+templates.env.globals["static_url"] = static_url
+_index_page = None
+
+
+def get_index_page():
+    """The home page, rendered and compressed once per process"""
+    global _index_page
+    if _index_page is None:
+        html = templates.get_template("index.html").render()
+        _index_page = CompressedBody(html.encode("utf-8"), "text/html; charset=utf-8")
+    return _index_page
+
+
+class AdmittedStreamingResponse(StreamingResponse):
+    """StreamingResponse that releases its admission ticket however the stream ends"""
+
+    def __init__(self, content, ticket, **kwargs):
+        super().__init__(content, **kwargs)
+        self.ticket = ticket
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.ticket.release()
+
+
+def rejection_response(rejection: AdmissionRejectedError):
+    """Fast 429/503 response with a Retry-After hint"""
+    return JSONResponse(
+        status_code=rejection.status_code,
+        content={"success": False, "error": rejection.reason,
+                 "retry_after": rejection.retry_after},
+        headers={"Retry-After": str(rejection.retry_after)}
+    )
 
 
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request):
-    """Render the home page"""
-    return templates.TemplateResponse("index.html", {"request": request})
+    """Serve the home page (ETag revalidation, precompressed)"""
+    return get_index_page().response(request.headers)
+
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness/readiness probe; touches no template, model or cache"""
+    return {"status": "ok"}
 
 
 @app.post("/api/find-url")
 async def find_url(company_name: str = Form(...)):
     """API endpoint to find company URL"""
     try:
+        sync_model()
         if not model_initialized:
             return {"success": False, "error": "Model not initialized"}
 
-        url = find_company_url(
-            company_name,
-            generator.MODEL_PROVIDER,
-            generator.MODEL_NAME,
-            generator.client
-        )
+        try:
+            # The search step calls the model too (Ollama through LangChain)
+            ticket = await admit("find_url", f"provider_{generator.MODEL_PROVIDER}")
+        except AdmissionRejectedError as rejection:
+            return rejection_response(rejection)
+
+        try:
+            url = await asyncio.to_thread(
+                find_company_url,
+                company_name,
+                generator.MODEL_PROVIDER,
+                generator.MODEL_NAME,
+                generator.client
+            )
+        finally:
+            ticket.release()
 
         if url:
             return {"success": True, "url": url}
@@ -82,68 +259,183 @@ async def find_url(company_name: str = Form(...)):
         return {"success": False, "error": str(e)}
 
 
+CACHED_CHUNK_SIZE = 400
+
+
+def sse_event(payload):
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+def close_opened_stream(opening):
+    """Done callback closing a completion stream nobody is left to read"""
+    if not opening.cancelled() and opening.exception() is None:
+        generator.close_stream(opening.result())
+
+
+# Default for brochure_event_stream's entry: look the brochure up in the cache
+_LOOKUP = object()
+
+
+def servable_from_cache(cache, entry):
+    """True when entry can be replayed as is (fresh, or stale while revalidating)"""
+    return entry is not None and (
+        cache.is_fresh(entry) or get_refresh_scheduler().can_serve_stale(entry))
+
+
+async def brochure_event_stream(request: Request, company_name: str, website_url: str,
+                                entry=_LOOKUP):
+    """
+    Yield the brochure as server-sent events.
+
+    Fresh cached brochures are replayed directly. Expired ones are served
+    stale while the refresh scheduler revalidates them in the background;
+    entries too old for that are revalidated inline, page by page, and reused
+    when no page fingerprint changed, otherwise the brochure is regenerated
+    from the re-packed pages and cached.
+
+    The client connection is polled between chunks; when the user goes away
+    the scraping thread is told to stop, the upstream LLM stream is closed and
+    the cancellation is counted in metrics.
+
+    entry is the cache entry when the caller already looked it up.
+    """
+    cancel_event = threading.Event()
+    stream = None
+    opening = None
+    provider_ticket = None
+    cache = get_brochure_cache()
+    metrics.increment("brochure_requests_total")
+    metrics.adjust_gauge("brochure_in_flight", 1)
+
+    async def ensure_connected():
+        if await request.is_disconnected():
+            raise GenerationCancelledError()
+
+    async def replay(brochure):
+        for i in range(0, len(brochure), CACHED_CHUNK_SIZE):
+            await ensure_connected()
+            yield sse_event({'content': brochure[i:i + CACHED_CHUNK_SIZE]})
+
+    try:
+        scheduler = get_refresh_scheduler()
+        scheduler.record_request(company_name, website_url)
+        if entry is _LOOKUP:
+            entry = cache.get(company_name, website_url)
+        if entry is not None and cache.is_fresh(entry):
+            metrics.increment("brochure_cache_hits_total")
+            async for event in replay(entry["brochure"]):
+                yield event
+            yield sse_event({'done': True, 'cached': True})
+            metrics.increment("brochure_completed_total")
+            return
+
+        if entry is not None and scheduler.can_serve_stale(entry):
+            # Stale-while-revalidate: answer now, refresh in the background
+            metrics.increment("brochure_stale_served_total")
+            scheduler.request_refresh(company_name, website_url)
+            async for event in replay(entry["brochure"]):
+                yield event
+            yield sse_event({'done': True, 'cached': True, 'stale': True})
+            metrics.increment("brochure_completed_total")
+            return
+
+        # Scraping is blocking, keep it off the event loop
+        pages = await asyncio.to_thread(
+            generator.collect_pages, website_url, cancel_event,
+            entry["pages"] if entry else None
+        )
+        await ensure_connected()
+
+        if entry is not None and pages_fingerprint(pages) == entry["fingerprint"]:
+            # Nothing changed on the site since the last run
+            cache.revalidate(entry, pages)
+            metrics.increment("brochure_reused_total")
+            async for event in replay(entry["brochure"]):
+                yield event
+            yield sse_event({'done': True, 'cached': True})
+            metrics.increment("brochure_completed_total")
+            return
+
+        user_prompt = generator.build_brochure_user_prompt(
+            company_name, generator.pack_pages(pages))
+
+        messages = generator.build_messages(brochure_system_prompt, user_prompt)
+        parts = []
+
+        # Only now is a model call certain; hold a provider slot for it
+        provider_ticket = await admit(f"provider_{generator.MODEL_PROVIDER}")
+
+        # Stream the response (hedged across providers when a router is configured)
+        # Kept so finally can close a stream opened after the client left
+        opening = asyncio.ensure_future(asyncio.to_thread(open_brochure_stream, messages))
+        stream = await asyncio.shield(opening)
+        pieces = iter(stream)
+        while True:
+            await ensure_connected()
+            content = await asyncio.to_thread(next, pieces, None)
+            if content is None:
+                break
+            parts.append(content)
+            yield sse_event({'content': content})
+            await asyncio.sleep(0.01)
+
+        cache.put(company_name, website_url, "".join(parts), pages)
+        yield sse_event({'done': True})
+        metrics.increment("brochure_completed_total")
+
+    except GenerationCancelledError:
+        metrics.increment("brochure_cancelled_total")
+
+    except AdmissionRejectedError as rejection:
+        yield sse_event({'error': rejection.reason, 'retry_after': rejection.retry_after})
+
+    except (asyncio.CancelledError, GeneratorExit):
+        metrics.increment("brochure_cancelled_total")
+        raise
+
+    except Exception as e:
+        metrics.increment("brochure_errors_total")
+        yield sse_event({'error': str(e)})
+
+    finally:
+        cancel_event.set()
+        if stream is not None:
+            generator.close_stream(stream)
+        elif opening is not None:
+            opening.add_done_callback(close_opened_stream)
+        if provider_ticket is not None:
+            provider_ticket.release()
+        metrics.adjust_gauge("brochure_in_flight", -1)
+
+
 @app.post("/api/generate-brochure")
 async def generate_brochure(
+    request: Request,
     company_name: str = Form(...),
     website_url: str = Form(...)
 ):
     """API endpoint to generate brochure (streaming)"""
+    sync_model()
+    cache = get_brochure_cache()
+    entry = cache.get(company_name, website_url)
+    if servable_from_cache(cache, entry):
+        # A cache replay calls no model, so it never waits behind generations
+        return StreamingResponse(
+            brochure_event_stream(request, company_name, website_url, entry),
+            media_type="text/event-stream"
+        )
 
-    async def generate():
-        try:
-            # Get the prompt
-            user_prompt = get_brochure_user_prompt(company_name, website_url)
-
-            # Create messages
-            messages = [
-                {"role": "system", "content": brochure_system_prompt},
-                {"role": "user", "content": user_prompt}
-            ]
-
-            # Stream the response
-            if generator.MODEL_PROVIDER == "openai" or generator.MODEL_PROVIDER == "ollama":
-                stream = generator.client.chat.completions.create(
-                    model=generator.MODEL_NAME,
-                    messages=messages,
-                    stream=True
-                )
-
-                for chunk in stream:
-                    if chunk.choices[0].delta.content:
-                        content = chunk.choices[0].delta.content
-                        yield f"data: {json.dumps({'content': content})}\n\n"
-                        await asyncio.sleep(0.01)
-
-            elif generator.MODEL_PROVIDER == "claude":
-                # Claude streaming
-                stream = generator.call_ai_model(messages, stream=True)
-
-                for chunk in stream:
-                    if chunk.choices[0].delta.content:
-                        content = chunk.choices[0].delta.content
-                        yield f"data: {json.dumps({'content': content})}\n\n"
-                        await asyncio.sleep(0.01)
-
-            elif generator.MODEL_PROVIDER == "gemini":
-                # Gemini doesn't support streaming in the same way
-                model = generator.client.GenerativeModel(generator.MODEL_NAME)
-                prompt = f"{brochure_system_prompt}\n\n{user_prompt}"
-                response = model.generate_content(prompt)
-
-                # Simulate streaming by sending chunks
-                text = response.text
-                chunk_size = 50
-                for i in range(0, len(text), chunk_size):
-                    chunk = text[i:i+chunk_size]
-                    yield f"data: {json.dumps({'content': chunk})}\n\n"
-                    await asyncio.sleep(0.05)
-
-            yield f"data: {json.dumps({'done': True})}\n\n"
-
-        except Exception as e:
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+    try:
+        # The provider slot is taken by the stream once a model call is needed
+        ticket = await admit("generate_brochure")
+    except AdmissionRejectedError as rejection:
+        return rejection_response(rejection)
 
-    return StreamingResponse(generate(), media_type="text/event-stream")
+    return AdmittedStreamingResponse(
+        brochure_event_stream(request, company_name, website_url, entry),
+        ticket,
+        media_type="text/event-stream"
+    )
 
 
 @app.post("/api/set-model")
@@ -151,40 +443,14 @@ async def set_model(
     provider: str = Form(...),
     model_name: Optional[str] = Form(None)
 ):
-    """API endpoint to change AI model"""
-    global model_initialized
-
+    """API endpoint to change AI model (for every worker)"""
     try:
-        generator.MODEL_PROVIDER = provider
-
-        if provider == "openai":
-            generator.MODEL_NAME = model_name or "gpt-5.1"
-            from openai import OpenAI
-            generator.client = OpenAI()
-
-        elif provider == "gemini":
-            generator.MODEL_NAME = model_name or "gemini-2.0-flash"
-            import google.generativeai as genai
-            import os
-            genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
-            generator.client = genai
-
-        elif provider == "ollama":
-            generator.MODEL_NAME = model_name or "deepseek-r1"
-            from openai import OpenAI as OllamaClient
-            generator.client = OllamaClient(
-                base_url="http://localhost:11434/v1",
-                api_key="ollama"
-            )
-
-        elif provider == "claude":
-            generator.MODEL_NAME = model_name or "claude-sonnet-4.5"
-            from anthropic import Anthropic
-            import os
-            generator.client = Anthropic(
-                api_key=os.getenv('ANTHROPIC_API_KEY'))
-
-        model_initialized = True
+        apply_model(provider, model_name)
+        if provider == "ollama":
+            await warm_up_ollama(generator.MODEL_NAME)
+        document = get_shared_document("model")
+        if document is not None:
+            document.write({"provider": generator.MODEL_PROVIDER, "model": generator.MODEL_NAME})
         return {
             "success": True,
             "provider": generator.MODEL_PROVIDER,
@@ -198,6 +464,7 @@ async def set_model(
 @app.get("/api/model-status")
 async def model_status():
     """Get current model status"""
+    sync_model()
     if model_initialized:
         return {
             "initialized": True,
@@ -208,6 +475,43 @@ async def model_status():
         return {"initialized": False}
 
 
-if __name__ == "__main__":
+@app.get("/api/metrics")
+async def get_metrics():
+    """Get pipeline counters and gauges"""
+    return metrics.snapshot()
+
+
+def main():
+    """
+    Production entry point (brandbook-web)
+
+    Runs uvicorn with BRANDBOOK_WORKERS processes on HOST:PORT. Each worker
+    imports the app and builds its own clients in lifespan. With more than
+    one worker, state that must agree across them (model selection, brochure
+    and link-selection caches, learned company domains) defaults to files under
+    BRANDBOOK_STATE_DIR. BRANDBOOK_RELOAD=1 enables auto-reload for
+    development (single process).
+    """
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
+
+    workers = int(os.getenv("BRANDBOOK_WORKERS") or 1)
+    if workers > 1:
+        # Inherited by the worker processes
+        shared = os.environ.setdefault(
+            "BRANDBOOK_STATE_DIR", os.path.join(tempfile.gettempdir(), "brandbook"))
+        os.environ.setdefault("BRANDBOOK_CACHE_DIR", os.path.join(shared, "cache"))
+        os.environ.setdefault("BRANDBOOK_LINK_CACHE_DIR", os.path.join(shared, "links"))
+        os.environ.setdefault("BRANDBOOK_COMPANY_INDEX_LEARNED",
+                              os.path.join(shared, "learned_domains.tsv"))
+        os.makedirs(shared, exist_ok=True)
+    uvicorn.run(
+        "app:app",
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8000")),
+        workers=workers,
+        reload=os.getenv("BRANDBOOK_RELOAD") == "1",
+    )
+
+
+if __name__ == "__main__":
+    main()
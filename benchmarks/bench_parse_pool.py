@@ -0,0 +1,64 @@
+"""
+Benchmark: HTML parsing throughput, in-process vs parse_pool.ParsePool
+
+Parses a batch of synthetic company pages from several threads (as
+concurrent brochure requests do) first in-process, where the GIL limits
+parsing to one core, then through a ParsePool with one worker per core.
+
+Usage:
+    python benchmarks/bench_parse_pool.py [pages] [page_kb]
+"""
+
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from parse_pool import ParsePool, parse_document  # noqa: E402
+
+THREADS = 16
+
+
+def make_page(index, size_kb):
+    section = (
+        f"<div class='card'><h2>Product {index}</h2><p>We build tools for teams. "
+        f"<a href='/products/{index}'>Learn more</a></p><script>var x = {index};</script></div>"
+    ).encode()
+    body = section * (size_kb * 1024 // len(section) + 1)
+    return (b"<html><head><title>Company " + str(index).encode() + b"</title></head><body>"
+            + body + b"</body></html>")
+
+
+def run(parse, pages):
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=THREADS) as executor:
+        documents = list(executor.map(parse, pages))
+    elapsed = time.perf_counter() - started
+    assert all(document["links"] for document in documents)
+    return elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    size_kb = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+    cores = os.cpu_count() or 1
+    pages = [make_page(index, size_kb) for index in range(count)]
+    print(f"{count} pages of {size_kb} KiB, {THREADS} threads, {cores} cores")
+
+    elapsed = run(parse_document, pages)
+    print(f"in-process : {elapsed:7.2f}s  {count / elapsed:7.1f} pages/s")
+
+    pool = ParsePool(workers=cores, max_pending=cores * 2, min_bytes=0)
+    try:
+        run(pool.parse, pages[:cores])  # start the workers
+        pooled = run(pool.parse, pages)
+    finally:
+        pool.shutdown()
+    print(f"parse pool : {pooled:7.2f}s  {count / pooled:7.1f} pages/s  "
+          f"({elapsed / pooled:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Benchmark: search-result URL scoring
+
+Compares the original per-result regex/substring scoring with
+url_finder.SearchResultStore on a synthetic result set shaped like
+find_company_url's ten queries (many repeated hrefs), then on a large
+batch of distinct candidates.
+
+Usage:
+    python benchmarks/bench_url_scoring.py
+"""
+
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from url_finder import extract_domain_from_results, parse_result_url  # noqa: E402
+
+LEGACY_SKIP = ['wikipedia.org', 'twitter.com', 'x.com', 'facebook.com',
+               'linkedin.com', 'youtube.com', 'stackoverflow.com',
+               'github.com', 'reddit.com', 'instagram.com', 'tiktok.com',
+               'sotwe.com', '1319lm.top', 'medium.com', 'quora.com']
+
+
+def legacy_extract(results):
+    """The pre-SearchResultStore implementation, kept for comparison"""
+    potential_urls = []
+    for result in results:
+        href = result.get('href', '')
+        if any(skip in href for skip in LEGACY_SKIP):
+            continue
+        if href and href.startswith('http'):
+            match = re.search(r'https?://(?:www\.)?([^/]+)', href)
+            if match:
+                path_count = href.rstrip('/').count('/')
+                score = 0
+                if path_count == 2:
+                    score += 10
+                elif path_count == 3:
+                    score += 5
+                if '.com' in href:
+                    score += 10
+                elif '.co/' in href or href.endswith('.co'):
+                    score += 7
+                elif '.ai' in href:
+                    score += 3
+                elif '.io' in href:
+                    score += 3
+                score -= path_count
+                clean_url = href.split('?')[0].rstrip('/')
+                if not clean_url.endswith(('.html', '.htm', '.php')):
+                    potential_urls.append((score, clean_url, href))
+    potential_urls.sort(reverse=True, key=lambda x: x[0])
+    com_urls = [url for url in potential_urls if '.com' in url[1]]
+    if com_urls:
+        potential_urls = com_urls
+    if potential_urls:
+        match = re.search(r'(https?://(?:www\.)?[^/]+)', potential_urls[0][1])
+        return match.group(1) if match else potential_urls[0][1]
+    return None
+
+
+def make_results(distinct, repeats, seed=7):
+    rng = random.Random(seed)
+    tlds = ['com', 'co', 'ai', 'io', 'org', 'net']
+    paths = ['', '/about', '/blog/post', '/careers/jobs/1', '/news?id=3']
+    pool = [{"href": "https://www.acme.com", "title": "Acme"}]
+    for i in range(distinct - 1):
+        host = f"site{i}.{rng.choice(tlds)}"
+        if rng.random() < 0.2:
+            host = rng.choice(LEGACY_SKIP)
+        pool.append({"href": f"https://{host}{rng.choice(paths)}", "title": f"r{i}"})
+    results = [rng.choice(pool) for _ in range(distinct * repeats)]
+    results.insert(0, pool[0])
+    return results
+
+
+def bench(func, results, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        chosen = func(results)
+    elapsed = time.perf_counter() - start
+    return chosen, elapsed / (rounds * len(results)) * 1e6
+
+
+def main():
+    for label, distinct, repeats, rounds in [
+        ("find_company_url shape (24 results, repeated hrefs)", 8, 3, 2000),
+        ("batch job (5,000 distinct candidates x2)", 5000, 2, 5),
+    ]:
+        results = make_results(distinct, repeats)
+        parse_result_url.cache_clear()
+        old_url, old_cost = bench(legacy_extract, results, rounds)
+        new_url, new_cost = bench(extract_domain_from_results, results, rounds)
+        print(label)
+        print(f"  legacy: {old_cost:7.2f} us/result -> {old_url}")
+        print(f"  store : {new_cost:7.2f} us/result -> {new_url}")
+        print(f"  same chosen URL: {old_url == new_url}")
+
+
+if __name__ == "__main__":
+    main()
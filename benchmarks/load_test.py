@@ -0,0 +1,131 @@
+"""
+Load test: brochure throughput vs. number of server workers
+
+Starts the production server (python app.py) with 1, 2, 4, ... workers and
+hits /api/generate-brochure for a brochure that is already in the shared
+cache, so the measurement covers the server's own per-request CPU work
+(routing, admission, cache lookup, SSE replay) without any LLM or network
+calls. Load comes from separate client processes so the client is not
+limited by one GIL. Throughput should grow close to linearly with the
+worker count up to the number of cores.
+
+Usage:
+    python benchmarks/load_test.py [--workers 1,2,4] [--requests 2000] [--concurrency 32]
+"""
+
+import argparse
+import http.client
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlencode
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from brochure_cache import BrochureCache  # noqa: E402
+
+COMPANY = "Acme"
+URL = "https://acme.example"
+BODY = urlencode({"company_name": COMPANY, "website_url": URL})
+FORM = {"Content-Type": "application/x-www-form-urlencoded"}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def seed_cache(directory):
+    brochure = "# Acme\n\n" + "Acme builds rockets for teams of every size. " * 200
+    page = {"url": URL, "type": "landing page", "content": "Acme", "fingerprint": "f",
+            "etag": None, "last_modified": None}
+    BrochureCache(directory=directory).put(COMPANY, URL, brochure, [page])
+
+
+def start_server(workers, port, state_dir):
+    env = dict(
+        os.environ,
+        HOST="127.0.0.1",
+        PORT=str(port),
+        BRANDBOOK_WORKERS=str(workers),
+        BRANDBOOK_STATE_DIR=state_dir,
+        BRANDBOOK_CACHE_DIR=os.path.join(state_dir, "cache"),
+        BRANDBOOK_BACKGROUND_REFRESH="0",
+        BRANDBOOK_MAX_CONCURRENT_GENERATE_BROCHURE="1000",
+        BRANDBOOK_MAX_QUEUE_GENERATE_BROCHURE="1000",
+        BRANDBOOK_MAX_CONCURRENT_PROVIDER_OPENAI="1000",
+        BRANDBOOK_MAX_QUEUE_PROVIDER_OPENAI="1000",
+        OPENAI_API_KEY=os.getenv("OPENAI_API_KEY", "load-test"),
+    )
+    server = subprocess.Popen([sys.executable, "app.py"], cwd=ROOT, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            connection.request("GET", "/api/model-status")
+            if connection.getresponse().status == 200:
+                # Give the remaining workers a moment to finish booting
+                time.sleep(1 + workers * 0.5)
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("server did not start")
+
+
+def client(args):
+    port, count = args
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    failures = 0
+    for _ in range(count):
+        connection.request("POST", "/api/generate-brochure", BODY, FORM)
+        response = connection.getresponse()
+        payload = response.read()
+        if response.status != 200 or b'"done": true' not in payload:
+            failures += 1
+    return failures
+
+
+def measure(port, requests, concurrency):
+    per_client = requests // concurrency
+    with multiprocessing.Pool(concurrency) as pool:
+        pool.map(client, [(port, 5)] * concurrency)  # warm up connections and workers
+        started = time.perf_counter()
+        failures = sum(pool.map(client, [(port, per_client)] * concurrency))
+        elapsed = time.perf_counter() - started
+    return per_client * concurrency / elapsed, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} cores, {args.requests} requests, {args.concurrency} clients")
+    baseline = None
+    for workers in [int(value) for value in args.workers.split(",")]:
+        with tempfile.TemporaryDirectory() as state_dir:
+            seed_cache(os.path.join(state_dir, "cache"))
+            port = free_port()
+            server = start_server(workers, port, state_dir)
+            try:
+                throughput, failures = measure(port, args.requests, args.concurrency)
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+        baseline = baseline or throughput
+        print(f"{workers:2d} workers: {throughput:8.1f} req/s  "
+              f"({throughput / baseline:.2f}x)  failures={failures}")
+
+
+if __name__ == "__main__":
+    main()
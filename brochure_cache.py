@@ -0,0 +1,175 @@
+"""
+Brochure Cache Module
+Stores generated brochures with the fingerprints of the pages they were built from
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 10_000
+
+
+def pages_fingerprint(pages):
+    """Combined fingerprint of the landing page and relevant links, in order"""
+    digest = hashlib.sha256()
+    for page in pages:
+        digest.update(f"{page['type']}\t{page['url']}\t{page['fingerprint']}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def cache_key(company_name, url):
+    normalized = f"{company_name.strip().lower()}\n{url.strip().rstrip('/').lower()}"
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class BrochureCache:
+    """
+    Brochures keyed by (company name, website URL)
+
+    Each entry records the brochure text, the page records it was generated
+    from (url, type, content, fingerprint, HTTP validators) and timestamps.
+    Entries are kept in memory (LRU, max_entries) and, when directory is set,
+    also written as one JSON file per entry so they survive restarts and are
+    shared by every process using the same directory: get() re-reads an
+    entry whose file another process has replaced since.
+    """
+
+    def __init__(self, directory=None, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._mtimes = {}
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, company_name, url):
+        """Return the entry for company/url (fresh or expired), or None"""
+        key = cache_key(company_name, url)
+        mtime = self._mtime(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._mtimes.get(key) == mtime:
+                self._entries.move_to_end(key)
+                return entry
+        loaded = self._load(key)
+        if loaded is None:
+            return entry
+        self._remember(key, loaded, mtime)
+        return loaded
+
+    def refreshed_at(self, company_name, url):
+        """
+        When company/url was last generated or revalidated, or None
+
+        Read-only: the LRU order is left alone and no brochure is loaded; an
+        entry another process wrote is dated by its file's modification time.
+        """
+        key = cache_key(company_name, url)
+        mtime = self._mtime(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._mtimes.get(key) == mtime:
+                return entry["refreshed_at"]
+        if mtime is None:
+            return None
+        return mtime[1] / 1e9
+
+    def is_fresh(self, entry, now=None):
+        return ((now or time.time()) - entry["refreshed_at"]) < self.ttl
+
+    def put(self, company_name, url, brochure, pages):
+        """Store a newly generated brochure together with its page records"""
+        now = time.time()
+        entry = {
+            "company_name": company_name,
+            "url": url,
+            "brochure": brochure,
+            "pages": pages,
+            "fingerprint": pages_fingerprint(pages),
+            "created_at": now,
+            "refreshed_at": now,
+        }
+        self._store(cache_key(company_name, url), entry)
+        return entry
+
+    def revalidate(self, entry, pages):
+        """Mark an entry as checked against the site; its brochure is still current"""
+        entry = dict(entry, pages=pages, refreshed_at=time.time())
+        self._store(cache_key(entry["company_name"], entry["url"]), entry)
+        return entry
+
+    def entries(self):
+        """Snapshot of the in-memory entries"""
+        with self._lock:
+            return list(self._entries.values())
+
+    def _store(self, key, entry):
+        mtime = None
+        if self.directory:
+            path = self._path(key)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as handle:
+                json.dump(entry, handle)
+            os.replace(tmp_path, path)
+            mtime = self._mtime(key)
+        self._remember(key, entry, mtime)
+
+    def _remember(self, key, entry, mtime=None):
+        with self._lock:
+            self._entries[key] = entry
+            self._mtimes[key] = mtime
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._mtimes.pop(evicted, None)
+
+    def _mtime(self, key):
+        """Version of an entry's file; os.replace gives every write a new inode"""
+        if not self.directory:
+            return None
+        try:
+            stat = os.stat(self._path(key))
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns)
+
+    def _load(self, key):
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(key), encoding="utf-8") as handle:
+                return json.load(handle)
+        except (OSError, ValueError):
+            return None
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+
+_shared_lock = threading.Lock()
+_shared_cache = None
+
+
+def get_brochure_cache():
+    """
+    Return the shared BrochureCache
+
+    BRANDBOOK_CACHE_DIR enables on-disk persistence and BRANDBOOK_CACHE_TTL
+    sets how many seconds a brochure is served before it is revalidated.
+    """
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            ttl = os.getenv("BRANDBOOK_CACHE_TTL")
+            _shared_cache = BrochureCache(
+                directory=os.getenv("BRANDBOOK_CACHE_DIR") or None,
+                ttl=float(ttl) if ttl else DEFAULT_TTL,
+            )
+        return _shared_cache
@@ -0,0 +1,264 @@
+"""
+Company Index Module
+Offline company-name to official-domain lookups backed by a memory-mapped file
+"""
+
+import difflib
+import ipaddress
+import mmap
+import os
+import re
+import threading
+import unicodedata
+
+from domain_index import get_blocked_domains, get_public_suffixes, host_of
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+COMPANY_INDEX_FILE = os.path.join(DATA_DIR, "company_domains.tsv")
+
+# Trailing words that do not distinguish one company from another
+LEGAL_SUFFIXES = {
+    'inc', 'incorporated', 'ltd', 'limited', 'llc', 'corp', 'corporation',
+    'co', 'company', 'gmbh', 'ag', 'sa', 'plc', 'holdings', 'group', 'as',
+}
+
+FUZZY_MIN_LENGTH = 5
+FUZZY_CUTOFF = 0.85
+FUZZY_SCAN_LIMIT = 2000
+
+_WORD = re.compile(r"[^\W_]+")
+_DOMAIN_LIKE = re.compile(r"^(?:https?://)?[\w-]+(?:\.[\w-]+)+(?:[/:?#].*)?$")
+
+
+def normalize_company_name(name):
+    """
+    Reduce a company name or website to its lookup key
+
+    'Hugging Face, Inc.' -> 'huggingface', 'https://www.openai.com/' -> 'openai'
+    """
+    text = unicodedata.normalize("NFKD", name.strip().lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    if _DOMAIN_LIKE.match(text):
+        host = host_of(text if "://" in text else f"https://{text}")
+        registrable = get_public_suffixes().registrable_domain(host) if host else None
+        if registrable:
+            return registrable.split('.', 1)[0].replace('-', '')
+    words = _WORD.findall(text.replace('&', ' and '))
+    while len(words) > 1 and (words[-1] in LEGAL_SUFFIXES or words[-1] == 'and'):
+        words.pop()
+    return "".join(words)
+
+
+def learnable_host(url):
+    """
+    Normalized host of a resolved company URL, or None if it is not a site
+
+    'https://WWW.Acme.com:443/about' -> 'acme.com'. Hosts without a
+    registrable domain (IPs, bare suffixes, localhost) and blocked domains
+    give None.
+    """
+    host = host_of(url if "://" in url else f"https://{url}")
+    if not host:
+        return None
+    host = host.rstrip(".").removeprefix("www.")
+    try:
+        ipaddress.ip_address(host)
+        return None
+    except ValueError:
+        pass
+    if not get_public_suffixes().registrable_domain(host):
+        return None
+    if get_blocked_domains().match(host) is not None:
+        return None
+    return host
+
+
+class CompanyIndex:
+    """
+    Sorted 'key<TAB>domain' file, memory-mapped and binary-searched
+
+    Exact lookups cost O(log n) line probes with no parsing of the whole file.
+    Misses fall back to fuzzy matching among keys sharing a short prefix.
+    Learned entries live in an in-memory overlay and, when learned_path is
+    set, are appended to that file; lookups read any lines other processes
+    (e.g. sibling server workers) appended since.
+    """
+
+    def __init__(self, path=COMPANY_INDEX_FILE, learned_path=None):
+        self.path = path
+        self.learned_path = learned_path
+        self._mm = None
+        self._learned = {}
+        self._learned_offset = 0
+        self._lock = threading.Lock()
+        if path and os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, "rb") as handle:
+                self._mm = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        self._read_learned()
+
+    def _read_learned(self):
+        """Load learned lines appended since the last read"""
+        if not self.learned_path:
+            return
+        try:
+            if os.path.getsize(self.learned_path) <= self._learned_offset:
+                return
+            with open(self.learned_path, "rb") as handle:
+                handle.seek(self._learned_offset)
+                data = handle.read()
+        except OSError:
+            return
+        # Only complete lines; a concurrent append may still be in progress
+        complete = data[:data.rfind(b"\n") + 1]
+        self._learned_offset += len(complete)
+        for line in complete.decode("utf-8", errors="replace").splitlines():
+            key, _, domain = line.partition("\t")
+            if key and domain:
+                self._learned[key] = domain
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+    def lookup(self, company_name, fuzzy=True):
+        """
+        Return the official URL for a company name, or None
+
+        Args:
+            company_name: Company name or website as typed by the user
+            fuzzy: Allow close (typo-tolerant) matches when there is no exact key
+        """
+        key = normalize_company_name(company_name)
+        if not key:
+            return None
+        with self._lock:
+            self._read_learned()
+        domain = self._learned.get(key) or self._exact(key)
+        if domain is None and fuzzy and len(key) >= FUZZY_MIN_LENGTH:
+            domain = self._fuzzy(key)
+        return f"https://{domain}" if domain else None
+
+    def learn(self, company_name, url):
+        """
+        Remember a successful resolution for future lookups
+
+        Only hosts that look like the company's own site are kept: the host
+        must sit under a registrable domain that is not blocked and whose
+        name matches the company's, so a stray search result (a directory,
+        a news article) is not served to every later lookup.
+        """
+        key = normalize_company_name(company_name)
+        domain = learnable_host(url)
+        if not key or not domain:
+            return
+        label = normalize_company_name(domain)
+        if not label or (label not in key and key not in label):
+            return
+        with self._lock:
+            if self._learned.get(key) == domain:
+                return
+            self._read_learned()
+            self._learned[key] = domain
+            if self.learned_path:
+                with open(self.learned_path, "a", encoding="utf-8") as handle:
+                    handle.write(f"{key}\t{domain}\n")
+                self._read_learned()
+
+    def _line(self, start):
+        """Return (key, domain, next_line_start) for the line beginning at start"""
+        mm = self._mm
+        end = mm.find(b"\n", start)
+        if end == -1:
+            end = len(mm)
+        key, _, domain = mm[start:end].partition(b"\t")
+        return key, domain, end + 1
+
+    def _bisect(self, key):
+        """Offset of the first line whose key is >= key"""
+        mm = self._mm
+        lo, hi = 0, len(mm)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = mm.rfind(b"\n", 0, mid) + 1
+            line_key, _, next_start = self._line(start)
+            if line_key < key:
+                lo = next_start
+            else:
+                hi = start
+        return lo
+
+    def _exact(self, key):
+        if self._mm is None:
+            return None
+        encoded = key.encode("utf-8")
+        position = self._bisect(encoded)
+        if position >= len(self._mm):
+            return None
+        line_key, domain, _ = self._line(position)
+        return domain.decode("utf-8") if line_key == encoded else None
+
+    def _candidates(self, prefix):
+        for key, domain in self._learned.items():
+            if key.startswith(prefix):
+                yield key, domain
+        if self._mm is None:
+            return
+        encoded = prefix.encode("utf-8")
+        position = self._bisect(encoded)
+        for _ in range(FUZZY_SCAN_LIMIT):
+            if position >= len(self._mm):
+                break
+            line_key, domain, position = self._line(position)
+            if not line_key.startswith(encoded):
+                break
+            yield line_key.decode("utf-8"), domain.decode("utf-8")
+
+    def _fuzzy(self, key):
+        best, best_ratio = None, FUZZY_CUTOFF
+        matcher = difflib.SequenceMatcher(b=key)
+        for candidate, domain in self._candidates(key[:2]):
+            matcher.set_seq1(candidate)
+            if matcher.real_quick_ratio() < best_ratio or matcher.quick_ratio() < best_ratio:
+                continue
+            ratio = matcher.ratio()
+            if ratio > best_ratio:
+                best, best_ratio = domain, ratio
+        return best
+
+
+def write_index(entries, path):
+    """
+    Write (company name, domain) pairs as a sorted index file
+
+    Names are normalized; later pairs win when two names share a key.
+    """
+    table = {}
+    for name, domain in entries:
+        key = normalize_company_name(name)
+        if key:
+            table[key] = domain
+    with open(path, "wb") as handle:
+        for key in sorted(table, key=lambda k: k.encode("utf-8")):
+            handle.write(f"{key}\t{table[key]}\n".encode("utf-8"))
+
+
+_shared_lock = threading.Lock()
+_shared_index = None
+
+
+def get_company_index():
+    """
+    Return the shared CompanyIndex
+
+    BRANDBOOK_COMPANY_INDEX_FILE replaces the bundled index and
+    BRANDBOOK_COMPANY_INDEX_LEARNED persists learned resolutions.
+    """
+    global _shared_index
+    with _shared_lock:
+        if _shared_index is None:
+            _shared_index = CompanyIndex(
+                os.getenv("BRANDBOOK_COMPANY_INDEX_FILE") or COMPANY_INDEX_FILE,
+                os.getenv("BRANDBOOK_COMPANY_INDEX_LEARNED"),
+            )
+        return _shared_index
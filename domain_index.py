@@ -0,0 +1,214 @@
+"""
+Domain Index Module
+Suffix tries over reversed host labels for public-suffix and block-list lookups
+"""
+
+import os
+import threading
+from urllib.parse import urlsplit
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+PUBLIC_SUFFIX_FILE = os.path.join(DATA_DIR, "public_suffix_list.dat")
+
+# Domains that are never a company's official website nor a useful brochure page
+DEFAULT_BLOCKED_DOMAINS = (
+    'wikipedia.org', 'twitter.com', 'x.com', 'facebook.com',
+    'linkedin.com', 'youtube.com', 'stackoverflow.com',
+    'github.com', 'reddit.com', 'instagram.com', 'tiktok.com',
+    'sotwe.com', '1319lm.top', 'medium.com', 'quora.com',
+)
+
+_RULE = None            # key under which a trie node stores its value
+_NORMAL = "normal"
+_EXCEPTION = "exception"
+
+
+def split_host(host):
+    """Normalize a host name and return its labels, TLD last"""
+    return host.strip().rstrip('.').lower().split('.')
+
+
+def host_of(url):
+    """Return the lowercase host of an absolute URL, or None for relative links"""
+    try:
+        return urlsplit(url).hostname
+    except ValueError:
+        return None
+
+
+class DomainIndex:
+    """
+    Map domains to values and look hosts up by label-aligned suffix
+
+    A host matches a domain when it equals it or is one of its subdomains, so
+    'en.wikipedia.org' matches 'wikipedia.org' but 'notgithub.company.io' does
+    not match 'github.com'. Lookups cost O(number of labels in the host).
+    """
+
+    def __init__(self, domains=(), value=True):
+        self._root = {}
+        self._size = 0
+        for domain in domains:
+            self.add(domain, value)
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, host):
+        return self.match(host) is not None
+
+    def add(self, domain, value=True):
+        node = self._root
+        for label in reversed(split_host(domain)):
+            node = node.setdefault(label, {})
+        if _RULE not in node:
+            self._size += 1
+        node[_RULE] = value
+
+    def update(self, domains, value=True):
+        for domain in domains:
+            self.add(domain, value)
+
+    def match(self, host):
+        """Return the value of the most specific domain covering host, or None"""
+        if not host:
+            return None
+        node = self._root
+        found = None
+        for label in reversed(split_host(host)):
+            node = node.get(label)
+            if node is None:
+                break
+            if _RULE in node:
+                found = node[_RULE]
+        return found
+
+
+class PublicSuffixList:
+    """
+    Public Suffix List rules (normal, wildcard and exception) in a label trie
+    """
+
+    def __init__(self, rules=()):
+        self._root = {}
+        for rule in rules:
+            self.add_rule(rule)
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, encoding="utf-8") as handle:
+            return cls(_read_rules(handle))
+
+    def add_rule(self, rule):
+        kind = _NORMAL
+        if rule.startswith('!'):
+            kind, rule = _EXCEPTION, rule[1:]
+        for variant in _label_variants(rule):
+            node = self._root
+            for label in reversed(variant):
+                node = node.setdefault(label, {})
+            node[_RULE] = kind
+
+    def suffix_length(self, labels):
+        """Number of trailing labels forming the public suffix (at least 1)"""
+        node = self._root
+        length = 1
+        for depth, label in enumerate(reversed(labels), 1):
+            child = node.get(label)
+            if child is not None:
+                rule = child.get(_RULE)
+                if rule == _EXCEPTION:
+                    return depth - 1
+                if rule == _NORMAL or '*' in node:
+                    length = depth
+                node = child
+            elif '*' in node:
+                length = depth
+                node = node['*']
+            else:
+                break
+        return length
+
+    def public_suffix(self, host):
+        labels = split_host(host)
+        return '.'.join(labels[-self.suffix_length(labels):])
+
+    def registrable_domain(self, host):
+        """Return the eTLD+1 of host ('foo.com.evil.top' -> 'evil.top') or None"""
+        labels = split_host(host)
+        length = self.suffix_length(labels)
+        if len(labels) <= length:
+            return None
+        return '.'.join(labels[-(length + 1):])
+
+
+def _read_rules(lines):
+    for line in lines:
+        rule = line.split('//', 1)[0].strip()
+        if rule:
+            yield rule.split()[0].lower()
+
+
+def _label_variants(rule):
+    """Yield the rule's labels as written and, for IDN rules, in punycode"""
+    labels = rule.split('.')
+    yield labels
+    try:
+        ascii_labels = [
+            label if label == '*' or label.isascii() else label.encode('idna').decode('ascii')
+            for label in labels
+        ]
+    except UnicodeError:
+        return
+    if ascii_labels != labels:
+        yield ascii_labels
+
+
+def _read_domain_file(path):
+    """One domain per line; '#' starts a comment"""
+    with open(path, encoding="utf-8") as handle:
+        for line in handle:
+            domain = line.split('#', 1)[0].strip()
+            if domain:
+                yield domain
+
+
+_shared_lock = threading.Lock()
+_public_suffixes = None
+_blocked_domains = None
+
+
+def get_public_suffixes():
+    """
+    Return the shared PublicSuffixList
+
+    Loaded once from BRANDBOOK_PUBLIC_SUFFIX_FILE or the bundled data file.
+    """
+    global _public_suffixes
+    with _shared_lock:
+        if _public_suffixes is None:
+            path = os.getenv("BRANDBOOK_PUBLIC_SUFFIX_FILE") or PUBLIC_SUFFIX_FILE
+            _public_suffixes = PublicSuffixList.from_file(path)
+        return _public_suffixes
+
+
+def get_blocked_domains():
+    """
+    Return the shared block list used by URL finding and link filtering
+
+    DEFAULT_BLOCKED_DOMAINS plus any domains listed in BRANDBOOK_BLOCKED_DOMAINS_FILE.
+    """
+    global _blocked_domains
+    with _shared_lock:
+        if _blocked_domains is None:
+            index = DomainIndex(DEFAULT_BLOCKED_DOMAINS)
+            path = os.getenv("BRANDBOOK_BLOCKED_DOMAINS_FILE")
+            if path:
+                index.update(_read_domain_file(path))
+            _blocked_domains = index
+        return _blocked_domains
+
+
+def is_blocked(host):
+    """True when host is a blocked domain or one of its subdomains"""
+    return host is not None and get_blocked_domains().match(host) is not None
@@ -2,13 +2,24 @@
 # Creates a brochure for a company to be used for prospective clients, investors and potential recruits
 
 # imports
+import hashlib
 import os
-import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 from dotenv import load_dotenv
-from IPython.display import Markdown, display, update_display
-from scraper import fetch_website_links, fetch_website_contents
+from IPython.display import Markdown, display
 from openai import OpenAI
 
+import metrics
+from brochure_cache import pages_fingerprint
+from link_cache import get_link_cache, link_selection_key
+from ollama_lifecycle import get_ollama_lifecycle, ollama_base_url
+from scraper import fetch_page, fetch_website_links
+from sitemap import discover_relevant_links
+from structured_output import LinkStreamParser, StructuredOutputError, parse_links
+
 # Initialize and constants
 load_dotenv(override=True)
 
@@ -17,6 +28,36 @@ MODEL_PROVIDER = None
 MODEL_NAME = None
 client = None
 
+# Link selection is streamed so sub-page fetches overlap with the model's output
+STREAM_LINK_SELECTION = os.getenv("BRANDBOOK_STREAM_LINK_SELECTION", "1") != "0"
+LINK_FETCH_WORKERS = 4
+
+
+class GenerationCancelledError(Exception):
+    """Raised when a brochure request is cancelled before it finishes"""
+
+
+def check_cancelled(cancel_event):
+    """Raise GenerationCancelledError if the given threading.Event has been set"""
+    if cancel_event is not None and cancel_event.is_set():
+        raise GenerationCancelledError()
+
+
+def close_stream(stream):
+    """
+    Abort an upstream streaming response so the provider stops generating
+
+    Works for OpenAI/Ollama Stream objects and ClaudeStreamWrapper alike;
+    errors while closing are ignored since the stream is being abandoned.
+    """
+    close = getattr(stream, "close", None)
+    if close is None:
+        return
+    try:
+        close()
+    except Exception:
+        pass
+
 
 def initialize_model():
     """Initialize the AI model based on user selection"""
@@ -71,7 +112,7 @@ def initialize_model():
             try:
                 from openai import OpenAI as OllamaClient
                 client = OllamaClient(
-                    base_url="http://localhost:11434/v1",
+                    base_url=f"{ollama_base_url()}/v1",
                     api_key="ollama"  # Ollama doesn't require API key
                 )
                 print("✓ Ollama configured successfully")
@@ -124,34 +165,138 @@ You should respond in JSON as in this example:
 """
 
 
-def get_links_user_prompt(url):
+def get_links_user_prompt(url, links=None):
     user_prompt = f"""
-Here is the list of links on the website {url} -
-Please decide which of these are relevant web links for a brochure about the company, 
+Please decide which of the links below are relevant web links for a brochure about the company,
 respond with the full https URL in JSON format.
 Do not include Terms of Service, Privacy, email links.
 
-Links (some might be relative links):
+Here is the list of links on the website {url} (some might be relative links):
 
 """
-    links = fetch_website_links(url)
+    if links is None:
+        links = fetch_website_links(url)
     user_prompt += "\n".join(links)
     return user_prompt
 
 
-def call_ai_model(messages, json_mode=False, stream=False):
-    """Universal function to call any AI model"""
-    if MODEL_PROVIDER == "openai":
-        params = {
-            "model": MODEL_NAME,
-            "messages": messages,
-            "stream": stream
-        }
-        if json_mode:
-            params["response_format"] = {"type": "json_object"}
-        return client.chat.completions.create(**params)
+def build_messages(system_prompt, user_prompt):
+    """
+    Chat messages with the static instructions first
+
+    Providers cache prompts by exact prefix, so the system prompt is never
+    formatted with request data: everything that varies goes in the user
+    message after it.
+    """
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
+
+def prompt_cache_key(messages):
+    """Routing hint for OpenAI prompt caching: a hash of the system prompt"""
+    system = "".join(msg["content"] for msg in messages if msg["role"] == "system")
+    return "brandbook-" + hashlib.sha256(system.encode("utf-8")).hexdigest()[:16]
 
-    elif MODEL_PROVIDER == "gemini":
+
+def _count(usage, *names):
+    """First integer attribute of usage among names (missing/None -> 0)"""
+    for name in names:
+        value = getattr(usage, name, None)
+        if isinstance(value, int):
+            return value
+    return 0
+
+
+def record_usage(provider, usage):
+    """
+    Add a response's input-token usage to the prompt cache metrics
+
+    Understands OpenAI/Ollama (prompt_tokens_details.cached_tokens), Anthropic
+    (cache_read/cache_creation_input_tokens) and Gemini usage_metadata.
+    """
+    if usage is None:
+        return
+    if provider == "claude":
+        cached = _count(usage, "cache_read_input_tokens")
+        written = _count(usage, "cache_creation_input_tokens")
+        # Anthropic's input_tokens only counts what came after the last breakpoint
+        total = _count(usage, "input_tokens") + cached + written
+    elif provider == "gemini":
+        cached = _count(usage, "cached_content_token_count")
+        written = 0
+        total = _count(usage, "prompt_token_count")
+    else:
+        cached = _count(getattr(usage, "prompt_tokens_details", None), "cached_tokens")
+        written = 0
+        total = _count(usage, "prompt_tokens")
+    if not total:
+        return
+    metrics.increment("prompt_tokens_total", total)
+    metrics.increment("prompt_cached_tokens_total", cached)
+    metrics.increment(f"provider_{provider}_prompt_tokens_total", total)
+    metrics.increment(f"provider_{provider}_cached_tokens_total", cached)
+    if written:
+        metrics.increment("prompt_cache_write_tokens_total", written)
+
+
+class UsageStream:
+    """
+    Pass an OpenAI-compatible stream through, recording its final usage chunk
+
+    With stream_options={"include_usage": True} the last chunk carries the
+    usage and no choices; consumers already skip chunks without choices.
+    """
+
+    def __init__(self, upstream, provider):
+        self.upstream = upstream
+        self.provider = provider
+
+    def __iter__(self):
+        for chunk in self.upstream:
+            if getattr(chunk, "usage", None) is not None:
+                record_usage(self.provider, chunk.usage)
+            yield chunk
+
+    def close(self):
+        close_stream(self.upstream)
+
+
+def _chat_completion(ai_client, provider, model_name, messages, json_mode, stream):
+    """OpenAI-compatible chat completion (OpenAI and Ollama)"""
+    params = {
+        "model": model_name,
+        "messages": messages,
+        "stream": stream
+    }
+    if json_mode:
+        params["response_format"] = {"type": "json_object"}
+    if provider == "openai":
+        params["prompt_cache_key"] = prompt_cache_key(messages)
+    if stream:
+        params["stream_options"] = {"include_usage": True}
+        return UsageStream(ai_client.chat.completions.create(**params), provider)
+    response = ai_client.chat.completions.create(**params)
+    record_usage(provider, getattr(response, "usage", None))
+    return response
+
+
+def call_ai_model(messages, json_mode=False, stream=False,
+                  provider=None, model_name=None, ai_client=None):
+    """
+    Universal function to call any AI model
+
+    provider, model_name and ai_client default to the globally selected model;
+    pass them to call a specific provider (e.g. a fallback route).
+    """
+    provider = provider or MODEL_PROVIDER
+    model_name = model_name or MODEL_NAME
+    ai_client = ai_client or client
+    if provider == "openai":
+        return _chat_completion(ai_client, provider, model_name, messages, json_mode, stream)
+
+    elif provider == "gemini":
         # Convert messages to Gemini format
         generation_config = {}
         if json_mode:
@@ -159,8 +304,8 @@ def call_ai_model(messages, json_mode=False, stream=False):
                 "response_mime_type": "application/json"
             }
 
-        model = client.GenerativeModel(
-            MODEL_NAME,
+        model = ai_client.GenerativeModel(
+            model_name,
             generation_config=generation_config
         )
 
@@ -168,6 +313,7 @@ def call_ai_model(messages, json_mode=False, stream=False):
             [f"{msg['role']}: {msg['content']}" for msg in messages])
 
         response = model.generate_content(prompt)
+        record_usage(provider, getattr(response, "usage_metadata", None))
 
         # Create OpenAI-compatible response object
         class GeminiResponse:
@@ -183,17 +329,13 @@ def call_ai_model(messages, json_mode=False, stream=False):
                 self.choices = [self.Choice(content)]
         return GeminiResponse(response.text)
 
-    elif MODEL_PROVIDER == "ollama":
-        params = {
-            "model": MODEL_NAME,
-            "messages": messages,
-            "stream": stream
-        }
-        if json_mode:
-            params["response_format"] = {"type": "json_object"}
-        return client.chat.completions.create(**params)
+    elif provider == "ollama":
+        # Keeps the model loaded (see ollama_lifecycle); Ollama reuses its KV
+        # cache for a repeated prefix on its own
+        get_ollama_lifecycle().touch(model_name)
+        return _chat_completion(ai_client, provider, model_name, messages, json_mode, stream)
 
-    elif MODEL_PROVIDER == "claude":
+    elif provider == "claude":
         # Anthropic Claude API
         # Extract system message and user messages separately
         system_content = ""
@@ -209,12 +351,20 @@ def call_ai_model(messages, json_mode=False, stream=False):
         if json_mode and system_content:
             system_content += "\n\nYou MUST respond with valid JSON only. No other text."
 
+        # Mark the system prompt as a cache breakpoint so repeated calls
+        # read it from Anthropic's prompt cache
+        system_blocks = [{
+            "type": "text",
+            "text": system_content,
+            "cache_control": {"type": "ephemeral"}
+        }] if system_content else None
+
         if stream:
             # Streaming mode
-            stream_response = client.messages.stream(
-                model=MODEL_NAME,
+            stream_response = ai_client.messages.stream(
+                model=model_name,
                 max_tokens=4096,
-                system=system_content if system_content else None,
+                system=system_blocks,
                 messages=user_messages
             )
 
@@ -222,10 +372,21 @@ def call_ai_model(messages, json_mode=False, stream=False):
             class ClaudeStreamWrapper:
                 def __init__(self, claude_stream):
                     self.claude_stream = claude_stream
+                    self.active_stream = None
+                    self.closed = False
+
+                def close(self):
+                    """Close the underlying HTTP stream (safe from another thread)"""
+                    self.closed = True
+                    if self.active_stream is not None:
+                        self.active_stream.close()
 
                 def __iter__(self):
                     with self.claude_stream as stream:
+                        self.active_stream = stream
                         for text in stream.text_stream:
+                            if self.closed:
+                                break
                             # Create OpenAI-compatible chunk
                             class Chunk:
                                 class Choice:
@@ -239,14 +400,16 @@ def call_ai_model(messages, json_mode=False, stream=False):
                                 def __init__(self, content):
                                     self.choices = [self.Choice(content)]
                             yield Chunk(text)
+                        if not self.closed:
+                            record_usage("claude", stream.get_final_message().usage)
 
             return ClaudeStreamWrapper(stream_response)
         else:
             # Non-streaming mode
-            response = client.messages.create(
-                model=MODEL_NAME,
+            response = ai_client.messages.create(
+                model=model_name,
                 max_tokens=4096,
-                system=system_content if system_content else None,
+                system=system_blocks,
                 messages=user_messages
             )
 
@@ -263,36 +426,300 @@ def call_ai_model(messages, json_mode=False, stream=False):
                 def __init__(self, content):
                     self.choices = [self.Choice(content)]
 
+            record_usage(provider, getattr(response, "usage", None))
             return ClaudeResponse(response.content[0].text)
 
 
-def select_relevant_links(url):
+# Default model per provider (as offered in initialize_model and the web UI)
+DEFAULT_MODELS = {
+    "openai": "gpt-5.1",
+    "gemini": "gemini-2.0-flash",
+    "ollama": "deepseek-r1",
+    "claude": "claude-sonnet-4.5",
+}
+
+
+def create_client(provider, model_name=None):
+    """
+    Build a client for provider without touching the global selection
+
+    Returns:
+        tuple: (model_name, client)
+    """
+    model_name = model_name or DEFAULT_MODELS[provider]
+    if provider == "openai":
+        return model_name, OpenAI()
+    elif provider == "gemini":
+        import google.generativeai as genai
+        genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
+        return model_name, genai
+    elif provider == "ollama":
+        return model_name, OpenAI(base_url=f"{ollama_base_url()}/v1", api_key="ollama")
+    elif provider == "claude":
+        from anthropic import Anthropic
+        return model_name, Anthropic(api_key=os.getenv('ANTHROPIC_API_KEY'))
+    raise ValueError(f"Unknown provider: {provider}")
+
+
+class TextStream:
+    """
+    Iterate the text pieces of a streamed completion
+
+    close() aborts the upstream response and is safe to call from another
+    thread while iteration is in progress.
+    """
+
+    def __init__(self, upstream):
+        self.upstream = upstream
+        self.closed = False
+
+    def __iter__(self):
+        for chunk in self.upstream:
+            if self.closed:
+                break
+            if isinstance(chunk, str):
+                if chunk:
+                    yield chunk
+            elif chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    def close(self):
+        self.closed = True
+        close_stream(self.upstream)
+
+
+GEMINI_CHUNK_SIZE = 50
+
+
+def stream_completion(messages, json_mode=False, provider=None, model_name=None, ai_client=None):
+    """
+    Start a completion and return it as a TextStream, whatever the provider
+
+    Gemini is called without streaming and its answer is split into chunks.
+    """
+    provider = provider or MODEL_PROVIDER
+    if provider == "gemini":
+        response = call_ai_model(messages, json_mode, provider=provider,
+                                 model_name=model_name, ai_client=ai_client)
+        text = response.choices[0].message.content
+        return TextStream([text[i:i + GEMINI_CHUNK_SIZE]
+                           for i in range(0, len(text), GEMINI_CHUNK_SIZE)])
+    return TextStream(call_ai_model(messages, json_mode, stream=True, provider=provider,
+                                    model_name=model_name, ai_client=ai_client))
+
+
+def select_relevant_links(url, page_links=None):
     print(
         f"Selecting relevant links for {url} by calling {MODEL_PROVIDER.upper()} {MODEL_NAME}")
     response = call_ai_model(
-        messages=[
-            {"role": "system", "content": link_system_prompt},
-            {"role": "user", "content": get_links_user_prompt(url)}
-        ],
+        messages=build_messages(link_system_prompt, get_links_user_prompt(url, page_links)),
         json_mode=True
     )
     result = response.choices[0].message.content
-    links = json.loads(result)
+    try:
+        links, repaired = parse_links(result, base_url=url)
+    except StructuredOutputError as e:
+        # Better a brochure from the landing page alone than a failed request
+        metrics.increment("link_selection_parse_failed_total")
+        print(f"⚠️ Could not parse link selection ({e}); using landing page only")
+        return {"links": []}
+    if repaired:
+        metrics.increment("link_selection_repaired_total")
     print(f"Found {len(links['links'])} relevant links")
     return links
 
 
+def stream_relevant_links(url, page_links=None):
+    """
+    Yield relevant links one by one while the model is still writing its answer
+
+    The JSON-mode response is streamed through LinkStreamParser, so each
+    {"type", "url"} entry can be handed to the page-fetch stage as soon as its
+    closing brace arrives. Gemini has no streaming here and falls back to
+    select_relevant_links.
+    """
+    if MODEL_PROVIDER == "gemini":
+        yield from select_relevant_links(url, page_links)["links"]
+        return
+
+    print(
+        f"Streaming relevant links for {url} from {MODEL_PROVIDER.upper()} {MODEL_NAME}")
+    stream = call_ai_model(
+        messages=build_messages(link_system_prompt, get_links_user_prompt(url, page_links)),
+        json_mode=True,
+        stream=True
+    )
+    parser = LinkStreamParser(base_url=url)
+    parts = []
+    try:
+        for chunk in stream:
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            content = chunk.choices[0].delta.content
+            parts.append(content)
+            yield from parser.feed(content)
+    finally:
+        close_stream(stream)
+
+    if parser.links:
+        print(f"Found {len(parser.links)} relevant links")
+        return
+    # Nothing complete was streamed; try repairing the full response instead
+    try:
+        links, _ = parse_links("".join(parts), base_url=url)
+    except StructuredOutputError as e:
+        metrics.increment("link_selection_parse_failed_total")
+        print(f"⚠️ Could not parse link selection ({e}); using landing page only")
+        return
+    metrics.increment("link_selection_repaired_total")
+    print(f"Found {len(links['links'])} relevant links")
+    yield from links["links"]
+
+
+def iter_relevant_links(url, page_links=None):
+    """
+    Relevant links for url, streamed when BRANDBOOK_STREAM_LINK_SELECTION is on
+
+    page_links are the landing page's links when the caller already fetched
+    it; otherwise the page is downloaded for them.
+
+    Sites with a sitemap listing about/careers/company pages are served from
+    it without parsing the landing page's links or calling the model.
+    Otherwise selections are memoized by a fingerprint of the page's link
+    set, the model and the link prompt; an unchanged link set needs no
+    model call.
+    """
+    discovered = discover_relevant_links(url)
+    if discovered:
+        return iter(discovered)
+    if page_links is None:
+        page_links = fetch_website_links(url)
+    key = link_selection_key(url, page_links, MODEL_PROVIDER, MODEL_NAME, link_system_prompt)
+    cache = get_link_cache()
+    cached = cache.get(key)
+    if cached is not None:
+        metrics.increment("link_selection_cache_hits_total")
+        return iter(cached)
+    metrics.increment("link_selection_cache_misses_total")
+    if STREAM_LINK_SELECTION:
+        return _remember_selection(cache, key, stream_relevant_links(url, page_links))
+    links = select_relevant_links(url, page_links)["links"]
+    if links:
+        cache.put(key, links)
+    return iter(links)
+
+
+def _remember_selection(cache, key, links):
+    """Pass streamed links through and cache them once the selection completed"""
+    selected = []
+    try:
+        for link in links:
+            selected.append(link)
+            yield link
+    finally:
+        close = getattr(links, "close", None)
+        if close is not None:
+            close()
+    # Not reached when the consumer stopped early; empty results are retried
+    if selected:
+        cache.put(key, selected)
+
+
 # Second step: make the brochure!
-def fetch_page_and_all_relevant_links(url):
-    contents = fetch_website_contents(url)
-    relevant_links = select_relevant_links(url)
-    result = f"## Landing Page:\n\n{contents}\n## Relevant Links:\n"
-    for link in relevant_links['links']:
-        result += f"\n\n### Link: {link['type']}\n"
-        result += fetch_website_contents(link["url"])
+LANDING_PAGE = "landing page"
+
+
+def fetch_page_record(url, page_type, previous=None):
+    """
+    Fetch one page as a record (url, type, content, fingerprint, validators)
+
+    With the previous record for the same URL the request is conditional, and
+    a 304 Not Modified reuses the previous content without downloading it.
+    """
+    return page_record(revalidate_page(url, previous), page_type)
+
+
+def revalidate_page(url, previous=None):
+    """fetch_page, conditional on the previous record and filled in from it on a 304"""
+    if previous is None:
+        return fetch_page(url)
+    page = fetch_page(url, previous.get("etag"), previous.get("last_modified"))
+    if page["not_modified"]:
+        page["content"] = previous["content"]
+        page["fingerprint"] = previous["fingerprint"]
+    return page
+
+
+def page_record(page, page_type):
+    """The cached record of a fetched page (its links are not kept)"""
+    return {
+        "url": page["url"],
+        "type": page_type,
+        "content": page["content"],
+        "fingerprint": page["fingerprint"],
+        "etag": page["etag"],
+        "last_modified": page["last_modified"],
+    }
+
+
+def collect_pages(url, cancel_event=None, previous_pages=None):
+    """
+    Fetch the landing page and its relevant links as page records
+
+    previous_pages are the records from the last run for this site. When the
+    landing page fingerprint still matches, the earlier link selection is
+    reused (no LLM call) and every page is revalidated conditionally.
+    """
+    previous_pages = previous_pages or []
+    previous = {page["url"]: page for page in previous_pages[1:]}
+    previous_landing = previous_pages[0] if previous_pages else None
+
+    check_cancelled(cancel_event)
+    landing_page = revalidate_page(url, previous_landing)
+    landing = page_record(landing_page, LANDING_PAGE)
+    check_cancelled(cancel_event)
+
+    if previous_landing is not None and landing["fingerprint"] == previous_landing["fingerprint"]:
+        links = [{"type": page["type"], "url": page["url"]} for page in previous_pages[1:]]
+    else:
+        # Link selection reuses the landing page just parsed, not a second download
+        links = iter_relevant_links(url, landing_page["links"])
+
+    # Each link is fetched as soon as it is known, in parallel with the rest
+    # of the link selection; pages keep the order the links were chosen in
+    pool = ThreadPoolExecutor(max_workers=LINK_FETCH_WORKERS)
+    futures = []
+    try:
+        for link in links:
+            check_cancelled(cancel_event)
+            futures.append(pool.submit(
+                fetch_page_record, link["url"], link["type"], previous.get(link["url"])))
+        pages = [landing]
+        for future in futures:
+            check_cancelled(cancel_event)
+            pages.append(future.result())
+        return pages
+    finally:
+        close = getattr(links, "close", None)
+        if close is not None:
+            close()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def pack_pages(pages):
+    """Lay out page records as the landing page followed by each relevant link"""
+    landing, links = pages[0], pages[1:]
+    result = f"## Landing Page:\n\n{landing['content']}\n## Relevant Links:\n"
+    for page in links:
+        result += f"\n\n### Link: {page['type']}\n"
+        result += page["content"]
     return result
 
 
+def fetch_page_and_all_relevant_links(url, cancel_event=None):
+    return pack_pages(collect_pages(url, cancel_event))
+
+
 brochure_system_prompt = """
 You are an assistant that analyzes the contents of several relevant pages from a company website
 and creates a short brochure about the company for prospective customers, investors and recruits.
@@ -310,59 +737,146 @@ Include details of company culture, customers and careers/jobs if you have the i
 # """
 
 
-def get_brochure_user_prompt(company_name, url):
+def build_brochure_user_prompt(company_name, packed_pages):
+    # Fixed instructions first, company data after them (see build_messages)
     user_prompt = f"""
-You are looking at a company called: {company_name}
-Here are the contents of its landing page and other relevant pages;
-use this information to build a short brochure of the company in markdown without code blocks.\n\n
+Here are the contents of a company's landing page and other relevant pages;
+use this information to build a short brochure of the company in markdown without code blocks.
+You are looking at a company called: {company_name}\n\n
 """
-    user_prompt += fetch_page_and_all_relevant_links(url)
+    user_prompt += packed_pages
     user_prompt = user_prompt[:5_000]  # Truncate if more than 5,000 characters
     return user_prompt
 
 
+def get_brochure_user_prompt(company_name, url, cancel_event=None):
+    return build_brochure_user_prompt(
+        company_name, fetch_page_and_all_relevant_links(url, cancel_event))
+
+
+def refresh_brochure(company_name, url, cache, cancel_event=None):
+    """
+    Bring the cached brochure for company/url up to date (non-streaming)
+
+    Pages are revalidated against the last run; when no fingerprint changed
+    the existing brochure is kept, otherwise it is regenerated from the
+    re-packed pages.
+
+    Returns:
+        tuple: (cache entry, regenerated: bool)
+    """
+    entry = cache.get(company_name, url)
+    pages = collect_pages(url, cancel_event, entry["pages"] if entry else None)
+    if entry is not None and pages_fingerprint(pages) == entry["fingerprint"]:
+        return cache.revalidate(entry, pages), False
+
+    check_cancelled(cancel_event)
+    response = call_ai_model(
+        messages=build_messages(brochure_system_prompt, build_brochure_user_prompt(
+            company_name, pack_pages(pages)))
+    )
+    return cache.put(company_name, url, response.choices[0].message.content, pages), True
+
+
 def create_brochure(company_name, url):
     response = call_ai_model(
-        messages=[
-            {"role": "system", "content": brochure_system_prompt},
-            {"role": "user", "content": get_brochure_user_prompt(
-                company_name, url)}
-        ]
+        messages=build_messages(brochure_system_prompt, get_brochure_user_prompt(
+            company_name, url))
     )
     result = response.choices[0].message.content
     display(Markdown(result))
 
 
-def stream_brochure(company_name, url):
-    """Stream brochure with typewriter animation"""
-    if MODEL_PROVIDER == "gemini":
-        # Gemini doesn't support streaming in the same way, so we'll just display the full result
-        print("Note: Streaming not available for Gemini, generating full response...")
-        create_brochure(company_name, url)
-        return
+RENDER_INTERVAL = 0.1
 
-    stream = call_ai_model(
-        messages=[
-            {"role": "system", "content": brochure_system_prompt},
-            {"role": "user", "content": get_brochure_user_prompt(
-                company_name, url)}
-        ],
-        stream=True
-    )
-    response = ""
-    display_handle = display(Markdown(""), display_id=True)
 
-    # Check if display_handle has display_id (might be None in some environments)
-    if display_handle and hasattr(display_handle, 'display_id') and display_handle.display_id:
-        for chunk in stream:
-            response += chunk.choices[0].delta.content or ''
-            update_display(Markdown(response),
-                           display_id=display_handle.display_id)
-    else:
-        # Fallback for environments where display_id doesn't work
-        for chunk in stream:
-            response += chunk.choices[0].delta.content or ''
-        display(Markdown(response))
+class MarkdownBlocks:
+    """
+    Split streamed markdown into settled blocks and a live tail
+
+    A block settles at a blank line outside a code fence; from then on it
+    never changes, so only the (short) tail needs re-rendering as text
+    arrives and the cost per chunk does not grow with the brochure.
+    """
+
+    def __init__(self):
+        self.tail = ""
+        self._scan = 0
+        self._in_fence = False
+
+    def feed(self, text):
+        """Append streamed text; return the blocks it completed"""
+        self.tail += text
+        settled = []
+        while True:
+            newline = self.tail.find("\n", self._scan)
+            if newline == -1:
+                return settled
+            line = self.tail[self._scan:newline]
+            self._scan = newline + 1
+            if line.lstrip().startswith(("```", "~~~")):
+                self._in_fence = not self._in_fence
+            elif not line.strip() and not self._in_fence and self.tail[:newline].strip():
+                settled.append(self.tail[:self._scan])
+                self.tail = self.tail[self._scan:]
+                self._scan = 0
+
+
+def _in_notebook():
+    try:
+        from IPython import get_ipython
+    except ImportError:
+        return False
+    shell = get_ipython()
+    return shell is not None and shell.__class__.__name__ == "ZMQInteractiveShell"
+
+
+def stream_brochure(company_name, url):
+    """
+    Stream brochure with typewriter animation
+
+    In a notebook, finished markdown blocks are displayed once and only the
+    block being written is re-rendered, at most every RENDER_INTERVAL seconds.
+    In a terminal the text is written straight to stdout.
+
+    Returns:
+        str: The complete brochure
+    """
+    stream = stream_completion(build_messages(
+        brochure_system_prompt, get_brochure_user_prompt(company_name, url)))
+    parts = []
+    try:
+        if not _in_notebook():
+            for text in stream:
+                parts.append(text)
+                sys.stdout.write(text)
+                sys.stdout.flush()
+            return "".join(parts)
+
+        blocks = MarkdownBlocks()
+        tail_handle = display(Markdown(""), display_id=True)
+        if not (tail_handle and getattr(tail_handle, 'display_id', None)):
+            # Fallback for environments where display_id doesn't work
+            parts.extend(stream)
+            display(Markdown("".join(parts)))
+            return "".join(parts)
+
+        last_render = 0.0
+        for text in stream:
+            parts.append(text)
+            for block in blocks.feed(text):
+                # Freeze the finished block and start a new live one below it
+                tail_handle.update(Markdown(block))
+                tail_handle = display(Markdown(""), display_id=True)
+                last_render = 0.0
+            now = time.monotonic()
+            if now - last_render >= RENDER_INTERVAL:
+                tail_handle.update(Markdown(blocks.tail))
+                last_render = now
+        tail_handle.update(Markdown(blocks.tail))
+        return "".join(parts)
+    finally:
+        stream.close()
 
 
 # Example usage:
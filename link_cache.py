@@ -0,0 +1,152 @@
+"""
+Link Cache Module
+Memoized link selection keyed by a fingerprint of a page's link set
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urldefrag, urljoin
+
+DEFAULT_MAX_ENTRIES = 10_000
+# Sitemap discovery results (found pages or "none") are reused this long
+DEFAULT_DISCOVERY_TTL = 24 * 60 * 60
+
+
+def normalize_links(url, links):
+    """Absolute, fragment-free, de-duplicated and sorted version of a page's links"""
+    normalized = set()
+    for link in links:
+        link = link.strip()
+        if link:
+            normalized.add(urldefrag(urljoin(url, link))[0])
+    return sorted(normalized)
+
+
+def link_selection_key(url, links, provider, model_name, system_prompt):
+    """
+    Fingerprint of everything a link selection depends on
+
+    Relative links are resolved against url, so two sites with the same
+    navigation still get different keys; a new model or prompt does too.
+    """
+    prompt_hash = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+    digest = hashlib.sha256(f"{provider}\t{model_name}\t{prompt_hash}\n".encode("utf-8"))
+    for link in normalize_links(url, links):
+        digest.update(link.encode("utf-8"))
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def discovery_key(site):
+    """Cache key of a site's sitemap discovery result"""
+    return hashlib.sha256(f"sitemap\t{site}".encode("utf-8")).hexdigest()
+
+
+class LinkSelectionCache:
+    """
+    Selected links ({"type", "url"} dicts) by link_selection_key
+
+    Entries are kept in memory (LRU, max_entries) and, when directory is set,
+    written as one JSON file per key. Keys are content hashes, so an entry
+    never changes and processes can share the directory freely. Sitemap
+    discovery results are stored alongside, per site, for discovery_ttl
+    seconds.
+    """
+
+    def __init__(self, directory=None, max_entries=DEFAULT_MAX_ENTRIES,
+                 discovery_ttl=DEFAULT_DISCOVERY_TTL):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.discovery_ttl = discovery_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, key):
+        """Return the cached links for key, or None"""
+        with self._lock:
+            links = self._entries.get(key)
+            if links is not None:
+                self._entries.move_to_end(key)
+                return links
+        links = self._load(key)
+        if links is not None:
+            self._remember(key, links)
+        return links
+
+    def put(self, key, links):
+        self._remember(key, links)
+        if self.directory:
+            path = self._path(key)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as handle:
+                json.dump(links, handle)
+            os.replace(tmp_path, path)
+
+    def get_discovery(self, site):
+        """
+        Memoized sitemap discovery for site
+
+        Returns:
+            list or None: the pages found ([] when the site had no usable
+            sitemap), or None when unknown or older than discovery_ttl
+        """
+        entry = self.get(discovery_key(site))
+        if entry is None or time.time() - entry["at"] > self.discovery_ttl:
+            return None
+        return entry["links"]
+
+    def put_discovery(self, site, links):
+        self.put(discovery_key(site), {"links": links, "at": time.time()})
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remember(self, key, links):
+        with self._lock:
+            self._entries[key] = links
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _load(self, key):
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(key), encoding="utf-8") as handle:
+                return json.load(handle)
+        except (OSError, ValueError):
+            return None
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+
+_shared_lock = threading.Lock()
+_shared_cache = None
+
+
+def get_link_cache():
+    """
+    Return the shared LinkSelectionCache
+
+    BRANDBOOK_LINK_CACHE_DIR enables on-disk persistence,
+    BRANDBOOK_LINK_CACHE_SIZE sets how many selections are kept in memory and
+    BRANDBOOK_SITEMAP_TTL how long sitemap discovery results are reused.
+    """
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            size = os.getenv("BRANDBOOK_LINK_CACHE_SIZE")
+            ttl = os.getenv("BRANDBOOK_SITEMAP_TTL")
+            _shared_cache = LinkSelectionCache(
+                directory=os.getenv("BRANDBOOK_LINK_CACHE_DIR") or None,
+                max_entries=int(size) if size else DEFAULT_MAX_ENTRIES,
+                discovery_ttl=int(ttl) if ttl else DEFAULT_DISCOVERY_TTL,
+            )
+        return _shared_cache
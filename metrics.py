@@ -0,0 +1,61 @@
+"""
+Metrics Module
+Lightweight in-process counters and gauges for the BrandBook pipeline
+"""
+
+import threading
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+
+
+def increment(name, value=1):
+    """
+    Increase a monotonic counter
+
+    Args:
+        name: Counter name (e.g. "brochure_cancelled_total")
+        value: Amount to add
+    """
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def set_gauge(name, value):
+    """
+    Set a gauge to an absolute value
+
+    Args:
+        name: Gauge name (e.g. "brochure_in_flight")
+        value: Current value
+    """
+    with _lock:
+        _gauges[name] = value
+
+
+def adjust_gauge(name, delta):
+    """
+    Move a gauge up or down by delta and return the new value
+    """
+    with _lock:
+        _gauges[name] = _gauges.get(name, 0) + delta
+        return _gauges[name]
+
+
+def snapshot():
+    """
+    Return a copy of all counters and gauges
+
+    Returns:
+        dict: {"counters": {...}, "gauges": {...}}
+    """
+    with _lock:
+        return {"counters": dict(_counters), "gauges": dict(_gauges)}
+
+
+def reset():
+    """Clear all metrics (used by tests)"""
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
@@ -0,0 +1,179 @@
+"""
+Ollama Lifecycle Module
+Warm-up, keep-alive and load-time tracking for models served by a local Ollama
+"""
+
+import asyncio
+import os
+import threading
+import time
+
+import requests
+
+import metrics
+
+DEFAULT_BASE_URL = "http://localhost:11434"
+# How long a model stays loaded after its last use (seconds, -1 = forever)
+DEFAULT_KEEP_ALIVE = 30 * 60
+# Ollama unloads a model OLLAMA_KEEP_ALIVE (5 minutes by default) after each
+# chat request, so the keep-alive is renewed well within that
+RENEW_INTERVAL = 120.0
+DEFAULT_WARMUP_TIMEOUT = 300.0
+# A warm-up whose load took longer than this found the model unloaded
+COLD_LOAD_SECONDS = 1.0
+
+
+def ollama_base_url():
+    """Ollama server URL from OLLAMA_HOST (as the ollama CLI reads it)"""
+    host = os.getenv("OLLAMA_HOST") or DEFAULT_BASE_URL
+    if "://" not in host:
+        host = f"http://{host}"
+    return host.rstrip("/")
+
+
+class OllamaLifecycle:
+    """
+    Keep the models BrandBook uses loaded in a local Ollama server
+
+    warm_up() loads a model ahead of the first request, timing the load.
+    touch() is called for every completion; run() then renews the model's
+    keep-alive until keep_alive seconds after its last use, so a model in
+    use is never unloaded between requests and an idle one still is.
+    """
+
+    def __init__(self, base_url=None, keep_alive=DEFAULT_KEEP_ALIVE,
+                 renew_interval=RENEW_INTERVAL, timeout=DEFAULT_WARMUP_TIMEOUT):
+        self.base_url = base_url or ollama_base_url()
+        self.keep_alive = keep_alive
+        self.renew_interval = renew_interval
+        self.timeout = timeout
+        self._last_used = {}
+        self._warm = set()
+        self._lock = threading.Lock()
+
+    def warm_up(self, model, keep_alive=None):
+        """
+        Load model (a no-op on the server when it is already loaded)
+
+        Returns:
+            float: Seconds the server spent loading the model
+        """
+        started = time.perf_counter()
+        # A generate request without a prompt only loads the model
+        response = requests.post(
+            f"{self.base_url}/api/generate",
+            json={"model": model,
+                  "keep_alive": self.keep_alive if keep_alive is None else keep_alive},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        elapsed = time.perf_counter() - started
+        load_seconds = response.json().get("load_duration", 0) / 1e9
+        with self._lock:
+            self._warm.add(model)
+            self._last_used.setdefault(model, time.time())
+        metrics.increment("ollama_warmups_total")
+        metrics.set_gauge("ollama_warmup_ms", round(elapsed * 1000))
+        if load_seconds >= COLD_LOAD_SECONDS:
+            metrics.increment("ollama_cold_loads_total")
+            metrics.set_gauge("ollama_load_ms", round(load_seconds * 1000))
+        return load_seconds
+
+    def touch(self, model):
+        """Record that model was just used for a completion"""
+        with self._lock:
+            self._last_used[model] = time.time()
+
+    def renewals(self, now=None):
+        """
+        Models whose keep-alive should be renewed, with the seconds left
+
+        Returns:
+            list: (model, keep_alive) pairs
+        """
+        now = now or time.time()
+        due = []
+        with self._lock:
+            for model, last_used in list(self._last_used.items()):
+                if self.keep_alive < 0:
+                    due.append((model, -1))
+                    continue
+                remaining = last_used + self.keep_alive - now
+                if remaining > 0:
+                    due.append((model, round(remaining)))
+                else:
+                    # Let the server unload it; the next use warms it again
+                    del self._last_used[model]
+                    self._warm.discard(model)
+        return due
+
+    def maintain(self, selected=None):
+        """Warm up the selected model if needed and renew recent models' keep-alive"""
+        with self._lock:
+            cold = selected is not None and selected not in self._warm
+        if cold:
+            self.warm_up(selected)
+        for model, keep_alive in self.renewals():
+            if model != selected or not cold:
+                self.warm_up(model, keep_alive)
+
+    async def run(self, selected):
+        """
+        Keep-alive loop
+
+        selected() returns the Ollama model currently selected, or None when
+        another provider is in use.
+        """
+        while True:
+            await asyncio.sleep(self.renew_interval)
+            try:
+                await asyncio.to_thread(self.maintain, selected())
+            except Exception as e:
+                metrics.increment("ollama_keep_alive_failed_total")
+                print(f"⚠️ Ollama keep-alive failed: {e}")
+
+
+def parallel_slots(default):
+    """
+    Concurrent Ollama requests one BrandBook worker should allow
+
+    OLLAMA_NUM_PARALLEL is how many requests the server runs at once; it is
+    shared by the BRANDBOOK_WORKERS worker processes. Extra requests would
+    only queue inside Ollama, where nobody can see or bound them.
+    """
+    parallel = os.getenv("OLLAMA_NUM_PARALLEL")
+    if not parallel:
+        return default
+    try:
+        slots = int(parallel)
+    except ValueError:
+        slots = 0
+    if slots < 1:
+        print(f"⚠️ Ignoring invalid OLLAMA_NUM_PARALLEL={parallel!r}; using {default} slots")
+        return default
+    workers = int(os.getenv("BRANDBOOK_WORKERS") or 1)
+    return max(1, slots // max(1, workers))
+
+
+_shared_lock = threading.Lock()
+_shared_lifecycle = None
+
+
+def get_ollama_lifecycle():
+    """
+    Return the shared OllamaLifecycle
+
+    OLLAMA_HOST sets the server, BRANDBOOK_OLLAMA_KEEP_ALIVE the seconds a
+    model stays loaded after its last use (-1 keeps it loaded) and
+    BRANDBOOK_OLLAMA_WARMUP_TIMEOUT how long a model load may take.
+    """
+    global _shared_lifecycle
+    with _shared_lock:
+        if _shared_lifecycle is None:
+            keep_alive = os.getenv("BRANDBOOK_OLLAMA_KEEP_ALIVE")
+            timeout = os.getenv("BRANDBOOK_OLLAMA_WARMUP_TIMEOUT")
+            _shared_lifecycle = OllamaLifecycle(
+                keep_alive=int(keep_alive) if keep_alive else DEFAULT_KEEP_ALIVE,
+                timeout=float(timeout) if timeout else DEFAULT_WARMUP_TIMEOUT,
+            )
+        return _shared_lifecycle
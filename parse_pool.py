@@ -0,0 +1,166 @@
+"""
+Parse Pool Module
+HTML parsing (raw bytes -> title, text, links), optionally in worker processes
+"""
+
+import codecs
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from bs4 import BeautifulSoup
+
+import metrics
+
+# How much of the body is searched for a <meta charset> declaration
+SNIFF_BYTES = 4096
+# Page text is cut to this many characters before it leaves the parser
+TEXT_LIMIT = 2_000
+# Pages smaller than this are parsed in-process: pickling and IPC cost more
+# than BeautifulSoup does on them
+DEFAULT_MIN_BYTES = 64 * 1024
+# Workers are recycled after this many pages to bound leaked parser memory
+TASKS_PER_WORKER = 500
+
+_META_CHARSET = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?\s*([a-zA-Z0-9_.:-]+)""", re.IGNORECASE)
+_BOMS = ((codecs.BOM_UTF8, "utf-8"), (codecs.BOM_UTF16_LE, "utf-16"), (codecs.BOM_UTF16_BE, "utf-16"))
+
+
+def detect_charset(content_type, head):
+    """
+    Pick the encoding from the Content-Type header, a BOM or a <meta> tag
+    in the first SNIFF_BYTES of the body, defaulting to UTF-8
+    """
+    for bom, encoding in _BOMS:
+        if head.startswith(bom):
+            return encoding
+    candidates = []
+    if content_type:
+        match = re.search(r"charset\s*=\s*[\"']?([^\s;\"']+)", content_type, re.IGNORECASE)
+        if match:
+            candidates.append(match.group(1))
+    match = _META_CHARSET.search(head[:SNIFF_BYTES])
+    if match:
+        candidates.append(match.group(1).decode("ascii"))
+    for candidate in candidates:
+        try:
+            return codecs.lookup(candidate).name
+        except LookupError:
+            continue
+    return "utf-8"
+
+
+def parse_document(body, content_type=None):
+    """
+    Parse an HTML document once into its title, visible text and links
+
+    Args:
+        body: Raw bytes (decoded with detect_charset) or already decoded text
+        content_type: Content-Type header of the response, if any
+
+    Returns:
+        dict: title, text (at most TEXT_LIMIT characters), links (hrefs in order)
+    """
+    if isinstance(body, bytes):
+        body = body.decode(detect_charset(content_type, body[:SNIFF_BYTES]), errors="replace")
+    soup = BeautifulSoup(body, "html.parser")
+    title = soup.title.string if soup.title and soup.title.string else "No title found"
+    links = [link.get("href") for link in soup.find_all("a")]
+    if soup.body:
+        for irrelevant in soup.body(["script", "style", "img", "input"]):
+            irrelevant.decompose()
+        text = soup.body.get_text(separator="\n", strip=True)[:TEXT_LIMIT]
+    else:
+        text = ""
+    return {"title": str(title), "text": text, "links": links}
+
+
+class ParsePool:
+    """
+    Parse pages in a pool of worker processes
+
+    Workers are long-lived (recycled every TASKS_PER_WORKER pages) so the
+    bs4 import is paid once per worker. At most max_pending pages are in
+    flight; further callers block until a slot frees up. Pages below
+    min_bytes, and every page after the pool broke, are parsed in-process.
+    """
+
+    def __init__(self, workers, max_pending=None, min_bytes=DEFAULT_MIN_BYTES):
+        self.workers = workers
+        self.min_bytes = min_bytes
+        self._slots = threading.BoundedSemaphore(max_pending or workers * 2)
+        # spawn: forking a server process that already runs threads is unsafe
+        self._executor = ProcessPoolExecutor(max_workers=workers,
+                                             mp_context=multiprocessing.get_context("spawn"),
+                                             max_tasks_per_child=TASKS_PER_WORKER)
+        self._broken = False
+
+    def parse(self, body, content_type=None):
+        """Same result as parse_document(body, content_type)"""
+        if self._broken or len(body) < self.min_bytes:
+            metrics.increment("parse_in_process_total")
+            return parse_document(body, content_type)
+        with self._slots:
+            metrics.adjust_gauge("parse_pool_pending", 1)
+            try:
+                result = self._executor.submit(parse_document, body, content_type).result()
+                metrics.increment("parse_pool_total")
+                return result
+            except BrokenProcessPool:
+                # A worker died (e.g. OOM-killed); keep serving in-process
+                self._broken = True
+                metrics.increment("parse_pool_broken_total")
+                return parse_document(body, content_type)
+            finally:
+                metrics.adjust_gauge("parse_pool_pending", -1)
+
+    def shutdown(self):
+        self._executor.shutdown(cancel_futures=True)
+
+
+_shared_lock = threading.Lock()
+_shared_pool = None
+
+
+def get_parse_pool():
+    """
+    Return the shared ParsePool, or None when process parsing is disabled
+
+    BRANDBOOK_PARSE_WORKERS enables it (0 or unset parses in-process),
+    BRANDBOOK_PARSE_QUEUE bounds the pages in flight and
+    BRANDBOOK_PARSE_MIN_BYTES sets the in-process threshold.
+    """
+    global _shared_pool
+    workers = int(os.getenv("BRANDBOOK_PARSE_WORKERS") or 0)
+    if workers <= 0:
+        return None
+    with _shared_lock:
+        if _shared_pool is None:
+            queue = os.getenv("BRANDBOOK_PARSE_QUEUE")
+            min_bytes = os.getenv("BRANDBOOK_PARSE_MIN_BYTES")
+            _shared_pool = ParsePool(
+                workers,
+                max_pending=int(queue) if queue else None,
+                min_bytes=int(min_bytes) if min_bytes else DEFAULT_MIN_BYTES,
+            )
+        return _shared_pool
+
+
+def shutdown_parse_pool():
+    """Stop the shared pool's workers (application shutdown)"""
+    global _shared_pool
+    with _shared_lock:
+        if _shared_pool is not None:
+            _shared_pool.shutdown()
+            _shared_pool = None
+
+
+def parse_page(body, content_type=None):
+    """Parse a page in the shared pool when enabled, otherwise in-process"""
+    pool = get_parse_pool()
+    if pool is None:
+        return parse_document(body, content_type)
+    return pool.parse(body, content_type)
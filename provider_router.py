@@ -0,0 +1,280 @@
+"""
+Provider Router Module
+Hedged streaming requests and failover across AI providers
+"""
+
+import os
+import queue
+import threading
+import time
+
+import generator
+import metrics
+
+DEFAULT_HEDGE_AFTER_MS = 1500
+EWMA_ALPHA = 0.3
+# A provider whose recent error rate is above this is tried last
+UNHEALTHY_ERROR_RATE = 0.5
+
+
+class Route:
+    """One provider/model pair with lazily created client and EWMA stats"""
+
+    def __init__(self, provider, model_name=None, client=None):
+        self.provider = provider
+        self.model_name = model_name or generator.DEFAULT_MODELS.get(provider)
+        self.client = client
+        self.ttft_ewma = None
+        self.error_ewma = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def name(self):
+        return f"{self.provider}:{self.model_name}"
+
+    @property
+    def healthy(self):
+        return self.error_ewma < UNHEALTHY_ERROR_RATE
+
+    def get_client(self):
+        with self._lock:
+            if self.client is None:
+                self.model_name, self.client = generator.create_client(
+                    self.provider, self.model_name)
+            return self.client
+
+    def record_first_token(self, seconds):
+        with self._lock:
+            self.ttft_ewma = seconds if self.ttft_ewma is None else (
+                EWMA_ALPHA * seconds + (1 - EWMA_ALPHA) * self.ttft_ewma)
+            self.error_ewma *= 1 - EWMA_ALPHA
+        metrics.set_gauge(f"provider_{self.provider}_ttft_ewma_ms", round(self.ttft_ewma * 1000))
+        metrics.set_gauge(f"provider_{self.provider}_error_ewma", round(self.error_ewma, 3))
+
+    def record_error(self):
+        with self._lock:
+            self.error_ewma = EWMA_ALPHA + (1 - EWMA_ALPHA) * self.error_ewma
+        metrics.increment(f"provider_{self.provider}_errors_total")
+        metrics.set_gauge(f"provider_{self.provider}_error_ewma", round(self.error_ewma, 3))
+
+    def stats(self):
+        return {
+            "provider": self.provider,
+            "model": self.model_name,
+            "ttft_ewma_ms": None if self.ttft_ewma is None else round(self.ttft_ewma * 1000),
+            "error_ewma": round(self.error_ewma, 3),
+            "healthy": self.healthy,
+        }
+
+
+class ProviderRouter:
+    """
+    Route a streamed completion over a primary provider and fallbacks
+
+    The primary is tried first unless it is unhealthy; healthy fallbacks are
+    ordered by their time-to-first-token EWMA. If no token has arrived after
+    hedge_after_ms, the next route is started in parallel and whichever
+    streams first wins (the other is closed). An attempt that fails before
+    its first token fails over to the next route immediately.
+    """
+
+    def __init__(self, fallbacks, hedge_after_ms=DEFAULT_HEDGE_AFTER_MS):
+        self.hedge_after_ms = hedge_after_ms
+        # One Route (and one set of stats) per provider/model, whether it is
+        # used as the primary, a fallback or both
+        self._routes = {}
+        self.fallbacks = []
+        for route in fallbacks:
+            route = self._routes.setdefault((route.provider, route.model_name), route)
+            if route not in self.fallbacks:
+                self.fallbacks.append(route)
+
+    def route_for(self, provider, model_name, client=None):
+        """Return the stats-carrying Route for provider/model"""
+        model_name = model_name or generator.DEFAULT_MODELS.get(provider)
+        key = (provider, model_name)
+        if key not in self._routes:
+            self._routes[key] = Route(provider, model_name, client)
+        route = self._routes[key]
+        if client is not None:
+            route.client = client
+        return route
+
+    def plan(self):
+        """Routes in the order they will be tried"""
+        primary = self.route_for(generator.MODEL_PROVIDER, generator.MODEL_NAME, generator.client)
+        fallbacks = [route for route in self.fallbacks if route is not primary]
+        fallbacks.sort(key=lambda route: (
+            not route.healthy,
+            route.ttft_ewma if route.ttft_ewma is not None else float("inf")))
+        if primary.healthy:
+            return [primary] + fallbacks
+        return fallbacks + [primary]
+
+    def stream(self, messages, json_mode=False):
+        """Return a HedgedStream of text pieces for messages"""
+        return HedgedStream(self.plan(), messages, json_mode, self.hedge_after_ms / 1000)
+
+    def stats(self):
+        """EWMA stats of every primary and fallback route seen so far"""
+        return [route.stats() for route in list(self._routes.values())]
+
+
+class _Attempt:
+    def __init__(self, route):
+        self.route = route
+        self.stream = None
+        self.cancelled = False
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            stream = self.stream
+        if stream is not None:
+            stream.close()
+
+
+class HedgedStream:
+    """
+    Iterable of text pieces from whichever route streams first; close() aborts all
+
+    close() may be called from another thread while the consumer waits for
+    the next piece; the consumer's iteration then simply ends.
+    """
+
+    def __init__(self, routes, messages, json_mode, hedge_after):
+        self.routes = list(routes)
+        self.messages = messages
+        self.json_mode = json_mode
+        self.hedge_after = hedge_after
+        self.winner = None
+        self._events = queue.Queue()
+        self._attempts = []
+        self._closed = False
+
+    def __iter__(self):
+        pending = list(self.routes)
+        self._launch(pending.pop(0))
+        live = 1
+        hedge_at = time.monotonic() + self.hedge_after if self.hedge_after > 0 else None
+        last_error = None
+
+        # Race: wait for the first token from any attempt
+        while self.winner is None:
+            timeout = None
+            if pending and hedge_at is not None:
+                timeout = max(0.0, hedge_at - time.monotonic())
+            try:
+                attempt, kind, payload = self._events.get(timeout=timeout)
+            except queue.Empty:
+                if self._closed:
+                    return
+                metrics.increment("router_hedges_total")
+                self._launch(pending.pop(0))
+                live += 1
+                hedge_at = None
+                continue
+            if self._closed:
+                return
+            if attempt.cancelled:
+                continue
+            if kind == "error":
+                live -= 1
+                last_error = payload
+                if live == 0:
+                    if not pending:
+                        raise last_error
+                    metrics.increment("router_failovers_total")
+                    self._launch(pending.pop(0))
+                    live += 1
+                continue
+            self.winner = attempt
+            for other in self._attempts:
+                if other is not attempt:
+                    other.cancel()
+            if attempt is not self._attempts[0]:
+                metrics.increment("router_fallback_wins_total")
+            if kind == "done":
+                return
+            yield payload
+
+        # Stream the winner to the end
+        while True:
+            attempt, kind, payload = self._events.get()
+            if self._closed:
+                return
+            if attempt is not self.winner:
+                continue
+            if kind == "text":
+                yield payload
+            elif kind == "done":
+                return
+            else:
+                raise payload
+
+    def close(self):
+        self._closed = True
+        for attempt in self._attempts:
+            attempt.cancel()
+        # Cancelled attempts post nothing; wake a consumer blocked on the queue
+        self._events.put((None, "closed", None))
+
+    def _launch(self, route):
+        attempt = _Attempt(route)
+        self._attempts.append(attempt)
+        threading.Thread(target=self._run, args=(attempt,), daemon=True).start()
+
+    def _run(self, attempt):
+        route = attempt.route
+        try:
+            stream = generator.stream_completion(
+                self.messages, self.json_mode, provider=route.provider,
+                model_name=route.model_name, ai_client=route.get_client())
+            with attempt.lock:
+                attempt.stream = stream
+                cancelled = attempt.cancelled
+            if cancelled:
+                stream.close()
+                return
+            first = True
+            for text in stream:
+                if attempt.cancelled:
+                    return
+                if first:
+                    route.record_first_token(time.monotonic() - attempt.started)
+                    first = False
+                self._events.put((attempt, "text", text))
+            self._events.put((attempt, "done", None))
+        except Exception as e:
+            if not attempt.cancelled:
+                route.record_error()
+                self._events.put((attempt, "error", e))
+
+
+def parse_routes(spec):
+    """'claude,ollama:deepseek-r1' -> [Route('claude'), Route('ollama', 'deepseek-r1')]"""
+    routes = []
+    for item in spec.split(","):
+        item = item.strip()
+        if item:
+            provider, _, model_name = item.partition(":")
+            routes.append(Route(provider.strip(), model_name.strip() or None))
+    return routes
+
+
+def router_from_env():
+    """
+    Build a ProviderRouter from BRANDBOOK_FALLBACK_PROVIDERS, or None when unset
+
+    BRANDBOOK_HEDGE_AFTER_MS sets the hedging delay (0 = failover only).
+    """
+    spec = os.getenv("BRANDBOOK_FALLBACK_PROVIDERS")
+    if not spec:
+        return None
+    hedge_after = os.getenv("BRANDBOOK_HEDGE_AFTER_MS")
+    return ProviderRouter(
+        parse_routes(spec),
+        hedge_after_ms=float(hedge_after) if hedge_after else DEFAULT_HEDGE_AFTER_MS,
+    )
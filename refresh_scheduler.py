@@ -0,0 +1,207 @@
+"""
+Refresh Scheduler Module
+Background revalidation of popular brochures (stale-while-revalidate)
+"""
+
+import asyncio
+import math
+import os
+import threading
+import time
+
+import metrics
+from admission import AdmissionRejectedError, admit
+from brochure_cache import cache_key
+
+DEFAULT_INTERVAL = 60.0
+DEFAULT_BUDGET = 10
+DEFAULT_MAX_STALE = 7 * 24 * 60 * 60
+# Entries this far into their TTL are refreshed ahead of expiry when popular
+REFRESH_AHEAD = 0.9
+# Request counts halve every HIT_HALF_LIFE seconds
+HIT_HALF_LIFE = 6 * 60 * 60
+MAX_TRACKED = 50_000
+
+
+class RefreshScheduler:
+    """
+    Rank cached brochures by request frequency and age and refresh the best
+    ones in the background, at most `budget` refreshes per `interval` seconds.
+
+    refresh(company_name, url, cancel_event) does the actual work (normally
+    generator.refresh_brochure bound to the cache) and runs in a worker thread.
+    admission_names() returns the admission controllers a refresh must pass,
+    so background work shares provider limits with user requests.
+    """
+
+    def __init__(self, cache, refresh, interval=DEFAULT_INTERVAL, budget=DEFAULT_BUDGET,
+                 max_stale=DEFAULT_MAX_STALE, admission_names=lambda: ("background_refresh",)):
+        self.cache = cache
+        self.refresh = refresh
+        self.admission_names = admission_names
+        self.interval = interval
+        self.budget = budget
+        self.max_stale = max_stale
+        self._stats = {}
+        self._pending = set()
+        self._running = set()
+        self._lock = threading.Lock()
+        self._loop = None
+        self._wakeup = None
+        self._cancel_event = threading.Event()
+        self._window_start = 0.0
+        self._window_used = 0
+
+    def record_request(self, company_name, url, now=None):
+        """Count a request for company/url (exponentially decayed)"""
+        now = now or time.time()
+        key = cache_key(company_name, url)
+        with self._lock:
+            stat = self._stats.get(key)
+            if stat is None:
+                if len(self._stats) >= MAX_TRACKED:
+                    self._evict_coldest(now)
+                stat = self._stats[key] = {
+                    "company_name": company_name, "url": url, "hits": 0.0, "last_hit": now}
+            stat["hits"] = self._decayed(stat, now) + 1
+            stat["last_hit"] = now
+
+    @property
+    def running(self):
+        return self._wakeup is not None
+
+    def can_serve_stale(self, entry, now=None):
+        """True when an expired entry is recent enough to be served while refreshing"""
+        if not self.running:
+            return False
+        age = (now or time.time()) - entry["refreshed_at"]
+        return age < self.cache.ttl + self.max_stale
+
+    def request_refresh(self, company_name, url):
+        """Queue company/url for refresh (a stale copy was just served)"""
+        with self._lock:
+            self._pending.add(cache_key(company_name, url))
+        metrics.increment("refresh_requested_total")
+        if self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def ranked_candidates(self, now=None):
+        """Keys worth refreshing, best first: score = decayed hits x age / ttl"""
+        now = now or time.time()
+        ranked = []
+        with self._lock:
+            stats = list(self._stats.items())
+            pending = set(self._pending)
+            running = set(self._running)
+        for key, stat in stats:
+            if key in running:
+                continue
+            refreshed_at = self.cache.refreshed_at(stat["company_name"], stat["url"])
+            if refreshed_at is None:
+                continue
+            age_ratio = (now - refreshed_at) / self.cache.ttl
+            if age_ratio < REFRESH_AHEAD and key not in pending:
+                continue
+            ranked.append((self._decayed(stat, now) * age_ratio, key))
+        ranked.sort(reverse=True)
+        metrics.set_gauge("refresh_candidates", len(ranked))
+        return [key for _, key in ranked]
+
+    async def run_once(self, now=None):
+        """Refresh as many top-ranked entries as the current budget window allows"""
+        now = now or time.time()
+        if now - self._window_start >= self.interval:
+            self._window_start, self._window_used = now, 0
+        refreshed = 0
+        # Ranking stats every tracked entry's file; keep that off the event loop
+        for key in await asyncio.to_thread(self.ranked_candidates, now):
+            if self._window_used >= self.budget:
+                metrics.increment("refresh_budget_exhausted_total")
+                break
+            self._window_used += 1
+            if await self._refresh_key(key):
+                refreshed += 1
+        return refreshed
+
+    async def run(self):
+        """Scheduler loop; wakes every interval or when a stale entry was served"""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        try:
+            while True:
+                await self.run_once()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+        finally:
+            self._cancel_event.set()
+            self._wakeup = None
+
+    async def _refresh_key(self, key):
+        with self._lock:
+            stat = self._stats.get(key)
+            if stat is None or key in self._running:
+                return False
+            self._running.add(key)
+            self._pending.discard(key)
+        try:
+            ticket = await admit(*self.admission_names())
+        except AdmissionRejectedError:
+            with self._lock:
+                self._running.discard(key)
+                self._pending.add(key)
+            return False
+        entry = self.cache.get(stat["company_name"], stat["url"])
+        if entry is not None and (time.time() - entry["refreshed_at"]) / self.cache.ttl < REFRESH_AHEAD:
+            # Another worker sharing the cache directory refreshed it meanwhile
+            ticket.release()
+            with self._lock:
+                self._running.discard(key)
+            metrics.increment("refresh_skipped_total")
+            return False
+        started = time.monotonic()
+        try:
+            _, regenerated = await asyncio.to_thread(
+                self.refresh, stat["company_name"], stat["url"], self._cancel_event)
+            metrics.increment("refresh_regenerated_total" if regenerated
+                              else "refresh_reused_total")
+            return True
+        except Exception as e:
+            metrics.increment("refresh_errors_total")
+            print(f"⚠️ Background refresh failed for {stat['url']}: {e}")
+            return False
+        finally:
+            ticket.release()
+            metrics.set_gauge("refresh_last_duration_seconds", time.monotonic() - started)
+            with self._lock:
+                self._running.discard(key)
+
+    def _decayed(self, stat, now):
+        return stat["hits"] * 0.5 ** ((now - stat["last_hit"]) / HIT_HALF_LIFE)
+
+    def _evict_coldest(self, now):
+        coldest = min(self._stats, key=lambda key: self._decayed(self._stats[key], now))
+        del self._stats[coldest]
+
+
+def scheduler_from_env(cache, refresh, **kwargs):
+    """
+    Build a RefreshScheduler from BRANDBOOK_REFRESH_INTERVAL,
+    BRANDBOOK_REFRESH_BUDGET and BRANDBOOK_MAX_STALE
+
+    The budget is for the whole server and is split across BRANDBOOK_WORKERS.
+    """
+    interval = os.getenv("BRANDBOOK_REFRESH_INTERVAL")
+    budget = int(os.getenv("BRANDBOOK_REFRESH_BUDGET") or DEFAULT_BUDGET)
+    workers = int(os.getenv("BRANDBOOK_WORKERS") or 1)
+    max_stale = os.getenv("BRANDBOOK_MAX_STALE")
+    return RefreshScheduler(
+        cache,
+        refresh,
+        interval=float(interval) if interval else DEFAULT_INTERVAL,
+        budget=max(1, math.ceil(budget / max(workers, 1))),
+        max_stale=float(max_stale) if max_stale else DEFAULT_MAX_STALE,
+        **kwargs,
+    )
@@ -1,6 +1,17 @@
-from bs4 import BeautifulSoup
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from urllib.robotparser import RobotFileParser
+
 import requests
 
+import metrics
+from domain_index import host_of, is_blocked
+from parse_pool import parse_document, parse_page
 
 # Standard headers to fetch a website
 headers = {
@@ -8,30 +19,367 @@ headers = {
 }
 
 
+# Bodies are read in chunks and cut off here, so one huge page cannot exhaust memory
+MAX_PAGE_BYTES = int(os.getenv("BRANDBOOK_MAX_PAGE_BYTES") or 2 * 1024 * 1024)
+CHUNK_SIZE = 64 * 1024
+REQUEST_TIMEOUT = 15
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+
+
+def is_html_response(response):
+    """False for responses declared as something other than HTML (PDFs, images, ...)"""
+    content_type = response.headers.get("Content-Type")
+    if not content_type:
+        return True
+    return content_type.split(";")[0].strip().lower() in HTML_CONTENT_TYPES
+
+
+def read_body(response, max_bytes=None):
+    """Read at most max_bytes (MAX_PAGE_BYTES) of a streamed response body"""
+    max_bytes = max_bytes or MAX_PAGE_BYTES
+    chunks = []
+    size = 0
+    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+        if not chunk:
+            continue
+        chunks.append(chunk[:max_bytes - size])
+        size += len(chunks[-1])
+        if size >= max_bytes:
+            metrics.increment("scraper_truncated_total")
+            break
+    return b"".join(chunks)
+
+
+def read_document(response):
+    """
+    Read and parse an HTML response into title, text and links (see
+    parse_pool.parse_document), or return None when the response is declared
+    as another content type and the body was never downloaded
+    """
+    if not is_html_response(response):
+        metrics.increment("scraper_skipped_non_html_total")
+        return None
+    return parse_page(read_body(response), response.headers.get("Content-Type"))
+
+
+def open_page(url, request_headers=None):
+    """Start a streamed GET; the caller reads the body and closes the response"""
+    return requests.get(url, headers=request_headers or headers, stream=True,
+                        timeout=REQUEST_TIMEOUT)
+
+
+# robots.txt rules are matched for this agent token (and "*")
+ROBOTS_USER_AGENT = "BrandBook"
+DEFAULT_ROBOTS_TTL = 60 * 60
+# Unreachable robots.txt files are retried sooner than parsed ones
+ROBOTS_ERROR_TTL = 5 * 60
+MAX_ROBOTS_BYTES = 512 * 1024
+MAX_ROBOTS_ENTRIES = 10_000
+# Crawl-delay values above this are capped so one brochure cannot stall for minutes
+MAX_CRAWL_DELAY = 10.0
+DEFAULT_PER_HOST = 2
+DEFAULT_CRAWL_CONCURRENCY = 16
+
+
+def origin_of(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme.lower()}://{parts.netloc.lower()}"
+
+
+def fetch_robots(origin):
+    """
+    Download origin's robots.txt
+
+    Returns:
+        str or None: The file ("" when there is none, i.e. 4xx), or None
+        when the server could not be reached or answered 5xx
+    """
+    try:
+        response = open_page(f"{origin}/robots.txt")
+    except requests.RequestException:
+        return None
+    try:
+        if response.status_code >= 500:
+            return None
+        if response.status_code >= 400:
+            return ""
+        return read_body(response, MAX_ROBOTS_BYTES).decode("utf-8", errors="replace")
+    finally:
+        response.close()
+
+
+class RobotsCache:
+    """
+    Parsed robots.txt per origin, shared by all requests for ttl seconds
+
+    Each origin is downloaded at most once per ttl even when many threads
+    ask at the same time. Missing or unreachable files allow everything.
+    """
+
+    def __init__(self, ttl=DEFAULT_ROBOTS_TTL, max_entries=MAX_ROBOTS_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def rules(self, url):
+        """RobotFileParser for url's origin, downloaded if missing or expired"""
+        origin = origin_of(url)
+        with self._lock:
+            entry = self._entries.get(origin)
+            if entry is None:
+                entry = self._entries[origin] = {"lock": threading.Lock(), "rules": None,
+                                                 "expires": 0.0}
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            self._entries.move_to_end(origin)
+        with entry["lock"]:
+            if entry["rules"] is None or time.monotonic() >= entry["expires"]:
+                metrics.increment("robots_fetched_total")
+                text = fetch_robots(origin)
+                rules = RobotFileParser()
+                rules.parse((text or "").splitlines())
+                entry["rules"] = rules
+                entry["expires"] = time.monotonic() + (
+                    self.ttl if text is not None else min(self.ttl, ROBOTS_ERROR_TTL))
+            return entry["rules"]
+
+    def allowed(self, url):
+        return self.rules(url).can_fetch(ROBOTS_USER_AGENT, url)
+
+    def sitemaps(self, url):
+        """Sitemap URLs announced in url's robots.txt"""
+        return list(self.rules(url).site_maps() or [])
+
+    def crawl_delay(self, url):
+        """Seconds to wait between requests to url's host, or None"""
+        rules = self.rules(url)
+        delay = rules.crawl_delay(ROBOTS_USER_AGENT)
+        if delay is None:
+            rate = rules.request_rate(ROBOTS_USER_AGENT)
+            if rate is not None and rate.requests:
+                delay = rate.seconds / rate.requests
+        return float(delay) if delay is not None else None
+
+
+class PolitenessScheduler:
+    """
+    Per-host politeness for page fetches shared by every brochure request
+
+    At most per_host requests run against one host at a time, consecutive
+    requests to a host start at least its crawl delay apart (robots.txt
+    Crawl-delay, else min_delay), and at most total requests run overall.
+    Free slots go round-robin across the hosts that have waiting requests,
+    so a batch job for one big site cannot starve requests for other sites.
+    """
+
+    def __init__(self, robots, per_host=DEFAULT_PER_HOST, total=DEFAULT_CRAWL_CONCURRENCY,
+                 min_delay=0.0):
+        self.robots = robots
+        self.per_host = per_host
+        self.total = total
+        self.min_delay = min_delay
+        self._hosts = {}
+        self._turns = deque()
+        self._active = 0
+        self._cond = threading.Condition()
+
+    def allowed(self, url):
+        return self.robots.allowed(url)
+
+    @contextmanager
+    def slot(self, url):
+        """Block until url may be fetched; hold the slot for the whole request"""
+        host = urlsplit(url).netloc.lower()
+        delay = self.robots.crawl_delay(url)
+        delay = min(max(delay or 0.0, self.min_delay), MAX_CRAWL_DELAY)
+        ticket = object()
+        with self._cond:
+            self._prune(time.monotonic())
+            state = self._hosts.setdefault(host, {"active": 0, "next_at": 0.0, "waiting": deque()})
+            state["waiting"].append(ticket)
+            if host not in self._turns:
+                self._turns.append(host)
+            metrics.adjust_gauge("crawl_waiting", 1)
+            while True:
+                now = time.monotonic()
+                turn, wake_at = self._next_turn(now)
+                if turn is ticket:
+                    break
+                self._cond.wait(None if wake_at is None else max(0.0, wake_at - now))
+            state["waiting"].popleft()
+            state["active"] += 1
+            state["next_at"] = now + delay
+            self._active += 1
+            # This host goes to the back of the line
+            self._turns.remove(host)
+            if state["waiting"]:
+                self._turns.append(host)
+            metrics.adjust_gauge("crawl_waiting", -1)
+            self._cond.notify_all()
+        try:
+            yield
+        finally:
+            with self._cond:
+                state["active"] -= 1
+                self._active -= 1
+                self._prune(time.monotonic())
+                self._cond.notify_all()
+
+    def _prune(self, now):
+        """Forget idle hosts once their crawl delay has passed"""
+        for host in [host for host, state in self._hosts.items()
+                     if not state["active"] and not state["waiting"] and state["next_at"] <= now]:
+            del self._hosts[host]
+
+    def _next_turn(self, now):
+        """(ticket allowed to go now or None, earliest time a delay expires)"""
+        if self._active >= self.total:
+            return None, None
+        wake_at = None
+        for host in self._turns:
+            state = self._hosts[host]
+            if state["active"] >= self.per_host:
+                continue
+            if now < state["next_at"]:
+                wake_at = state["next_at"] if wake_at is None else min(wake_at, state["next_at"])
+                continue
+            return state["waiting"][0], None
+        return None, wake_at
+
+
+_crawler_lock = threading.Lock()
+_crawler = None
+
+
+def get_crawler():
+    """
+    Return the shared PolitenessScheduler
+
+    BRANDBOOK_ROBOTS_TTL, BRANDBOOK_CRAWL_PER_HOST, BRANDBOOK_CRAWL_CONCURRENCY
+    and BRANDBOOK_CRAWL_DELAY (minimum seconds between requests to one host)
+    override the defaults; BRANDBOOK_RESPECT_ROBOTS=0 ignores robots.txt.
+    """
+    global _crawler
+    with _crawler_lock:
+        if _crawler is None:
+            ttl = os.getenv("BRANDBOOK_ROBOTS_TTL")
+            robots = RobotsCache(ttl=float(ttl) if ttl else DEFAULT_ROBOTS_TTL)
+            if os.getenv("BRANDBOOK_RESPECT_ROBOTS", "1") == "0":
+                robots = _IgnoreRobots()
+            _crawler = PolitenessScheduler(
+                robots,
+                per_host=int(os.getenv("BRANDBOOK_CRAWL_PER_HOST") or DEFAULT_PER_HOST),
+                total=int(os.getenv("BRANDBOOK_CRAWL_CONCURRENCY") or DEFAULT_CRAWL_CONCURRENCY),
+                min_delay=float(os.getenv("BRANDBOOK_CRAWL_DELAY") or 0.0),
+            )
+        return _crawler
+
+
+class _IgnoreRobots:
+    def allowed(self, url):
+        return True
+
+    def crawl_delay(self, url):
+        return None
+
+    def sitemaps(self, url):
+        return []
+
+
+def content_fingerprint(text):
+    """Stable hash of cleaned page text (whitespace differences are ignored)"""
+    normalized = " ".join(text.split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def extract_contents(html):
+    """
+    Return the title and visible text of an HTML document;
+    truncate to 2,000 characters as a sensible limit
+    """
+    return format_contents(parse_document(html))
+
+
+def format_contents(document):
+    return (document["title"] + "\n\n" + document["text"])[:2_000]
+
+
+def fetch_page(url, etag=None, last_modified=None):
+    """
+    Fetch a page, revalidating with the given HTTP validators when present
+
+    Returns:
+        dict: url, not_modified, content, fingerprint, etag, last_modified
+        and links (as fetch_website_links returns them, from the same parse).
+        When the server answers 304 Not Modified the body is not downloaded
+        and content/fingerprint are None. Non-HTML responses and pages
+        disallowed by robots.txt are not downloaded either and yield empty
+        content.
+    """
+    request_headers = dict(headers)
+    if etag:
+        request_headers["If-None-Match"] = etag
+    if last_modified:
+        request_headers["If-Modified-Since"] = last_modified
+    crawler = get_crawler()
+    if not crawler.allowed(url):
+        metrics.increment("scraper_robots_disallowed_total")
+        return {"url": url, "not_modified": False, "content": "",
+                "fingerprint": content_fingerprint(""), "etag": None, "last_modified": None,
+                "links": []}
+    with crawler.slot(url):
+        response = open_page(url, request_headers)
+        try:
+            if response.status_code == 304:
+                return {"url": url, "not_modified": True, "content": None, "fingerprint": None,
+                        "etag": etag, "last_modified": last_modified, "links": []}
+            document = read_document(response)
+        finally:
+            response.close()
+    content = format_contents(document) if document is not None else ""
+    return {
+        "url": url,
+        "not_modified": False,
+        "content": content,
+        "fingerprint": content_fingerprint(content),
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "links": page_links(document),
+    }
+
+
 def fetch_website_contents(url):
     """
     Return the title and contents of the website at the given url;
     truncate to 2,000 characters as a sensible limit
     """
-    response = requests.get(url, headers=headers)
-    soup = BeautifulSoup(response.content, "html.parser")
-    title = soup.title.string if soup.title else "No title found"
-    if soup.body:
-        for irrelevant in soup.body(["script", "style", "img", "input"]):
-            irrelevant.decompose()
-        text = soup.body.get_text(separator="\n", strip=True)
-    else:
-        text = ""
-    return (title + "\n\n" + text)[:2_000]
+    return fetch_page(url)["content"]
 
 
 def fetch_website_links(url):
     """
     Return the links on the webiste at the given url
-    I realize this is inefficient as we're parsing twice! This is to keep the code in the lab simple.
-    Feel free to use a class and optimize it!
+
+    Callers that also need the page's content use fetch_page, which returns
+    both from one download.
     """
-    response = requests.get(url, headers=headers)
-    soup = BeautifulSoup(response.content, "html.parser")
-    links = [link.get("href") for link in soup.find_all("a")]
-    return [link for link in links if link]
+    crawler = get_crawler()
+    if not crawler.allowed(url):
+        metrics.increment("scraper_robots_disallowed_total")
+        return []
+    with crawler.slot(url):
+        response = open_page(url)
+        try:
+            document = read_document(response)
+        finally:
+            response.close()
+    return page_links(document)
+
+
+def page_links(document):
+    """Links of a parsed document, without empty hrefs or blocked domains"""
+    if document is None:
+        return []
+    # Drop empty hrefs and links to blocked domains (social media, wikis, ...)
+    return [link for link in document["links"] if link and not is_blocked(host_of(link))]
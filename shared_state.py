@@ -0,0 +1,72 @@
+"""
+Shared State Module
+Small JSON documents shared by all server worker processes
+"""
+
+import json
+import os
+import threading
+
+
+def state_dir():
+    """Directory shared by the workers (BRANDBOOK_STATE_DIR), or None in single-process mode"""
+    return os.getenv("BRANDBOOK_STATE_DIR") or None
+
+
+class SharedDocument:
+    """
+    A JSON value stored in a file that every worker reads
+
+    read() only re-parses the file when it was replaced since the last read,
+    so checking it on every request costs one stat().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._version = None
+        self._value = None
+        self._lock = threading.Lock()
+
+    def read(self):
+        """Current value, or None when nothing was written yet"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        version = (stat.st_ino, stat.st_mtime_ns)
+        with self._lock:
+            if version != self._version:
+                try:
+                    with open(self.path, encoding="utf-8") as handle:
+                        self._value = json.load(handle)
+                    self._version = version
+                except (OSError, ValueError):
+                    return self._value
+            return self._value
+
+    def write(self, value):
+        """Atomically replace the value for all workers"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as handle:
+            json.dump(value, handle)
+        os.replace(tmp_path, self.path)
+        with self._lock:
+            self._value = value
+            self._version = None
+
+
+_documents = {}
+_documents_lock = threading.Lock()
+
+
+def get_shared_document(name):
+    """Return the shared document called name, or None without a state directory"""
+    directory = state_dir()
+    if directory is None:
+        return None
+    path = os.path.join(directory, f"{name}.json")
+    with _documents_lock:
+        if path not in _documents:
+            _documents[path] = SharedDocument(path)
+        return _documents[path]
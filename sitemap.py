@@ -0,0 +1,232 @@
+"""
+Sitemap Module
+Find about, careers and company pages from a site's sitemaps, without an LLM
+"""
+
+import gzip
+import io
+import os
+import re
+import xml.etree.ElementTree as ET
+from collections import deque
+from urllib.parse import urlsplit
+
+import metrics
+from link_cache import get_link_cache
+from scraper import get_crawler, open_page, origin_of
+
+# Spec limits: 50,000 URLs and 50 MB (uncompressed) per sitemap file
+MAX_SITEMAP_URLS = 50_000
+MAX_SITEMAP_BYTES = 50 * 1024 * 1024
+MAX_CHILD_SITEMAPS = 5
+# Child sitemaps of an index that rarely hold company pages are read last
+LOW_PRIORITY_SITEMAPS = ("post", "blog", "news", "product", "tag", "category", "author",
+                         "image", "video")
+GZIP_MAGIC = b"\x1f\x8b"
+
+# Page type -> path segments that identify it, best first
+PAGE_PATTERNS = (
+    ("about page", ("about", "about-us", "aboutus", "who-we-are", "our-story", "company")),
+    ("careers page", ("careers", "career", "jobs", "join-us", "work-with-us")),
+    ("team page", ("team", "our-team", "leadership", "people")),
+    ("mission page", ("mission", "values", "culture")),
+    ("customers page", ("customers", "case-studies", "clients")),
+    ("investors page", ("investors", "investor-relations")),
+)
+_LOCALE = re.compile(r"^[a-z]{2}(?:[-_][a-z]{2})?$", re.IGNORECASE)
+
+
+class _LimitedReader(io.RawIOBase):
+    """Read-only file over a chunk iterator or file, stopping after limit bytes"""
+
+    def __init__(self, source, limit):
+        self._read = source.read if hasattr(source, "read") else None
+        self._chunks = None if self._read else iter(source)
+        self._pending = b""
+        self._left = limit
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self._left <= 0:
+            return 0
+        size = min(len(buffer), self._left)
+        if self._read is not None:
+            data = self._read(size)
+        else:
+            while not self._pending:
+                chunk = next(self._chunks, None)
+                if chunk is None:
+                    return 0
+                self._pending = chunk
+            data, self._pending = self._pending[:size], self._pending[size:]
+        buffer[:len(data)] = data
+        self._left -= len(data)
+        return len(data)
+
+
+def parse_sitemap(stream, max_urls=MAX_SITEMAP_URLS):
+    """
+    Stream-parse a sitemap or sitemap index (plain or gzip-compressed)
+
+    Elements are discarded as soon as they are read, so memory stays flat
+    however long the file is.
+
+    Yields:
+        tuple: ("sitemap", url) for index entries, ("url", url) for pages
+    """
+    buffered = io.BufferedReader(_LimitedReader(stream, MAX_SITEMAP_BYTES))
+    if buffered.peek(2)[:2] == GZIP_MAGIC:
+        buffered = io.BufferedReader(
+            _LimitedReader(gzip.GzipFile(fileobj=buffered), MAX_SITEMAP_BYTES))
+    kind = None
+    root = None
+    count = 0
+    for event, element in ET.iterparse(buffered, events=("start", "end")):
+        tag = element.tag.rsplit("}", 1)[-1]
+        if event == "start":
+            if root is None:
+                root = element
+                kind = "sitemap" if tag == "sitemapindex" else "url"
+            continue
+        if tag == "loc" and element.text:
+            yield kind, element.text.strip()
+            count += 1
+            if count >= max_urls:
+                return
+        elif tag in ("url", "sitemap"):
+            # Detach finished entries so the tree only holds the current read buffer
+            root.clear()
+
+
+def read_sitemap(sitemap_url):
+    """
+    Download and parse one sitemap file politely
+
+    Returns:
+        list: (kind, url) pairs, or None when there is no sitemap there
+    """
+    crawler = get_crawler()
+    if not crawler.allowed(sitemap_url):
+        return None
+    with crawler.slot(sitemap_url):
+        try:
+            response = open_page(sitemap_url)
+        except Exception:
+            return None
+        try:
+            if response.status_code != 200:
+                return None
+            return list(parse_sitemap(response.iter_content(chunk_size=64 * 1024)))
+        except (ET.ParseError, OSError, EOFError):
+            # Not XML (e.g. an HTML 'not found' page served with 200) or bad gzip
+            return None
+        finally:
+            response.close()
+
+
+def sitemap_locations(url):
+    """Sitemaps announced in robots.txt, else the conventional /sitemap.xml"""
+    return get_crawler().robots.sitemaps(url) or [f"{origin_of(url)}/sitemap.xml"]
+
+
+def collect_sitemap_urls(url):
+    """
+    Page URLs of url's site listed in its sitemaps, following sitemap indexes
+
+    Returns:
+        list or None: None when the site has no readable sitemap
+    """
+    site = _site_of(url)
+    queue = deque(sitemap_locations(url))
+    seen = set()
+    pages = []
+    found = False
+    followed = 0
+    while queue and followed < MAX_CHILD_SITEMAPS + 1:
+        sitemap_url = queue.popleft()
+        if sitemap_url in seen:
+            continue
+        seen.add(sitemap_url)
+        followed += 1
+        entries = read_sitemap(sitemap_url)
+        if entries is None:
+            continue
+        found = True
+        children = [loc for kind, loc in entries if kind == "sitemap"]
+        children.sort(key=lambda loc: any(word in loc.lower() for word in LOW_PRIORITY_SITEMAPS))
+        queue.extend(children)
+        pages.extend(loc for kind, loc in entries if kind == "url" and _site_of(loc) == site)
+    return pages if found else None
+
+
+def _site_of(url):
+    host = urlsplit(url).netloc.lower()
+    return host[4:] if host.startswith("www.") else host
+
+
+def _segments(url):
+    """Lower-cased path segments without a leading locale (/en/, /de-de/)"""
+    segments = [segment for segment in urlsplit(url).path.lower().split("/") if segment]
+    if segments and _LOCALE.match(segments[0]):
+        segments = segments[1:]
+    return [re.sub(r"\.(html?|php|aspx?)$", "", segment) for segment in segments]
+
+
+def pick_pages(page_urls):
+    """
+    Choose at most one URL per PAGE_PATTERNS type from sitemap URLs
+
+    A page matches when one of its path segments is a known name; the best
+    match is the shallowest path, then the earliest name in the pattern, so
+    /about-us wins over /blog/2023/about-our-new-office.
+    """
+    best = {}
+    for page_url in page_urls:
+        segments = _segments(page_url)
+        if not segments or len(segments) > 2:
+            continue
+        for page_type, names in PAGE_PATTERNS:
+            for rank, name in enumerate(names):
+                if name in segments:
+                    score = (len(segments), segments.index(name), rank, len(page_url))
+                    if page_type not in best or score < best[page_type][0]:
+                        best[page_type] = (score, page_url)
+                    break
+    return [{"type": page_type, "url": best[page_type][1]}
+            for page_type, _ in PAGE_PATTERNS if page_type in best]
+
+
+def discover_relevant_links(url):
+    """
+    Relevant links for url from its sitemaps
+
+    Results, including "nothing found", are memoized per site in the link
+    cache, so repeat requests make no sitemap downloads until it expires.
+
+    Returns:
+        list or None: {"type", "url"} dicts, or None when there is no sitemap
+        or it lists none of the pages we look for (use the LLM selection then)
+    """
+    if os.getenv("BRANDBOOK_SITEMAP_DISCOVERY", "1") == "0":
+        return None
+    cache = get_link_cache()
+    site = _site_of(url)
+    cached = cache.get_discovery(site)
+    if cached is not None:
+        metrics.increment("sitemap_cache_hits_total")
+        return cached or None
+    links = []
+    page_urls = collect_sitemap_urls(url)
+    if page_urls is None:
+        metrics.increment("sitemap_missing_total")
+    else:
+        links = pick_pages(page_urls)
+        if links:
+            metrics.increment("sitemap_discovered_total")
+            print(f"Found {len(links)} relevant links in the sitemap of {url}")
+        else:
+            metrics.increment("sitemap_no_match_total")
+    cache.put_discovery(site, links)
+    return links or None
@@ -0,0 +1,315 @@
+// Render streamed markdown without re-parsing the whole document per
+// chunk: a block that ends at a blank line outside a code fence is
+// parsed once and appended, and only the block still being written is
+// re-rendered, at most once per animation frame.
+class IncrementalMarkdown {
+  constructor(container) {
+    this.container = container;
+    this.tail = "";
+    this.scan = 0;
+    this.inFence = false;
+    this.settled = [];
+    this.tailElement = null;
+    this.frame = null;
+  }
+
+  append(text) {
+    this.tail += text;
+    let newline;
+    while ((newline = this.tail.indexOf("\n", this.scan)) !== -1) {
+      const line = this.tail.slice(this.scan, newline);
+      this.scan = newline + 1;
+      const trimmed = line.trimStart();
+      if (trimmed.startsWith("```") || trimmed.startsWith("~~~")) {
+        this.inFence = !this.inFence;
+      } else if (
+        !line.trim() &&
+        !this.inFence &&
+        this.tail.slice(0, newline).trim()
+      ) {
+        this.settled.push(this.tail.slice(0, this.scan));
+        this.tail = this.tail.slice(this.scan);
+        this.scan = 0;
+      }
+    }
+    this.schedule();
+  }
+
+  schedule() {
+    if (this.frame === null) {
+      this.frame = requestAnimationFrame(() => {
+        this.frame = null;
+        this.render();
+      });
+    }
+  }
+
+  render() {
+    if (this.tailElement === null) {
+      // First render replaces the placeholder
+      this.tailElement = document.createElement("div");
+      this.container.replaceChildren(this.tailElement);
+    }
+    for (const block of this.settled) {
+      const element = document.createElement("div");
+      element.innerHTML = markdown.parse(block);
+      this.container.insertBefore(element, this.tailElement);
+    }
+    this.settled = [];
+    this.tailElement.innerHTML = markdown.parse(this.tail);
+  }
+
+  flush() {
+    this.cancel();
+    this.render();
+  }
+
+  cancel() {
+    if (this.frame !== null) {
+      cancelAnimationFrame(this.frame);
+      this.frame = null;
+    }
+  }
+}
+
+let currentCompanyName = "";
+let selectedProvider = "openai";
+let selectedModel = "gpt-5.1";
+
+// Initialize model on page load
+window.addEventListener("DOMContentLoaded", function () {
+  selectModel("openai", "gpt-5.1");
+});
+
+async function selectModel(provider, modelName) {
+  selectedProvider = provider;
+  selectedModel = modelName;
+
+  // Update UI
+  document.querySelectorAll(".model-option").forEach((opt) => {
+    opt.classList.remove("selected");
+  });
+  document
+    .querySelector(`[data-provider="${provider}"]`)
+    .classList.add("selected");
+
+  // Show status
+  const modelNames = {
+    openai: "OpenAI GPT-5.1",
+    claude: "Anthropic Claude Sonnet 4.5",
+    gemini: "Google Gemini 2.0-Flash",
+    ollama: "Ollama deepseek-r1",
+  };
+  document.getElementById("currentModel").textContent =
+    modelNames[provider];
+  document.getElementById("modelStatus").style.display = "block";
+
+  // Send to backend
+  try {
+    const formData = new FormData();
+    formData.append("provider", provider);
+    formData.append("model_name", modelName);
+
+    const response = await fetch("/api/set-model", {
+      method: "POST",
+      body: formData,
+    });
+
+    const data = await response.json();
+    if (data.success) {
+      showStatus(`✅ Model set to ${modelNames[provider]}`, "success");
+    } else {
+      showStatus(`⚠️ Error: ${data.error}`, "error");
+    }
+  } catch (error) {
+    showStatus(`❌ Error: ${error.message}`, "error");
+  }
+}
+
+function showStatus(message, type) {
+  const statusEl = document.getElementById("statusMessage");
+  statusEl.textContent = message;
+  statusEl.className = `status-message ${type}`;
+  statusEl.style.display = "block";
+
+  if (type === "success") {
+    setTimeout(() => {
+      statusEl.style.display = "none";
+    }, 5000);
+  }
+}
+
+async function findCompanyUrl() {
+  const companyName = document.getElementById("companyName").value.trim();
+
+  if (!companyName) {
+    showStatus("Please enter a company name", "error");
+    return;
+  }
+
+  currentCompanyName = companyName;
+
+  // UI updates
+  const btn = document.getElementById("findUrlBtn");
+  const btnText = document.getElementById("findBtnText");
+  const loader = document.getElementById("findLoader");
+
+  btn.disabled = true;
+  btnText.style.display = "none";
+  loader.style.display = "inline-block";
+
+  showStatus("🔍 Searching for website URL...", "info");
+
+  try {
+    const formData = new FormData();
+    formData.append("company_name", companyName);
+
+    const response = await fetch("/api/find-url", {
+      method: "POST",
+      body: formData,
+    });
+
+    const data = await response.json();
+
+    if (!response.ok) {
+      showStatus(`⚠️ ${data.error}`, "error");
+    } else if (data.success) {
+      document.getElementById("websiteUrl").value = data.url;
+      showStatus(`✅ Found website: ${data.url}`, "success");
+    } else {
+      showStatus(
+        `⚠️ Could not find URL automatically. Please enter manually.`,
+        "error"
+      );
+    }
+  } catch (error) {
+    showStatus(`❌ Error: ${error.message}`, "error");
+  } finally {
+    btn.disabled = false;
+    btnText.style.display = "inline";
+    loader.style.display = "none";
+  }
+}
+
+async function generateBrochure() {
+  const companyName = document.getElementById("companyName").value.trim();
+  const websiteUrl = document.getElementById("websiteUrl").value.trim();
+
+  if (!companyName) {
+    showStatus("Please enter a company name", "error");
+    return;
+  }
+
+  if (!websiteUrl) {
+    showStatus("Please enter a website URL", "error");
+    return;
+  }
+
+  currentCompanyName = companyName;
+
+  // UI updates
+  const btn = document.getElementById("generateBtn");
+  const btnText = document.getElementById("genBtnText");
+  const loader = document.getElementById("genLoader");
+  const resultSection = document.getElementById("resultSection");
+  const brochureContent = document.getElementById("brochureContent");
+
+  btn.disabled = true;
+  btnText.style.display = "none";
+  loader.style.display = "inline-block";
+
+  showStatus("✨ Generating brochure... This may take a moment.", "info");
+
+  resultSection.classList.add("active");
+  brochureContent.innerHTML =
+    '<p style="color: #667eea;">Generating your brochure...</p>';
+
+  let renderer = null;
+  try {
+    const formData = new FormData();
+    formData.append("company_name", companyName);
+    formData.append("website_url", websiteUrl);
+
+    const response = await fetch("/api/generate-brochure", {
+      method: "POST",
+      body: formData,
+    });
+
+    if (!response.ok) {
+      // Server is at capacity (429/503); tell the user when to retry
+      const data = await response.json();
+      const retryAfter = response.headers.get("Retry-After");
+      const message = retryAfter
+        ? `${data.error} (retry in ${retryAfter}s)`
+        : data.error;
+      showStatus(`⚠️ ${message}`, "error");
+      brochureContent.innerHTML = "";
+      return;
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    renderer = new IncrementalMarkdown(brochureContent);
+    let buffered = "";
+
+    while (true) {
+      const { done, value } = await reader.read();
+
+      if (done) break;
+
+      // Keep a partial SSE line for the next read
+      buffered += decoder.decode(value, { stream: true });
+      const lines = buffered.split("\n");
+      buffered = lines.pop();
+
+      for (const line of lines) {
+        if (line.startsWith("data: ")) {
+          const data = JSON.parse(line.slice(6));
+
+          if (data.error) {
+            renderer.cancel();
+            showStatus(`❌ Error: ${data.error}`, "error");
+            brochureContent.innerHTML = `<p style="color: red;">Error: ${data.error}</p>`;
+            return;
+          }
+
+          if (data.content) {
+            renderer.append(data.content);
+          }
+
+          if (data.done) {
+            renderer.flush();
+            showStatus(
+              data.stale
+                ? "✅ Brochure loaded from cache (an update is on its way)"
+                : "✅ Brochure generated successfully!",
+              "success"
+            );
+          }
+        }
+      }
+    }
+    renderer.flush();
+  } catch (error) {
+    if (renderer) renderer.cancel();
+    showStatus(`❌ Error: ${error.message}`, "error");
+    brochureContent.innerHTML = `<p style="color: red;">Error: ${error.message}</p>`;
+  } finally {
+    btn.disabled = false;
+    btnText.style.display = "inline";
+    loader.style.display = "none";
+  }
+}
+
+// Allow Enter key to trigger actions
+document
+  .getElementById("companyName")
+  .addEventListener("keypress", (e) => {
+    if (e.key === "Enter") findCompanyUrl();
+  });
+
+document
+  .getElementById("websiteUrl")
+  .addEventListener("keypress", (e) => {
+    if (e.key === "Enter") generateBrochure();
+  });
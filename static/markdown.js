@@ -0,0 +1,224 @@
+// Minimal markdown renderer for brochures (self-hosted, no CDN).
+//
+// Covers what the models write: headings, paragraphs, emphasis, inline and
+// fenced code, links, images, block quotes, nested lists, pipe tables and
+// rules. All text is HTML-escaped and only http(s), mailto and relative URLs
+// become links, so model output cannot inject markup.
+const markdown = (() => {
+  const FENCE = /^ {0,3}(`{3,}|~{3,})\s*([^`\s]*)/;
+  const HEADING = /^ {0,3}(#{1,6})(?:[ \t]+(.*?))?(?:[ \t]+#+)?[ \t]*$/;
+  const RULE = /^ {0,3}([-*_])(?:[ \t]*\1){2,}[ \t]*$/;
+  const QUOTE = /^ {0,3}> ?/;
+  const ITEM = /^( *)([-*+]|\d{1,9}[.)])([ \t]+|$)(.*)$/;
+  const TABLE_DIVIDER = /^ *\|? *:?-+:? *(\| *:?-+:? *)*\|? *$/;
+  const SAFE_URL = /^(https?:|mailto:|\/|#|\.|[^:]*$)/i;
+
+  function escapeHtml(text) {
+    return text
+      .replace(/&/g, "&amp;")
+      .replace(/</g, "&lt;")
+      .replace(/>/g, "&gt;")
+      .replace(/"/g, "&quot;");
+  }
+
+  function safeUrl(url) {
+    return SAFE_URL.test(url.replace(/&amp;/g, "&")) ? url : "#";
+  }
+
+  function inline(text) {
+    // Code spans, links and autolinks are set aside so emphasis markers in
+    // them (e.g. underscores in URLs) are left alone
+    const held = [];
+    const hold = (html) => `\u0000${held.push(html) - 1}\u0000`;
+
+    let out = text.replace(/(`+)([\s\S]*?[^`])\1(?!`)/g, (_, ticks, code) =>
+      hold(`<code>${escapeHtml(code.trim())}</code>`)
+    );
+    out = escapeHtml(out);
+    out = out.replace(
+      /(!?)\[([^\]]*)\]\(\s*([^\s)]+)(?:\s+&quot;(.*?)&quot;)?\s*\)/g,
+      (_, bang, label, url, title) => {
+        const titleAttr = title ? ` title="${title}"` : "";
+        if (bang) {
+          return hold(`<img src="${safeUrl(url)}" alt="${label}"${titleAttr} />`);
+        }
+        return hold(`<a href="${safeUrl(url)}"${titleAttr}>${emphasis(label)}</a>`);
+      }
+    );
+    out = out.replace(/&lt;((?:https?:\/\/|mailto:)[^\s&]+)&gt;/g, (_, url) =>
+      hold(`<a href="${url}">${url}</a>`)
+    );
+    out = emphasis(out).replace(/ {2,}\n|\\\n/g, "<br />\n");
+    return out.replace(/\u0000(\d+)\u0000/g, (_, index) => held[index]);
+  }
+
+  function emphasis(text) {
+    return text
+      .replace(/\*\*(?=\S)([\s\S]*?\S)\*\*/g, "<strong>$1</strong>")
+      .replace(/(^|[^\w])__(?=\S)([\s\S]*?\S)__(?!\w)/g, "$1<strong>$2</strong>")
+      .replace(/~~(?=\S)([\s\S]*?\S)~~/g, "<del>$1</del>")
+      .replace(/\*(?=\S)([\s\S]*?\S)\*/g, "<em>$1</em>")
+      .replace(/(^|[^\w])_(?=\S)([\s\S]*?\S)_(?!\w)/g, "$1<em>$2</em>");
+  }
+
+  function startsBlock(line) {
+    return (
+      FENCE.test(line) ||
+      HEADING.test(line) ||
+      RULE.test(line) ||
+      QUOTE.test(line) ||
+      /^ {0,3}([-*+]|1[.)])[ \t]+\S/.test(line)
+    );
+  }
+
+  function splitRow(line) {
+    return line
+      .trim()
+      .replace(/^\|/, "")
+      .replace(/\|$/, "")
+      .split("|")
+      .map((cell) => cell.trim());
+  }
+
+  function table(lines, i) {
+    const header = splitRow(lines[i]);
+    const aligns = splitRow(lines[i + 1]).map((cell) =>
+      cell.endsWith(":") ? (cell.startsWith(":") ? "center" : "right") : cell.startsWith(":") ? "left" : ""
+    );
+    const cells = (row, tag) =>
+      header
+        .map((_, column) => {
+          const align = aligns[column] ? ` style="text-align: ${aligns[column]}"` : "";
+          return `<${tag}${align}>${inline(row[column] || "")}</${tag}>`;
+        })
+        .join("");
+    let html = `<table>\n<thead>\n<tr>${cells(header, "th")}</tr>\n</thead>\n<tbody>\n`;
+    i += 2;
+    while (i < lines.length && lines[i].trim() && lines[i].includes("|")) {
+      html += `<tr>${cells(splitRow(lines[i]), "td")}</tr>\n`;
+      i++;
+    }
+    return [html + "</tbody>\n</table>\n", i];
+  }
+
+  function list(lines, i) {
+    const first = lines[i].match(ITEM);
+    const indent = first[1].length;
+    const ordered = /\d/.test(first[2]);
+    const items = [];
+    let tight = true;
+    let current = null;
+    let contentIndent = 0;
+
+    while (i < lines.length) {
+      const line = lines[i];
+      const match = line.match(ITEM);
+      if (match && match[1].length === indent && /\d/.test(match[2]) === ordered) {
+        current = [match[4]];
+        items.push(current);
+        contentIndent = indent + match[2].length + Math.max(1, Math.min(match[3].length, 4));
+        i++;
+        continue;
+      }
+      if (!line.trim()) {
+        // A blank line continues the list only if more of it follows
+        let next = i + 1;
+        while (next < lines.length && !lines[next].trim()) next++;
+        const following = lines[next] || "";
+        const nextItem = following.match(ITEM);
+        const sameList =
+          nextItem && nextItem[1].length === indent && /\d/.test(nextItem[2]) === ordered;
+        if (next >= lines.length || (!sameList && following.search(/\S/) < contentIndent)) {
+          break;
+        }
+        tight = false;
+        current.push("");
+        i++;
+        continue;
+      }
+      const leading = line.search(/\S/);
+      if (leading >= contentIndent || leading > indent) {
+        current.push(line.slice(Math.min(leading, contentIndent)));
+      } else if (current[current.length - 1].trim() && !startsBlock(line)) {
+        current.push(line.trim()); // lazy continuation of a paragraph
+      } else {
+        break;
+      }
+      i++;
+    }
+
+    const tag = ordered ? "ol" : "ul";
+    const number = parseInt(first[2], 10);
+    const start = ordered && number !== 1 ? ` start="${number}"` : "";
+    const body = items
+      .map((item) => `<li>${blocks(item, tight).trim()}</li>\n`)
+      .join("");
+    return [`<${tag}${start}>\n${body}</${tag}>\n`, i];
+  }
+
+  function blocks(lines, tight = false) {
+    let html = "";
+    let i = 0;
+    while (i < lines.length) {
+      const line = lines[i];
+      let match;
+      if (!line.trim()) {
+        i++;
+      } else if ((match = line.match(FENCE))) {
+        const marker = match[1];
+        const code = [];
+        i++;
+        while (i < lines.length && !lines[i].trim().startsWith(marker)) {
+          code.push(lines[i]);
+          i++;
+        }
+        i++; // closing fence (or end of text while streaming)
+        const language = match[2] ? ` class="language-${escapeHtml(match[2])}"` : "";
+        html += `<pre><code${language}>${escapeHtml(code.join("\n"))}\n</code></pre>\n`;
+      } else if ((match = line.match(HEADING))) {
+        const level = match[1].length;
+        html += `<h${level}>${inline(match[2] || "")}</h${level}>\n`;
+        i++;
+      } else if (RULE.test(line)) {
+        html += "<hr />\n";
+        i++;
+      } else if (QUOTE.test(line)) {
+        const quoted = [];
+        while (i < lines.length && QUOTE.test(lines[i])) {
+          quoted.push(lines[i].replace(QUOTE, ""));
+          i++;
+        }
+        html += `<blockquote>\n${blocks(quoted)}</blockquote>\n`;
+      } else if (ITEM.test(line) && ITEM.exec(line)[4].trim()) {
+        const [rendered, next] = list(lines, i);
+        html += rendered;
+        i = next;
+      } else if (line.includes("|") && TABLE_DIVIDER.test(lines[i + 1] || "") &&
+                 lines[i + 1].includes("-")) {
+        const [rendered, next] = table(lines, i);
+        html += rendered;
+        i = next;
+      } else {
+        const paragraph = [line.replace(/^ +/, "")];
+        i++;
+        while (i < lines.length && lines[i].trim() && !startsBlock(lines[i])) {
+          paragraph.push(lines[i].replace(/^ +/, ""));
+          i++;
+        }
+        const text = inline(paragraph.join("\n").replace(/[ \t]+$/, ""));
+        html += tight ? `${text}\n` : `<p>${text}</p>\n`;
+      }
+    }
+    return html;
+  }
+
+  function parse(text) {
+    return blocks(text.replace(/\r\n?/g, "\n").replace(/\t/g, "    ").split("\n"));
+  }
+
+  return { parse };
+})();
+
+if (typeof module !== "undefined") {
+  module.exports = markdown;
+}
@@ -0,0 +1,273 @@
+"""
+Structured Output Module
+Tolerant JSON extraction from LLM output: reasoning blocks, code fences,
+surrounding prose and truncated responses
+"""
+
+import json
+import re
+from urllib.parse import urljoin
+
+_THINK_BLOCK = re.compile(r"<think>.*?(?:</think>|$)", re.DOTALL | re.IGNORECASE)
+_FENCE = re.compile(r"```[a-zA-Z]*")
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+class StructuredOutputError(ValueError):
+    """Raised when no usable JSON can be recovered from model output"""
+
+
+def strip_reasoning(text):
+    """Remove <think>...</think> blocks (closed or not) and markdown code fences"""
+    return _FENCE.sub("", _THINK_BLOCK.sub("", text))
+
+
+def _scan(text, start):
+    """
+    Walk a JSON value from text[start] and collect safe truncation points
+
+    Returns:
+        tuple: (end index or None if unterminated, in_string, stack, cuts) where
+        cuts are (index, stack) pairs at which the prefix can be closed cleanly
+    """
+    stack = []
+    cuts = []
+    in_string = escaped = False
+    for index in range(start, len(text)):
+        ch = text[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append(ch)
+            cuts.append((index + 1, tuple(stack)))
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+            if not stack:
+                return index + 1, False, (), cuts
+            cuts.append((index + 1, tuple(stack)))
+        elif ch == ",":
+            cuts.append((index, tuple(stack)))
+    return None, in_string, tuple(stack), cuts
+
+
+def _close(prefix, stack):
+    return prefix + "".join(_CLOSERS[opener] for opener in reversed(stack))
+
+
+def _loads(candidate):
+    try:
+        return json.loads(candidate)
+    except ValueError:
+        pass
+    try:
+        return json.loads(_TRAILING_COMMA.sub(r"\1", candidate))
+    except ValueError:
+        return None
+
+
+def extract_json(text):
+    """
+    Recover the first JSON object from model output
+
+    Tries, in order: the cleaned text as-is, the first balanced {...} block,
+    and finally the truncated tail closed at the latest point that parses
+    (dropping a partial trailing value).
+
+    Returns:
+        tuple: (value, repaired: bool)
+
+    Raises:
+        StructuredOutputError: nothing parseable was found
+    """
+    cleaned = strip_reasoning(text).strip()
+    value = _loads(cleaned)
+    if value is not None:
+        return value, False
+
+    start = cleaned.find("{")
+    if start == -1:
+        raise StructuredOutputError("No JSON object in model output")
+    end, in_string, stack, cuts = _scan(cleaned, start)
+    if end is not None:
+        value = _loads(cleaned[start:end])
+        if value is not None:
+            return value, True
+        raise StructuredOutputError("Malformed JSON object in model output")
+
+    # A string cut off mid-way (e.g. half a URL) is dropped rather than closed
+    candidates = [] if in_string else [_close(cleaned[start:], stack)]
+    candidates += [_close(cleaned[start:cut], cut_stack) for cut, cut_stack in reversed(cuts)]
+    for candidate in candidates:
+        value = _loads(candidate)
+        if value is not None:
+            return value, True
+    raise StructuredOutputError("Truncated JSON could not be repaired")
+
+
+def validate_link(item, base_url=None):
+    """
+    Normalize one {"type", "url"} entry, or return None if it is unusable
+
+    Relative URLs are resolved against base_url; only http(s) URLs are kept.
+    """
+    if not isinstance(item, dict):
+        return None
+    url = item.get("url") or item.get("href")
+    if not isinstance(url, str) or not url.strip():
+        return None
+    url = url.strip()
+    if base_url:
+        url = urljoin(base_url, url)
+    if not url.startswith(("http://", "https://")):
+        return None
+    link_type = item.get("type")
+    if not isinstance(link_type, str) or not link_type.strip():
+        link_type = "relevant page"
+    return {"type": link_type.strip(), "url": url}
+
+
+def validate_links(value, base_url=None):
+    """
+    Coerce parsed output into {"links": [{"type": str, "url": str}, ...]}
+
+    Accepts the documented object or a bare list; invalid and duplicate
+    entries are dropped.
+    """
+    if isinstance(value, dict):
+        items = value.get("links", [])
+    elif isinstance(value, list):
+        items = value
+    else:
+        raise StructuredOutputError("Expected an object with a 'links' list")
+    if not isinstance(items, list):
+        raise StructuredOutputError("'links' is not a list")
+    links, seen = [], set()
+    for item in items:
+        link = validate_link(item, base_url)
+        if link is not None and link["url"] not in seen:
+            seen.add(link["url"])
+            links.append(link)
+    return {"links": links}
+
+
+def parse_links(text, base_url=None):
+    """
+    Parse link-selection output into a validated {"links": [...]} dict
+
+    Returns:
+        tuple: (links dict, repaired: bool)
+    """
+    try:
+        value, repaired = extract_json(text)
+        return validate_links(value, base_url), repaired
+    except StructuredOutputError:
+        # Salvage any complete link objects from otherwise unusable output
+        parser = LinkStreamParser(base_url)
+        links = parser.feed(text)
+        if not links:
+            raise
+        return {"links": links}, True
+
+
+class LinkStreamParser:
+    """
+    Incremental parser that emits each link object as soon as it is complete
+
+    Feed model output chunk by chunk; text inside <think> blocks and anything
+    before the first '{' is ignored, so reasoning and prose never confuse it.
+    """
+
+    def __init__(self, base_url=None):
+        self.base_url = base_url
+        self.links = []
+        self._seen = set()
+        self._text = ""
+        self._pending = ""
+        self._in_think = False
+        self._started = False
+        self._finished = False
+        self._stack = []
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, chunk):
+        """Consume a chunk; return the link dicts completed by it"""
+        completed = []
+        for piece in self._visible(chunk):
+            completed.extend(self._consume(piece))
+        return completed
+
+    def _visible(self, chunk):
+        """Yield chunk text outside <think> blocks (tags may span chunks)"""
+        data = self._pending + chunk
+        self._pending = ""
+        while data:
+            tag = "</think>" if self._in_think else "<think>"
+            index = data.lower().find(tag)
+            if index == -1:
+                # Hold back a possible partial tag at the end of the chunk
+                keep = 0
+                for size in range(min(len(tag) - 1, len(data)), 0, -1):
+                    if tag.startswith(data[-size:].lower()):
+                        keep = size
+                        break
+                visible, self._pending = data[:len(data) - keep], data[len(data) - keep:]
+                if not self._in_think and visible:
+                    yield visible
+                return
+            if not self._in_think and index:
+                yield data[:index]
+            self._in_think = not self._in_think
+            data = data[index + len(tag):]
+
+    def _consume(self, piece):
+        completed = []
+        for ch in piece:
+            if self._finished:
+                break
+            if not self._started:
+                if ch != "{":
+                    continue
+                self._started = True
+            position = len(self._text)
+            self._text += ch
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+            if ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._stack.append((ch, position))
+            elif ch in "}]" and self._stack:
+                opener, start = self._stack.pop()
+                if not self._stack:
+                    self._finished = True
+                elif opener == "{" and self._stack[-1][0] == "[":
+                    link = self._emit(self._text[start:position + 1])
+                    if link is not None:
+                        completed.append(link)
+        return completed
+
+    def _emit(self, candidate):
+        value = _loads(candidate)
+        link = validate_link(value, self.base_url)
+        if link is None or link["url"] in self._seen:
+            return None
+        self._seen.add(link["url"])
+        self.links.append(link)
+        return link
@@ -3,8 +3,26 @@ BrandBook Test Suite
 Basic tests for the application
 """
 
+from unittest.mock import MagicMock, patch
+
 import pytest
-from unittest.mock import patch, MagicMock
+
+from brochure_cache import BrochureCache
+from link_cache import LinkSelectionCache
+
+LANDING_PAGE_RECORD = {
+    "url": "https://example.com", "type": "landing page", "content": "Example\n\nWe make things",
+    "fingerprint": "f1", "etag": None, "last_modified": None,
+}
+
+
+def html_response(body, content_type="text/html; charset=utf-8"):
+    """Mock of a streamed requests response"""
+    response = MagicMock()
+    response.status_code = 200
+    response.headers = {"Content-Type": content_type}
+    response.iter_content.side_effect = lambda chunk_size: iter([body])
+    return response
 
 
 class TestImports:
@@ -29,7 +47,7 @@ class TestImports:
 
     def test_import_url_finder(self):
         """Test URL finder module imports"""
-        from url_finder import find_company_url, extract_domain_from_results
+        from url_finder import extract_domain_from_results, find_company_url
         assert find_company_url is not None
         assert extract_domain_from_results is not None
 
@@ -81,23 +99,50 @@ class TestURLFinder:
         assert "twitter" not in result
         assert "facebook" not in result
 
+    def test_result_store_dedupes_hrefs(self):
+        """Test that repeated hrefs across queries are stored once"""
+        from url_finder import SearchResultStore
+
+        store = SearchResultStore()
+        store.extend([
+            {"href": "https://example.com", "title": "Example"},
+            {"href": "https://example.com", "title": "Example again"},
+            {"href": "https://example.com/about", "title": "About"},
+        ])
+
+        assert len(store) == 2
+        assert store.results[0]["title"] == "Example"
+        assert store.best_url() == "https://example.com"
+
+    def test_skip_list_matches_whole_domains(self):
+        """Test that skip domains match by domain, not by substring"""
+        from url_finder import extract_domain_from_results
+
+        results = [
+            {"href": "https://en.wikipedia.org/wiki/Dropbox", "title": "Wiki"},
+            {"href": "https://www.dropbox.com", "title": "Dropbox"},
+        ]
+
+        # 'x.com' is a substring of 'dropbox.com' but not its domain
+        assert extract_domain_from_results(results) == "https://www.dropbox.com"
+
 
 class TestScraper:
     """Test web scraping functionality"""
 
+    @patch('scraper.fetch_robots', new=lambda origin: "")
     @patch('scraper.requests.get')
     def test_fetch_website_contents(self, mock_get):
         """Test website content fetching"""
         from scraper import fetch_website_contents
 
         # Mock response
-        mock_response = MagicMock()
-        mock_response.content = b"""
+        mock_response = html_response(b"""
         <html>
             <head><title>Test Page</title></head>
             <body><p>Hello World</p></body>
         </html>
-        """
+        """)
         mock_get.return_value = mock_response
 
         result = fetch_website_contents("https://example.com")
@@ -105,14 +150,14 @@ class TestScraper:
         assert "Test Page" in result
         assert "Hello World" in result
 
+    @patch('scraper.fetch_robots', new=lambda origin: "")
     @patch('scraper.requests.get')
     def test_fetch_website_links(self, mock_get):
         """Test website link extraction"""
         from scraper import fetch_website_links
 
         # Mock response
-        mock_response = MagicMock()
-        mock_response.content = b"""
+        mock_response = html_response(b"""
         <html>
             <body>
                 <a href="/about">About</a>
@@ -120,7 +165,7 @@ class TestScraper:
                 <a href="https://example.com/contact">Contact</a>
             </body>
         </html>
-        """
+        """)
         mock_get.return_value = mock_response
 
         result = fetch_website_links("https://example.com")
@@ -129,6 +174,115 @@ class TestScraper:
         assert "/careers" in result
         assert "https://example.com/contact" in result
 
+    @patch('scraper.fetch_robots', new=lambda origin: "")
+    @patch('scraper.requests.get')
+    def test_huge_page_read_within_byte_cap(self, mock_get):
+        """Test that peak memory stays bounded for a page of hundreds of MB"""
+        import tracemalloc
+
+        import scraper
+
+        def endless_body(chunk_size):
+            yield b"<html><head><title>Huge</title></head><body><p>Start</p>"
+            for _ in range(300 * 1024 * 1024 // chunk_size):
+                yield b"<p>filler</p>".ljust(chunk_size, b" ")
+
+        response = html_response(b"")
+        response.iter_content.side_effect = endless_body
+        mock_get.return_value = response
+
+        tracemalloc.start()
+        try:
+            with patch.object(scraper, 'MAX_PAGE_BYTES', 1024 * 1024):
+                page = scraper.fetch_page("https://example.com")
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        assert page["content"].startswith("Huge\n\nStart")
+        assert peak < 32 * 1024 * 1024
+        response.close.assert_called_once()
+
+    @patch('scraper.fetch_robots', new=lambda origin: "")
+    @patch('scraper.requests.get')
+    def test_non_html_skipped_before_download(self, mock_get):
+        """Test that PDFs and images are not downloaded"""
+        from scraper import fetch_page, fetch_website_links
+
+        response = html_response(b"%PDF-1.7", content_type="application/pdf")
+        mock_get.return_value = response
+
+        assert fetch_page("https://example.com/report.pdf")["content"] == ""
+        assert fetch_website_links("https://example.com/report.pdf") == []
+        response.iter_content.assert_not_called()
+
+    @patch('scraper.fetch_robots', new=lambda origin: "")
+    @patch('scraper.requests.get')
+    def test_fetch_page_keeps_validators(self, mock_get):
+        """Test that ETag and Last-Modified are returned for the next conditional request"""
+        from scraper import fetch_page
+
+        response = html_response(b"<html><body><p>Hi</p></body></html>")
+        response.headers.update({"ETag": '"abc"', "Last-Modified": "Mon, 19 Oct 2026 08:00:00 GMT"})
+        mock_get.return_value = response
+
+        page = fetch_page("https://example.com")
+
+        assert page["etag"] == '"abc"'
+        assert page["last_modified"] == "Mon, 19 Oct 2026 08:00:00 GMT"
+
+    @patch('scraper.fetch_robots', new=lambda origin: "")
+    @patch('scraper.requests.get')
+    def test_landing_page_downloaded_once(self, mock_get):
+        """Test that link selection reuses the landing page parsed for its content"""
+        import generator
+
+        mock_get.side_effect = lambda url, **kwargs: html_response(
+            b'<html><head><title>Home</title></head>'
+            b'<body><a href="/about">About</a><a href="https://twitter.com/x">X</a></body></html>'
+            if url == "https://example.com" else b"<html><body>About us</body></html>")
+        selection = {"links": [{"type": "about page", "url": "https://example.com/about"}]}
+
+        with patch.object(generator, 'STREAM_LINK_SELECTION', False), \
+                patch('generator.discover_relevant_links', return_value=None), \
+                patch('generator.get_link_cache', return_value=LinkSelectionCache()), \
+                patch('generator.select_relevant_links', return_value=selection) as mock_select:
+            pages = generator.collect_pages("https://example.com")
+
+        fetched = [call.args[0] for call in mock_get.call_args_list]
+        assert fetched == ["https://example.com", "https://example.com/about"]
+        assert mock_select.call_args.args[1] == ["/about"]
+        assert "links" not in pages[0]
+        assert [page["type"] for page in pages] == ["landing page", "about page"]
+
+    def test_detect_charset(self):
+        """Test charset detection from the header, a meta tag and the default"""
+        from parse_pool import detect_charset
+
+        assert detect_charset("text/html; charset=ISO-8859-1", b"") == "iso8859-1"
+        assert detect_charset("text/html", b'<meta charset="windows-1252">') == "cp1252"
+        assert detect_charset(None, b"<html>") == "utf-8"
+
+    def test_parse_pool_matches_in_process_parsing(self):
+        """Test that worker processes return the same document as in-process parsing"""
+        import metrics
+        from parse_pool import ParsePool, parse_document
+
+        small = b"<html><head><title>Small</title></head><body><a href='/a'>A</a></body></html>"
+        large = (b"<html><head><title>Large</title></head><body>"
+                 + b"<p>text</p><a href='/about'>About</a>" * 5000 + b"</body></html>")
+        metrics.reset()
+        pool = ParsePool(workers=2, max_pending=2, min_bytes=1024)
+        try:
+            assert pool.parse(small) == parse_document(small)
+            assert pool.parse(large, "text/html; charset=utf-8") == parse_document(large)
+        finally:
+            pool.shutdown()
+
+        counters = metrics.snapshot()["counters"]
+        assert counters["parse_in_process_total"] == 1
+        assert counters["parse_pool_total"] == 1
+
 
 class TestGenerator:
     """Test brochure generation functionality"""
@@ -147,3 +301,1407 @@ class TestGenerator:
 
         assert "links" in link_system_prompt.lower()
         assert "JSON" in link_system_prompt
+
+
+class TestCancellation:
+    """Test that abandoned brochure requests stop upstream work"""
+
+    def test_fetch_pipeline_stops_when_cancelled(self):
+        """Test that scraping does not start once the request is cancelled"""
+        import threading
+
+        from generator import GenerationCancelledError, fetch_page_and_all_relevant_links
+
+        cancel_event = threading.Event()
+        cancel_event.set()
+
+        with patch('generator.fetch_page') as mock_fetch:
+            with pytest.raises(GenerationCancelledError):
+                fetch_page_and_all_relevant_links("https://example.com", cancel_event)
+            mock_fetch.assert_not_called()
+
+    def test_disconnect_closes_upstream_stream(self):
+        """Test that a client disconnect aborts the LLM stream and is counted"""
+        import asyncio
+        import itertools
+
+        import app
+        import generator
+        import metrics
+
+        class FakeStream:
+            def __init__(self):
+                self.closed = False
+
+            def __iter__(self):
+                for i in itertools.count():
+                    if self.closed:
+                        return
+                    chunk = MagicMock()
+                    chunk.choices[0].delta.content = f"token{i} "
+                    yield chunk
+
+            def close(self):
+                self.closed = True
+
+        class FakeRequest:
+            def __init__(self, connected_polls):
+                self.polls = 0
+                self.connected_polls = connected_polls
+
+            async def is_disconnected(self):
+                self.polls += 1
+                return self.polls > self.connected_polls
+
+        fake_stream = FakeStream()
+        fake_client = MagicMock()
+        fake_client.chat.completions.create.return_value = fake_stream
+
+        async def consume():
+            events = []
+            async for event in app.brochure_event_stream(
+                    FakeRequest(connected_polls=4), "Example", "https://example.com"):
+                events.append(event)
+            return events
+
+        metrics.reset()
+        with patch.object(generator, 'MODEL_PROVIDER', 'openai'), \
+                patch.object(generator, 'MODEL_NAME', 'gpt-5.1'), \
+                patch.object(generator, 'client', fake_client), \
+                patch('app.get_brochure_cache', return_value=BrochureCache()), \
+                patch('generator.collect_pages', return_value=[LANDING_PAGE_RECORD]):
+            events = asyncio.run(consume())
+
+        assert fake_stream.closed
+        assert not any('"done"' in event for event in events)
+        snapshot = metrics.snapshot()
+        assert snapshot["counters"]["brochure_cancelled_total"] == 1
+        assert snapshot["gauges"]["brochure_in_flight"] == 0
+
+    def test_disconnect_while_opening_closes_late_stream(self):
+        """Test that a stream opened after the client left is still closed"""
+        import asyncio
+        import threading
+
+        import app
+        import generator
+
+        opened = threading.Event()
+        late_stream = MagicMock()
+
+        def slow_open(messages):
+            opened.set()
+            threading.Event().wait(0.2)
+            return late_stream
+
+        class ConnectedRequest:
+            async def is_disconnected(self):
+                return False
+
+        async def disconnect_while_opening():
+            async def consume():
+                return [event async for event in app.brochure_event_stream(
+                    ConnectedRequest(), "Example", "https://example.com")]
+
+            task = asyncio.create_task(consume())
+            await asyncio.to_thread(opened.wait, 5)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            await asyncio.sleep(0.5)
+
+        with patch.object(generator, 'MODEL_PROVIDER', 'openai'), \
+                patch('app.get_brochure_cache', return_value=BrochureCache()), \
+                patch('generator.collect_pages', return_value=[LANDING_PAGE_RECORD]), \
+                patch('app.open_brochure_stream', side_effect=slow_open):
+            asyncio.run(disconnect_while_opening())
+
+        late_stream.close.assert_called_once()
+
+
+class TestAdmission:
+    """Test concurrency limits, the wait queue and fast rejections"""
+
+    def test_queue_full_rejects_with_429(self):
+        """Test that requests beyond the queue bound are rejected immediately"""
+        import asyncio
+
+        from admission import AdmissionController, AdmissionRejectedError
+
+        async def scenario():
+            controller = AdmissionController("test_full", max_concurrent=1, max_queue=1)
+            await controller.acquire()
+            waiter = asyncio.create_task(controller.acquire())
+            await asyncio.sleep(0)
+            assert controller.queued == 1
+            with pytest.raises(AdmissionRejectedError) as excinfo:
+                await controller.acquire()
+            controller.release()
+            await waiter
+            assert controller.active == 1 and controller.queued == 0
+            return excinfo.value
+
+        rejection = asyncio.run(scenario())
+        assert rejection.status_code == 429
+        assert rejection.retry_after >= 1
+
+    def test_queue_timeout_rejects_with_503(self):
+        """Test that a queued request gives up after the queue timeout"""
+        import asyncio
+
+        import metrics
+        from admission import AdmissionController, AdmissionRejectedError
+
+        async def scenario():
+            controller = AdmissionController(
+                "test_timeout", max_concurrent=1, max_queue=4, queue_timeout=0.05)
+            await controller.acquire()
+            with pytest.raises(AdmissionRejectedError) as excinfo:
+                await controller.acquire()
+            assert controller.queued == 0
+            return excinfo.value
+
+        rejection = asyncio.run(scenario())
+        assert rejection.status_code == 503
+        gauges = metrics.snapshot()["gauges"]
+        assert gauges["admission_test_timeout_queued"] == 0
+
+    def test_hold_time_measured_per_grant(self):
+        """Test that slots released out of order each count their own hold time"""
+        import asyncio
+
+        from admission import AdmissionController, Ticket
+
+        async def scenario():
+            controller = AdmissionController("test_hold", max_concurrent=2, max_queue=0)
+            first = Ticket([(controller, await controller.acquire())])
+            second = Ticket([(controller, await controller.acquire())])
+            second.release()
+            first.release()
+            return controller
+
+        # Grants at t=0 and t=9, both released at t=10: held 1s and 10s
+        clock = MagicMock()
+        clock.monotonic.side_effect = [0.0, 9.0, 10.0, 10.0]
+        with patch('admission.time', clock):
+            controller = asyncio.run(scenario())
+
+        assert controller.active == 0
+        assert controller._avg_hold == pytest.approx(0.8 * (0.8 * 5.0 + 0.2 * 1) + 0.2 * 10)
+
+    def test_generate_endpoint_returns_retry_after(self):
+        """Test that a saturated brochure endpoint answers 429 with Retry-After"""
+        from fastapi.testclient import TestClient
+
+        import admission
+        from app import app
+
+        saturated = admission.AdmissionController(
+            "generate_brochure", max_concurrent=0, max_queue=0)
+        with patch.dict(admission._controllers, {"generate_brochure": saturated}), \
+                patch('app.get_brochure_cache', return_value=BrochureCache()):
+            client = TestClient(app)
+            response = client.post("/api/generate-brochure",
+                                   data={"company_name": "Example",
+                                         "website_url": "https://example.com"})
+
+        assert response.status_code == 429
+        assert int(response.headers["Retry-After"]) >= 1
+        assert response.json()["success"] is False
+
+    def test_cached_brochure_skips_admission(self):
+        """Test that a cached brochure is replayed even when every slot is busy"""
+        from fastapi.testclient import TestClient
+
+        import admission
+        from app import app
+
+        cache = BrochureCache()
+        cache.put("Example", "https://example.com", "# Example", [LANDING_PAGE_RECORD])
+        saturated = admission.AdmissionController(
+            "generate_brochure", max_concurrent=0, max_queue=0)
+        with patch.dict(admission._controllers, {"generate_brochure": saturated}), \
+                patch('app.get_brochure_cache', return_value=cache):
+            client = TestClient(app)
+            response = client.post("/api/generate-brochure",
+                                   data={"company_name": "Example",
+                                         "website_url": "https://example.com"})
+
+        assert response.status_code == 200
+        assert "# Example" in response.text
+        assert '"cached": true' in response.text
+        assert saturated.active == 0
+
+
+class TestDomainIndex:
+    """Test public-suffix and block-list lookups"""
+
+    def test_registrable_domain(self):
+        """Test eTLD+1 extraction including multi-label and wildcard suffixes"""
+        from domain_index import PublicSuffixList
+
+        psl = PublicSuffixList(["com", "top", "uk", "co.uk", "ck", "*.ck", "!www.ck"])
+
+        assert psl.registrable_domain("foo.com.evil.top") == "evil.top"
+        assert psl.registrable_domain("shop.example.co.uk") == "example.co.uk"
+        assert psl.registrable_domain("a.b.ck") == "a.b.ck"
+        assert psl.registrable_domain("www.ck") == "www.ck"
+        assert psl.registrable_domain("co.uk") is None
+
+    def test_block_list_matches_on_label_boundaries(self):
+        """Test that blocked domains match subdomains but not lookalikes"""
+        from domain_index import DomainIndex
+
+        index = DomainIndex(["github.com", "wikipedia.org"])
+
+        assert "en.wikipedia.org" in index
+        assert "github.com" in index
+        assert "notgithub.company.io" not in index
+        assert "github.com.evil.top" not in index
+
+    def test_empty_block_list_is_respected(self):
+        """Test that an explicitly empty block list is not replaced by the default"""
+        from domain_index import DomainIndex
+        from url_finder import SearchResultStore
+
+        store = SearchResultStore(blocked_domains=DomainIndex())
+        store.add({"href": "https://github.com/acme", "title": "Acme"})
+
+        assert len(store) == 1
+
+    def test_tld_preference_uses_public_suffix(self):
+        """Test that '.com' inside a host does not earn the .com bonus"""
+        from url_finder import extract_domain_from_results
+
+        results = [
+            {"href": "https://acme.com.evil.top", "title": "Lookalike"},
+            {"href": "https://acme.io", "title": "Acme"},
+        ]
+
+        assert extract_domain_from_results(results) == "https://acme.io"
+
+    @patch('scraper.fetch_robots', new=lambda origin: "")
+    @patch('scraper.requests.get')
+    def test_fetch_website_links_drops_blocked_domains(self, mock_get):
+        """Test that social media links are filtered out of the link list"""
+        from scraper import fetch_website_links
+
+        mock_response = html_response(b"""
+        <html><body>
+            <a href="/about">About</a>
+            <a href="https://twitter.com/example">Twitter</a>
+            <a href="https://www.linkedin.com/company/example">LinkedIn</a>
+        </body></html>
+        """)
+        mock_get.return_value = mock_response
+
+        result = fetch_website_links("https://example.com")
+
+        assert result == ["/about"]
+
+
+class TestCompanyIndex:
+    """Test offline company-to-domain resolution"""
+
+    @pytest.fixture(autouse=True)
+    def isolated_index(self):
+        """A fresh index per test, so learned entries never reach the shared one"""
+        from company_index import CompanyIndex
+
+        index = CompanyIndex()
+        with patch('url_finder.get_company_index', return_value=index):
+            yield index
+
+    def test_lookup_name_variants(self):
+        """Test exact, normalized and typo-tolerant lookups"""
+        from company_index import CompanyIndex
+
+        index = CompanyIndex()
+
+        assert index.lookup("HuggingFace") == "https://huggingface.co"
+        assert index.lookup("Hugging Face, Inc.") == "https://huggingface.co"
+        assert index.lookup("Hugingface") == "https://huggingface.co"
+        assert index.lookup("Definitely Not A Real Company") is None
+
+    def test_learned_resolutions_persist(self, tmp_path):
+        """Test that learned entries are reused by a fresh index"""
+        from company_index import CompanyIndex, write_index
+
+        bundled = tmp_path / "companies.tsv"
+        learned = tmp_path / "learned.tsv"
+        write_index([("Example Corp", "example.com")], bundled)
+
+        index = CompanyIndex(bundled, learned)
+        assert index.lookup("Example") == "https://example.com"
+        index.learn("Acme Widgets", "https://www.acmewidgets.io")
+
+        reopened = CompanyIndex(bundled, learned)
+        assert reopened.lookup("acme widgets ltd") == "https://acmewidgets.io"
+
+    def test_learn_keeps_only_the_company_site(self):
+        """Test that learned hosts are normalized and unrelated results dropped"""
+        from company_index import CompanyIndex
+
+        index = CompanyIndex(path=None)
+        index.learn("Acme Widgets", "https://WWW.AcmeWidgets.io:443/about")
+        index.learn("Globex", "https://en.wikipedia.org/wiki/Globex")
+        index.learn("Initech", "https://www.crunchbase.com/organization/initech")
+        index.learn("Umbrella", "http://127.0.0.1:8000")
+        index.learn("Hooli", "co.uk")
+
+        assert index.lookup("Acme Widgets") == "https://acmewidgets.io"
+        for name in ("Globex", "Initech", "Umbrella", "Hooli"):
+            assert index.lookup(name) is None
+
+    @patch('url_finder.DDGS')
+    def test_find_company_url_learns_into_isolated_index(self, mock_ddgs, isolated_index):
+        """Test that a searched resolution is learned by the test's own index"""
+        from company_index import get_company_index
+        from url_finder import find_company_url
+
+        mock_ddgs.return_value.text.return_value = [
+            {"href": "https://www.zorblax.com/", "title": "Zorblax"},
+        ]
+
+        assert find_company_url("Zorblax") == "https://www.zorblax.com"
+        assert isolated_index.lookup("Zorblax") == "https://zorblax.com"
+        assert get_company_index().lookup("Zorblax", fuzzy=False) is None
+
+    @patch('url_finder.DDGS')
+    def test_find_company_url_skips_search_for_indexed_company(self, mock_ddgs):
+        """Test that indexed companies resolve without any search query"""
+        from url_finder import find_company_url
+
+        assert find_company_url("OpenAI") == "https://openai.com"
+        mock_ddgs.assert_not_called()
+
+
+class TestIncrementalRefresh:
+    """Test fingerprint-based reuse and partial re-fetching of cached brochures"""
+
+    @staticmethod
+    def fake_site(pages, not_modified=()):
+        """Build a fetch_page stand-in serving the given {url: text} mapping"""
+        from scraper import content_fingerprint
+
+        def fetch_page(url, etag=None, last_modified=None):
+            if url in not_modified and etag:
+                return {"url": url, "not_modified": True, "content": None,
+                        "fingerprint": None, "etag": etag, "last_modified": None, "links": []}
+            return {"url": url, "not_modified": False, "content": pages[url],
+                    "fingerprint": content_fingerprint(pages[url]),
+                    "etag": f'"{url}"', "last_modified": None, "links": []}
+        return fetch_page
+
+    def seed_cache(self, site):
+        import generator
+
+        cache = BrochureCache()
+        with patch('generator.fetch_page', side_effect=self.fake_site(site)), \
+                patch('generator.iter_relevant_links',
+                      return_value=iter([{"type": "about page",
+                                          "url": "https://example.com/about"}])), \
+                patch('generator.call_ai_model') as mock_call:
+            mock_call.return_value.choices[0].message.content = "# Brochure v1"
+            generator.refresh_brochure("Example", "https://example.com", cache)
+        return cache
+
+    def test_unchanged_site_reuses_brochure(self):
+        """Test that matching fingerprints skip link selection and generation"""
+        import generator
+
+        site = {"https://example.com": "Home", "https://example.com/about": "About us"}
+        cache = self.seed_cache(site)
+
+        with patch('generator.fetch_page',
+                   side_effect=self.fake_site(site, not_modified={"https://example.com/about"})), \
+                patch('generator.iter_relevant_links') as mock_select, \
+                patch('generator.call_ai_model') as mock_call:
+            entry, regenerated = generator.refresh_brochure("Example", "https://example.com", cache)
+
+        assert not regenerated
+        assert entry["brochure"] == "# Brochure v1"
+        assert entry["pages"][1]["content"] == "About us"
+        mock_select.assert_not_called()
+        mock_call.assert_not_called()
+
+    def test_changed_page_regenerates_from_repacked_pages(self):
+        """Test that a changed sub-page triggers regeneration without new link selection"""
+        import generator
+
+        site = {"https://example.com": "Home", "https://example.com/about": "About us"}
+        cache = self.seed_cache(site)
+        site["https://example.com/about"] = "About us - now hiring"
+
+        with patch('generator.fetch_page', side_effect=self.fake_site(site)), \
+                patch('generator.iter_relevant_links') as mock_select, \
+                patch('generator.call_ai_model') as mock_call:
+            mock_call.return_value.choices[0].message.content = "# Brochure v2"
+            entry, regenerated = generator.refresh_brochure("Example", "https://example.com", cache)
+
+        assert regenerated
+        assert entry["brochure"] == "# Brochure v2"
+        mock_select.assert_not_called()
+        prompt = mock_call.call_args.kwargs["messages"][1]["content"]
+        assert "now hiring" in prompt
+
+    def test_revalidation_takes_provider_slot_only_to_generate(self):
+        """Test that an unchanged site is reused while every provider slot is busy"""
+        import asyncio
+        import time
+
+        import admission
+        import app
+        import generator
+
+        site = {"https://example.com": "Home", "https://example.com/about": "About us"}
+        cache = self.seed_cache(site)
+        entry = cache.get("Example", "https://example.com")
+        entry["refreshed_at"] = time.time() - 2 * cache.ttl
+        scheduler = MagicMock()
+        scheduler.can_serve_stale.return_value = False
+        saturated = admission.AdmissionController(
+            "provider_openai", max_concurrent=0, max_queue=0)
+
+        class ConnectedRequest:
+            async def is_disconnected(self):
+                return False
+
+        async def consume():
+            return [event async for event in app.brochure_event_stream(
+                ConnectedRequest(), "Example", "https://example.com")]
+
+        changed = [dict(page, content=page["content"] + "!", fingerprint="changed")
+                   for page in entry["pages"]]
+        with patch.object(generator, 'MODEL_PROVIDER', 'openai'), \
+                patch.dict(admission._controllers, {"provider_openai": saturated}), \
+                patch('app.get_brochure_cache', return_value=cache), \
+                patch('app.get_refresh_scheduler', return_value=scheduler), \
+                patch('app.open_brochure_stream') as mock_open:
+            with patch('generator.collect_pages', return_value=entry["pages"]):
+                reused = asyncio.run(consume())
+            # Reuse revalidated the entry; expire it again
+            cache.get("Example", "https://example.com")["refreshed_at"] -= 2 * cache.ttl
+            with patch('generator.collect_pages', return_value=changed):
+                regenerated = asyncio.run(consume())
+
+        assert "# Brochure v1" in reused[0]
+        assert '"done": true' in reused[-1]
+        assert '"retry_after"' in regenerated[-1]
+        mock_open.assert_not_called()
+
+
+class TestRefreshScheduler:
+    """Test stale-while-revalidate serving and background refresh ranking"""
+
+    @staticmethod
+    def stale_cache(*companies, age=2.0):
+        import time
+
+        cache = BrochureCache(ttl=1.0)
+        for company in companies:
+            entry = cache.put(company, f"https://{company}.com", f"# {company}",
+                              [LANDING_PAGE_RECORD])
+            entry["refreshed_at"] = time.time() - age
+        return cache
+
+    def test_refresh_ranked_by_frequency_within_budget(self):
+        """Test that the most requested stale entries are refreshed first, up to the budget"""
+        import asyncio
+
+        from refresh_scheduler import RefreshScheduler
+
+        cache = self.stale_cache("popular", "rare", "medium")
+        refreshed = []
+
+        def refresh(company_name, url, cancel_event):
+            refreshed.append(company_name)
+            return None, False
+
+        scheduler = RefreshScheduler(cache, refresh, budget=2)
+        for company, hits in [("popular", 5), ("rare", 1), ("medium", 3)]:
+            for _ in range(hits):
+                scheduler.record_request(company, f"https://{company}.com")
+
+        assert asyncio.run(scheduler.run_once()) == 2
+        assert refreshed == ["popular", "medium"]
+
+    def test_ranking_leaves_cache_untouched(self, tmp_path):
+        """Test that ranking reads no brochures and does not reorder the LRU"""
+        import time
+
+        from brochure_cache import cache_key
+        from refresh_scheduler import RefreshScheduler
+
+        writer = BrochureCache(directory=str(tmp_path), ttl=1.0)
+        for company in ("first", "second"):
+            entry = writer.put(company, f"https://{company}.com", f"# {company}",
+                               [LANDING_PAGE_RECORD])
+            writer._store(cache_key(company, entry["url"]),
+                          dict(entry, refreshed_at=time.time() - 5))
+        cache = BrochureCache(directory=str(tmp_path), ttl=1.0, max_entries=2)
+        cache.get("first", "https://first.com")
+        cache.get("second", "https://second.com")
+
+        scheduler = RefreshScheduler(cache, lambda *args: (None, False))
+        for company in ("second", "first"):
+            scheduler.record_request(company, f"https://{company}.com")
+        with patch.object(cache, '_load') as mock_load:
+            ranked = scheduler.ranked_candidates()
+
+        assert len(ranked) == 2
+        mock_load.assert_not_called()
+        assert [entry["company_name"] for entry in cache.entries()] == ["first", "second"]
+
+    def test_stale_brochure_served_immediately(self):
+        """Test that an expired brochure is streamed at once and queued for refresh"""
+        import asyncio
+
+        import app
+
+        cache = self.stale_cache("example")
+        scheduler = MagicMock()
+        scheduler.can_serve_stale.return_value = True
+
+        class ConnectedRequest:
+            async def is_disconnected(self):
+                return False
+
+        async def consume():
+            return [event async for event in app.brochure_event_stream(
+                ConnectedRequest(), "example", "https://example.com")]
+
+        with patch('app.get_brochure_cache', return_value=cache), \
+                patch('app.get_refresh_scheduler', return_value=scheduler), \
+                patch('generator.collect_pages') as mock_collect:
+            events = asyncio.run(consume())
+
+        assert "# example" in events[0]
+        assert '"stale": true' in events[-1]
+        scheduler.request_refresh.assert_called_once_with("example", "https://example.com")
+        mock_collect.assert_not_called()
+
+
+class TestStructuredOutput:
+    """Test tolerant parsing of link-selection output"""
+
+    def test_strips_reasoning_and_code_fences(self):
+        """Test deepseek-style <think> blocks and ```json fences are ignored"""
+        from structured_output import parse_links
+
+        text = """<think>The {about} page looks useful...</think>
+Here you go:
+```json
+{"links": [{"type": "about page", "url": "/about"}]}
+```"""
+        links, _ = parse_links(text, base_url="https://example.com")
+
+        assert links == {"links": [{"type": "about page", "url": "https://example.com/about"}]}
+
+    def test_repairs_truncated_output(self):
+        """Test that a response cut off mid-object keeps the complete links"""
+        from structured_output import parse_links
+
+        text = ('{"links": [{"type": "about page", "url": "https://example.com/about"}, '
+                '{"type": "careers page", "url": "https://exa')
+        links, repaired = parse_links(text)
+
+        assert repaired
+        assert [link["url"] for link in links["links"]] == ["https://example.com/about"]
+
+    def test_stream_parser_emits_each_link_when_complete(self):
+        """Test incremental parsing across arbitrary chunk boundaries"""
+        from structured_output import LinkStreamParser
+
+        text = ('<thi' 'nk>{"links": "draft"}</th' 'ink>{"links": [{"type": "about page", '
+                '"url": "https://example.com/about"}, {"type": "jobs", "url": "mailto:x@y.z"}, '
+                '{"type": "careers page", "url": "https://example.com/careers"}]}')
+        parser = LinkStreamParser()
+        emitted = []
+        for i in range(0, len(text), 7):
+            emitted.append([link["url"] for link in parser.feed(text[i:i + 7])])
+
+        flat = [url for chunk in emitted for url in chunk]
+        assert flat == ["https://example.com/about", "https://example.com/careers"]
+        # The first link is available long before the output ends
+        first_chunk = next(i for i, chunk in enumerate(emitted) if chunk)
+        assert first_chunk < len(emitted) - 5
+
+    def test_unparseable_output_degrades_to_no_links(self):
+        """Test that link selection failure no longer fails the brochure"""
+        import generator
+
+        with patch('generator.get_links_user_prompt', return_value="links"), \
+                patch('generator.call_ai_model') as mock_call, \
+                patch.object(generator, 'MODEL_PROVIDER', 'ollama'):
+            mock_call.return_value.choices[0].message.content = "I cannot help with that."
+            assert generator.select_relevant_links("https://example.com") == {"links": []}
+
+
+class TestStreamingLinkSelection:
+    """Test that sub-page fetching overlaps with streamed link selection"""
+
+    def test_fetch_starts_before_link_selection_finishes(self):
+        """Test that the first link is fetched while the model is still streaming"""
+        import threading
+
+        import generator
+
+        first_fetch = threading.Event()
+        fetched_mid_stream = []
+
+        def fake_stream():
+            pieces = ['{"links": [{"type": "about page", ',
+                      '"url": "https://example.com/about"}',
+                      ', {"type": "careers page", "url": "https://example.com/careers"}]}']
+            for index, piece in enumerate(pieces):
+                if index == 2:
+                    # Hold the rest of the answer until the first fetch has begun
+                    fetched_mid_stream.append(first_fetch.wait(timeout=5))
+                chunk = MagicMock()
+                chunk.choices[0].delta.content = piece
+                yield chunk
+
+        def fake_fetch_page(url, etag=None, last_modified=None):
+            if url.endswith("/about"):
+                first_fetch.set()
+            return {"url": url, "not_modified": False, "content": f"page {url}",
+                    "fingerprint": url, "etag": None, "last_modified": None,
+                    "links": ["/about", "/careers"]}
+
+        with patch.object(generator, 'MODEL_PROVIDER', 'openai'), \
+                patch.object(generator, 'STREAM_LINK_SELECTION', True), \
+                patch('generator.discover_relevant_links', return_value=None), \
+                patch('generator.get_link_cache', return_value=LinkSelectionCache()), \
+                patch('generator.get_links_user_prompt', return_value="links"), \
+                patch('generator.call_ai_model', return_value=fake_stream()), \
+                patch('generator.fetch_page', side_effect=fake_fetch_page):
+            pages = generator.collect_pages("https://example.com")
+
+        assert fetched_mid_stream == [True]
+        assert [page["type"] for page in pages] == ["landing page", "about page", "careers page"]
+
+
+class TestProviderRouter:
+    """Test hedged streaming and failover across providers"""
+
+    @staticmethod
+    def fake_streams(behaviours):
+        """stream_completion stand-in: provider -> (delay before first token, error)"""
+        import time
+
+        import generator
+
+        opened = []
+
+        def fake_stream_completion(messages, json_mode=False, provider=None,
+                                   model_name=None, ai_client=None):
+            delay, error = behaviours[provider]
+            opened.append(provider)
+
+            def pieces():
+                time.sleep(delay)
+                if error:
+                    raise error
+                yield f"{provider} says "
+                yield "hello"
+
+            return generator.TextStream(pieces())
+
+        return opened, fake_stream_completion
+
+    def make_router(self, hedge_after_ms):
+        from provider_router import ProviderRouter, parse_routes
+
+        routes = parse_routes("claude,ollama:deepseek-r1")
+        for route in routes:
+            route.client = MagicMock()
+        return ProviderRouter(routes, hedge_after_ms=hedge_after_ms)
+
+    def test_slow_primary_is_hedged(self):
+        """Test that a secondary started after the hedge delay wins the race"""
+        import generator
+        import metrics
+
+        metrics.reset()
+        router = self.make_router(hedge_after_ms=50)
+        opened, fake = self.fake_streams({
+            "openai": (2.0, None), "claude": (0.0, None), "ollama": (0.0, None)})
+        with patch.object(generator, 'MODEL_PROVIDER', 'openai'), \
+                patch.object(generator, 'MODEL_NAME', 'gpt-5.1'), \
+                patch.object(generator, 'client', MagicMock()), \
+                patch('generator.stream_completion', side_effect=fake):
+            stream = router.stream([{"role": "user", "content": "hi"}])
+            text = "".join(stream)
+            stream.close()
+
+        assert text == "claude says hello"
+        assert opened == ["openai", "claude"]
+        counters = metrics.snapshot()["counters"]
+        assert counters["router_hedges_total"] == 1
+        assert counters["router_fallback_wins_total"] == 1
+
+    def test_failover_and_stats(self):
+        """Test that an early error fails over and demotes the failing provider"""
+        import generator
+        import metrics
+
+        metrics.reset()
+        router = self.make_router(hedge_after_ms=0)
+        opened, fake = self.fake_streams({
+            "openai": (0.0, RuntimeError("rate limited")), "claude": (0.0, None),
+            "ollama": (0.0, None)})
+        with patch.object(generator, 'MODEL_PROVIDER', 'openai'), \
+                patch.object(generator, 'MODEL_NAME', 'gpt-5.1'), \
+                patch.object(generator, 'client', MagicMock()), \
+                patch('generator.stream_completion', side_effect=fake):
+            assert "".join(router.stream([])) == "claude says hello"
+            # A second failure marks the primary unhealthy; it is then tried last
+            "".join(router.stream([]))
+            plan = [route.provider for route in router.plan()]
+
+        assert plan[-1] == "openai"
+        assert metrics.snapshot()["counters"]["router_failovers_total"] == 2
+        stats = {item["provider"]: item for item in router.stats()}
+        assert stats["openai"]["healthy"] is False
+        assert stats["claude"]["ttft_ewma_ms"] is not None
+
+    def test_close_wakes_a_blocked_consumer(self):
+        """Test that close() ends iteration while waiting for a first or later token"""
+        import threading
+        import time
+
+        import generator
+
+        stall = threading.Event()
+
+        def fake_stream_completion(messages, json_mode=False, provider=None,
+                                   model_name=None, ai_client=None):
+            def pieces():
+                if messages:
+                    yield "first"
+                stall.wait(5)
+                yield "late"
+
+            return generator.TextStream(pieces())
+
+        router = self.make_router(hedge_after_ms=0)
+        results = []
+        with patch.object(generator, 'MODEL_PROVIDER', 'openai'), \
+                patch.object(generator, 'MODEL_NAME', 'gpt-5.1'), \
+                patch.object(generator, 'client', MagicMock()), \
+                patch('generator.stream_completion', side_effect=fake_stream_completion):
+            # Racing for the first token, then streaming the winner
+            for messages, expected in (([], []), ([{"role": "user"}], ["first"])):
+                stream = router.stream(messages)
+                received = []
+                consumer = threading.Thread(target=lambda: received.extend(stream), daemon=True)
+                consumer.start()
+                time.sleep(0.1)
+                stream.close()
+                consumer.join(1)
+                results.append((consumer.is_alive(), received, expected))
+            stall.set()
+
+        for alive, received, expected in results:
+            assert not alive
+            assert received == expected
+
+    def test_primary_listed_as_fallback_shares_stats(self):
+        """Test that one provider/model has one Route however it is reached"""
+        import generator
+        from provider_router import ProviderRouter, parse_routes
+
+        router = ProviderRouter(parse_routes("claude,openai:gpt-5.1,claude"))
+        with patch.object(generator, 'MODEL_PROVIDER', 'openai'), \
+                patch.object(generator, 'MODEL_NAME', 'gpt-5.1'), \
+                patch.object(generator, 'client', MagicMock()):
+            primary, *fallbacks = router.plan()
+            primary.record_error()
+
+        assert primary is router.fallbacks[1]
+        assert [route.provider for route in fallbacks] == ["claude"]
+        assert [item["provider"] for item in router.stats()] == ["claude", "openai"]
+
+
+class TestIncrementalRendering:
+    """Test that streamed brochures are rendered block by block"""
+
+    def test_blocks_settle_outside_code_fences(self):
+        """Test that finished blocks are emitted once and the tail stays short"""
+        from generator import MarkdownBlocks
+
+        section = "## Section\n\nSome text about the company.\n\n```\ncode\n\nmore code\n```\n\n"
+        text = section * 200
+        blocks = MarkdownBlocks()
+        settled = []
+        longest_tail = 0
+        for i in range(0, len(text), 5):
+            settled.extend(blocks.feed(text[i:i + 5]))
+            longest_tail = max(longest_tail, len(blocks.tail))
+
+        assert "".join(settled) + blocks.tail == text
+        assert settled[2] == "```\ncode\n\nmore code\n```\n\n"
+        assert longest_tail < len(section)
+
+    def test_terminal_output_streams_text(self, capsys):
+        """Test that the CLI writes pieces as they arrive and returns the brochure"""
+        import generator
+
+        with patch('generator.get_brochure_user_prompt', return_value="prompt"), \
+                patch('generator.stream_completion',
+                      return_value=generator.TextStream(["# Acme", "\n\nHello"])):
+            result = generator.stream_brochure("Acme", "https://acme.com")
+
+        assert result == "# Acme\n\nHello"
+        assert capsys.readouterr().out == "# Acme\n\nHello"
+
+
+class TestProductionServer:
+    """Test multi-worker serving and state shared between workers"""
+
+    def test_main_runs_workers_with_shared_state(self, tmp_path, monkeypatch):
+        """Test that main() starts N workers without reload and shares state on disk"""
+        import os
+
+        import app
+
+        monkeypatch.setenv("BRANDBOOK_WORKERS", "4")
+        monkeypatch.delenv("BRANDBOOK_RELOAD", raising=False)
+        # main() sets the shared-state variables; restore them afterwards
+        with patch.dict(os.environ), patch('uvicorn.run') as mock_run:
+            os.environ["BRANDBOOK_STATE_DIR"] = str(tmp_path)
+            for name in ("BRANDBOOK_CACHE_DIR", "BRANDBOOK_LINK_CACHE_DIR",
+                         "BRANDBOOK_COMPANY_INDEX_LEARNED"):
+                os.environ.pop(name, None)
+            app.main()
+            cache_dir = os.environ["BRANDBOOK_CACHE_DIR"]
+
+        args, kwargs = mock_run.call_args
+        assert args == ("app:app",)
+        assert kwargs["workers"] == 4
+        assert kwargs["reload"] is False
+        assert cache_dir == str(tmp_path / "cache")
+        assert os.environ.get("BRANDBOOK_CACHE_DIR") != cache_dir
+
+    def test_cache_entries_visible_across_processes(self, tmp_path):
+        """Test that one worker's cache sees another worker's newer brochure"""
+        worker_a = BrochureCache(directory=str(tmp_path))
+        worker_b = BrochureCache(directory=str(tmp_path))
+        worker_a.put("Example", "https://example.com", "old", [LANDING_PAGE_RECORD])
+        assert worker_b.get("Example", "https://example.com")["brochure"] == "old"
+
+        worker_a.put("Example", "https://example.com", "new", [LANDING_PAGE_RECORD])
+        assert worker_b.get("Example", "https://example.com")["brochure"] == "new"
+
+    def test_model_selection_follows_other_worker(self, tmp_path, monkeypatch):
+        """Test that a worker adopts a model chosen through another worker"""
+        import app
+        import generator
+        from shared_state import SharedDocument
+
+        monkeypatch.setenv("BRANDBOOK_STATE_DIR", str(tmp_path))
+        SharedDocument(str(tmp_path / "model.json")).write(
+            {"provider": "ollama", "model": "llama3"})
+        with patch.object(generator, 'MODEL_PROVIDER', 'openai'), \
+                patch.object(generator, 'MODEL_NAME', 'gpt-5.1'), \
+                patch.object(generator, 'client', MagicMock()), \
+                patch.object(app, 'model_initialized', True), \
+                patch('generator.create_client', return_value=("llama3", "ollama-client")):
+            app.sync_model()
+            assert (generator.MODEL_PROVIDER, generator.MODEL_NAME) == ("ollama", "llama3")
+            assert generator.client == "ollama-client"
+
+
+class TestCrawlPoliteness:
+    """Test robots.txt handling and per-host fetch scheduling"""
+
+    def test_robots_rules_cached_and_enforced(self):
+        """Test that robots.txt is fetched once per TTL and disallowed pages are skipped"""
+        import scraper
+
+        robots = "User-agent: *\nDisallow: /private\nCrawl-delay: 2\n"
+        crawler = scraper.PolitenessScheduler(scraper.RobotsCache(ttl=60))
+        with patch('scraper.fetch_robots', return_value=robots) as mock_robots, \
+                patch('scraper.get_crawler', return_value=crawler), \
+                patch('scraper.requests.get') as mock_get:
+            assert scraper.fetch_page("https://polite.example/private/a")["content"] == ""
+            assert scraper.fetch_website_links("https://polite.example/private/b") == []
+            assert crawler.robots.crawl_delay("https://polite.example/about") == 2.0
+
+        mock_robots.assert_called_once_with("https://polite.example")
+        mock_get.assert_not_called()
+
+    def test_per_host_limit_and_fair_order(self):
+        """Test that one busy host cannot hold every slot from other hosts"""
+        import threading
+        import time
+
+        import scraper
+
+        robots = MagicMock()
+        robots.crawl_delay.return_value = None
+        crawler = scraper.PolitenessScheduler(robots, per_host=1, total=2)
+        order = []
+        peak = {"big.example": 0, "small.example": 0}
+        active = {"big.example": 0, "small.example": 0}
+        lock = threading.Lock()
+
+        def fetch(url):
+            host = url.split("/")[2]
+            with crawler.slot(url):
+                with lock:
+                    order.append(host)
+                    active[host] += 1
+                    peak[host] = max(peak[host], active[host])
+                time.sleep(0.02)
+                with lock:
+                    active[host] -= 1
+
+        threads = [threading.Thread(target=fetch, args=(f"https://big.example/{i}",))
+                   for i in range(6)]
+        threads += [threading.Thread(target=fetch, args=(f"https://small.example/{i}",))
+                    for i in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=5)
+
+        assert peak == {"big.example": 1, "small.example": 1}
+        # Both small-site pages are fetched long before the big site's queue drains
+        assert max(i for i, host in enumerate(order) if host == "small.example") <= 4
+
+    def test_crawl_delay_between_sequential_requests(self):
+        """Test that the delay holds for requests that do not overlap"""
+        import time
+
+        import scraper
+
+        robots = MagicMock()
+        robots.crawl_delay.return_value = 0.1
+        crawler = scraper.PolitenessScheduler(robots)
+        started = []
+        for i in range(3):
+            with crawler.slot(f"https://slow.example/{i}"):
+                started.append(time.monotonic())
+
+        assert all(later - earlier >= 0.09 for earlier, later in zip(started, started[1:]))
+        # An idle host is forgotten once its delay has passed
+        time.sleep(0.1)
+        with crawler.slot("https://other.example/"):
+            assert "slow.example" not in crawler._hosts
+
+
+class TestLinkSelectionCache:
+    """Test memoized link selection"""
+
+    def test_unchanged_link_set_skips_model(self, tmp_path):
+        """Test that the same links, model and prompt reuse the selection from disk"""
+        import generator
+        import metrics
+
+        selection = '{"links": [{"type": "about page", "url": "https://example.com/about"}]}'
+        response = MagicMock()
+        response.choices[0].message.content = selection
+        cache = LinkSelectionCache(directory=str(tmp_path))
+
+        with patch.object(generator, 'MODEL_PROVIDER', 'openai'), \
+                patch.object(generator, 'MODEL_NAME', 'gpt-5.1'), \
+                patch.object(generator, 'STREAM_LINK_SELECTION', False), \
+                patch('generator.discover_relevant_links', return_value=None), \
+                patch('generator.get_link_cache', return_value=cache), \
+                patch('generator.fetch_website_links',
+                      side_effect=[["/about", "/careers#team"], ["/careers", "/about", "/about"]]), \
+                patch('generator.call_ai_model', return_value=response) as mock_call:
+            first = list(generator.iter_relevant_links("https://example.com"))
+            # A restarted process reads the selection back from disk
+            cache = LinkSelectionCache(directory=str(tmp_path))
+            metrics.reset()
+            with patch('generator.get_link_cache', return_value=cache):
+                second = list(generator.iter_relevant_links("https://example.com"))
+
+        assert first == second == [{"type": "about page", "url": "https://example.com/about"}]
+        assert mock_call.call_count == 1
+        assert metrics.snapshot()["counters"]["link_selection_cache_hits_total"] == 1
+
+    def test_key_depends_on_site_model_and_prompt(self):
+        """Test that a different site, model or prompt is a different entry"""
+        from link_cache import link_selection_key
+
+        key = link_selection_key("https://a.com", ["/about"], "openai", "gpt-5.1", "prompt")
+        assert key == link_selection_key("https://a.com", ["https://a.com/about"],
+                                         "openai", "gpt-5.1", "prompt")
+        assert key != link_selection_key("https://b.com", ["/about"], "openai", "gpt-5.1", "prompt")
+        assert key != link_selection_key("https://a.com", ["/about"], "claude", "gpt-5.1", "prompt")
+        assert key != link_selection_key("https://a.com", ["/about"], "openai", "gpt-5.1", "other")
+
+
+class TestSitemapDiscovery:
+    """Test finding relevant pages from sitemaps"""
+
+    INDEX = b"""<?xml version="1.0" encoding="UTF-8"?>
+<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <sitemap><loc>https://acme.example/sitemap-posts.xml.gz</loc></sitemap>
+  <sitemap><loc>https://acme.example/sitemap-pages.xml.gz</loc></sitemap>
+</sitemapindex>"""
+    PAGES = b"""<?xml version="1.0" encoding="UTF-8"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <url><loc>https://acme.example/</loc></url>
+  <url><loc>https://acme.example/en/about-us/</loc></url>
+  <url><loc>https://acme.example/about/history</loc></url>
+  <url><loc>https://www.acme.example/careers</loc></url>
+  <url><loc>https://acme.example/privacy</loc></url>
+  <url><loc>https://other.example/about</loc></url>
+</urlset>"""
+    POSTS = b"""<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <url><loc>https://acme.example/blog/2023/about-our-new-office</loc></url>
+</urlset>"""
+
+    def crawl(self, files, cache=None):
+        """Run discovery against in-memory sitemap files (url -> bytes)"""
+        import scraper
+        import sitemap
+
+        robots = MagicMock()
+        robots.allowed.return_value = True
+        robots.crawl_delay.return_value = None
+        robots.sitemaps.return_value = []
+        crawler = scraper.PolitenessScheduler(robots)
+        requested = []
+        if cache is None:
+            cache = LinkSelectionCache()
+
+        def fake_open_page(url):
+            requested.append(url)
+            response = html_response(files.get(url, b""), content_type="application/xml")
+            response.status_code = 200 if url in files else 404
+            return response
+
+        with patch('sitemap.get_crawler', return_value=crawler), \
+                patch('sitemap.get_link_cache', return_value=cache), \
+                patch('sitemap.open_page', side_effect=fake_open_page):
+            return sitemap.discover_relevant_links("https://acme.example"), requested
+
+    def test_gzip_sitemap_index_picks_company_pages(self):
+        """Test index + gzip children are followed and the right pages chosen"""
+        import gzip
+
+        links, requested = self.crawl({
+            "https://acme.example/sitemap.xml": self.INDEX,
+            "https://acme.example/sitemap-pages.xml.gz": gzip.compress(self.PAGES),
+            "https://acme.example/sitemap-posts.xml.gz": gzip.compress(self.POSTS),
+        })
+
+        assert links == [
+            {"type": "about page", "url": "https://acme.example/en/about-us/"},
+            {"type": "careers page", "url": "https://www.acme.example/careers"},
+        ]
+        # Page sitemaps are read before blog ones
+        assert requested.index("https://acme.example/sitemap-pages.xml.gz") < \
+            requested.index("https://acme.example/sitemap-posts.xml.gz")
+
+    def test_no_sitemap_falls_back(self):
+        """Test that a missing sitemap returns None so the LLM selection runs"""
+        links, requested = self.crawl({})
+
+        assert links is None
+        assert requested == ["https://acme.example/sitemap.xml"]
+
+    def test_discovery_memoized_per_site(self):
+        """Test that found pages and "no sitemap" are both reused without downloads"""
+        found = LinkSelectionCache()
+        first, _ = self.crawl({"https://acme.example/sitemap.xml": self.PAGES}, found)
+        again, requested = self.crawl({}, found)
+        assert again == first and requested == []
+
+        missing = LinkSelectionCache()
+        self.crawl({}, missing)
+        links, requested = self.crawl({"https://acme.example/sitemap.xml": self.PAGES}, missing)
+        assert links is None and requested == []
+
+        missing.discovery_ttl = -1
+        links, requested = self.crawl({"https://acme.example/sitemap.xml": self.PAGES}, missing)
+        assert links and requested == ["https://acme.example/sitemap.xml"]
+
+    def test_parse_sitemap_streams_large_files(self):
+        """Test that the parser yields entries without holding the document"""
+        from sitemap import parse_sitemap
+
+        def chunks():
+            yield b'<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+            for i in range(20000):
+                yield f"<url><loc>https://acme.example/p/{i}</loc></url>".encode()
+            yield b"</urlset>"
+
+        import xml.etree.ElementTree as ET
+        original_iterparse = ET.iterparse
+        roots = []
+
+        def iterparse(source, events):
+            for event, element in original_iterparse(source, events):
+                if not roots:
+                    roots.append(element)
+                yield event, element
+
+        with patch('sitemap.ET.iterparse', side_effect=iterparse):
+            entries = parse_sitemap(chunks(), max_urls=15000)
+            assert next(entries) == ("url", "https://acme.example/p/0")
+            sizes = [len(roots[0]) for _ in entries]
+
+        assert len(sizes) == 14999
+        # Finished <url> elements are detached from the root as they are read;
+        # only the entries parsed from the current read buffer remain
+        assert max(sizes) < 1000
+
+
+class TestPromptCaching:
+    """Test the cache-friendly prompt layout and cached-token accounting"""
+
+    def test_static_instructions_form_a_stable_prefix(self):
+        """Test that request data never appears before the fixed instructions"""
+        import generator
+
+        first = generator.build_messages(
+            generator.brochure_system_prompt,
+            generator.build_brochure_user_prompt("Acme", "Landing page: rockets"))
+        second = generator.build_messages(
+            generator.brochure_system_prompt,
+            generator.build_brochure_user_prompt("Globex", "Landing page: chemicals"))
+
+        assert first[0] == second[0] and first[0]["role"] == "system"
+        prefix = first[1]["content"].split("Acme")[0]
+        assert second[1]["content"].startswith(prefix) and len(prefix) > 100
+
+    def test_openai_stream_records_cached_tokens(self):
+        """Test that the final usage chunk is recorded and skipped as text"""
+        import generator
+        import metrics
+
+        def chunk(content=None, usage=None):
+            item = MagicMock()
+            item.choices = [MagicMock()] if content else []
+            if content:
+                item.choices[0].delta.content = content
+            item.usage = usage
+            return item
+
+        usage = MagicMock(prompt_tokens=1500)
+        usage.prompt_tokens_details.cached_tokens = 1280
+        ai_client = MagicMock()
+        ai_client.chat.completions.create.return_value = iter(
+            [chunk("Hello "), chunk("world"), chunk(usage=usage)])
+        messages = generator.build_messages("system", "user")
+        metrics.reset()
+
+        text = "".join(generator.stream_completion(
+            messages, provider="openai", model_name="gpt-5.1", ai_client=ai_client))
+
+        params = ai_client.chat.completions.create.call_args.kwargs
+        assert text == "Hello world"
+        assert params["stream_options"] == {"include_usage": True}
+        assert params["prompt_cache_key"] == generator.prompt_cache_key(messages)
+        counters = metrics.snapshot()["counters"]
+        assert counters["prompt_tokens_total"] == 1500
+        assert counters["prompt_cached_tokens_total"] == 1280
+        assert counters["provider_openai_cached_tokens_total"] == 1280
+
+    def test_claude_system_prompt_is_a_cache_breakpoint(self):
+        """Test that Claude gets cache_control on the system block and reads count"""
+        import generator
+        import metrics
+
+        ai_client = MagicMock()
+        response = ai_client.messages.create.return_value
+        response.content[0].text = "brochure"
+        response.usage = MagicMock(input_tokens=40, cache_read_input_tokens=1200,
+                                   cache_creation_input_tokens=0)
+        metrics.reset()
+
+        result = generator.call_ai_model(
+            generator.build_messages("system", "user"),
+            provider="claude", model_name="claude-sonnet-4.5", ai_client=ai_client)
+
+        system = ai_client.messages.create.call_args.kwargs["system"]
+        assert result.choices[0].message.content == "brochure"
+        assert system == [{"type": "text", "text": "system",
+                           "cache_control": {"type": "ephemeral"}}]
+        counters = metrics.snapshot()["counters"]
+        assert counters["prompt_tokens_total"] == 1240
+        assert counters["prompt_cached_tokens_total"] == 1200
+
+
+class TestOllamaLifecycle:
+    """Test Ollama warm-up, keep-alive and slots against a local stand-in server"""
+
+    @pytest.fixture
+    def ollama_server(self):
+        import json
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        requests_seen = []
+
+        class Handler(BaseHTTPRequestHandler):
+            loaded = set()
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                requests_seen.append((self.path, body))
+                # Loading takes 2s the first time, nothing once the model is in memory
+                cold = body["model"] not in Handler.loaded
+                Handler.loaded.add(body["model"])
+                payload = json.dumps({"model": body["model"], "done": True,
+                                      "load_duration": 2_000_000_000 if cold else 50_000})
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.end_headers()
+                self.wfile.write(payload.encode())
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield f"http://127.0.0.1:{server.server_address[1]}", requests_seen
+        server.shutdown()
+        server.server_close()
+
+    def test_warm_up_records_load_time(self, ollama_server):
+        """Test that a cold load is timed and a second warm-up is cheap"""
+        import metrics
+        from ollama_lifecycle import OllamaLifecycle
+
+        base_url, seen = ollama_server
+        lifecycle = OllamaLifecycle(base_url=base_url, keep_alive=600)
+        metrics.reset()
+
+        assert lifecycle.warm_up("deepseek-r1") == 2.0
+        assert lifecycle.warm_up("deepseek-r1") < 0.01
+
+        assert seen[0] == ("/api/generate", {"model": "deepseek-r1", "keep_alive": 600})
+        counters = metrics.snapshot()["counters"]
+        assert counters["ollama_warmups_total"] == 2
+        assert counters["ollama_cold_loads_total"] == 1
+        assert metrics.snapshot()["gauges"]["ollama_load_ms"] == 2000
+
+    def test_keep_alive_renewed_until_idle(self, ollama_server):
+        """Test that recently used models are renewed and idle ones let go"""
+        import time
+
+        from ollama_lifecycle import OllamaLifecycle
+
+        base_url, seen = ollama_server
+        lifecycle = OllamaLifecycle(base_url=base_url, keep_alive=600)
+        lifecycle.touch("deepseek-r1")
+        lifecycle.touch("llama3")
+        lifecycle._last_used["llama3"] = time.time() - 700
+
+        lifecycle.maintain(selected="deepseek-r1")
+
+        assert [body["model"] for _, body in seen] == ["deepseek-r1"]
+        assert seen[0][1]["keep_alive"] == 600
+        assert lifecycle.renewals() == [("deepseek-r1", 600)]
+
+    def test_slots_follow_ollama_parallelism(self, monkeypatch):
+        """Test that the provider_ollama limit is this worker's share of the server's slots"""
+        import admission
+
+        monkeypatch.setenv("OLLAMA_NUM_PARALLEL", "4")
+        monkeypatch.setenv("BRANDBOOK_WORKERS", "2")
+        monkeypatch.delitem(admission._controllers, "provider_ollama", raising=False)
+        try:
+            assert admission.get_controller("provider_ollama").max_concurrent == 2
+            admission._controllers.pop("provider_ollama")
+            monkeypatch.setenv("OLLAMA_NUM_PARALLEL", "four")
+            assert admission.get_controller("provider_ollama").max_concurrent == \
+                admission.DEFAULT_LIMITS["provider_ollama"][0]
+        finally:
+            admission._controllers.pop("provider_ollama", None)
+
+    def test_find_url_takes_a_provider_slot(self):
+        """Test that URL discovery waits for the provider's slots like brochures do"""
+        from fastapi.testclient import TestClient
+
+        import admission
+        import app
+        import generator
+
+        saturated = admission.AdmissionController("provider_ollama", max_concurrent=0, max_queue=0)
+        with patch.dict(admission._controllers, {"provider_ollama": saturated}), \
+                patch.object(generator, 'MODEL_PROVIDER', 'ollama'), \
+                patch.object(app, 'model_initialized', True), \
+                patch('app.sync_model'), \
+                patch('app.find_company_url') as mock_find:
+            response = TestClient(app.app).post("/api/find-url", data={"company_name": "Acme"})
+
+        assert response.status_code == 429
+        mock_find.assert_not_called()
+
+
+class TestStaticDelivery:
+    """Test the cached home page, fingerprinted assets and compression"""
+
+    def test_home_page_is_precompressed_and_revalidated(self):
+        """Test that / is served gzipped with an ETag and answers 304 when unchanged"""
+        from fastapi.testclient import TestClient
+
+        from app import app
+
+        client = TestClient(app)
+        response = client.get("/", headers={"Accept-Encoding": "gzip"})
+        etag = response.headers["ETag"]
+        revalidated = client.get("/", headers={"If-None-Match": etag})
+
+        assert response.status_code == 200
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert response.headers["Cache-Control"] == "no-cache"
+        assert "cdn.jsdelivr.net" not in response.text
+        assert "/static/markdown.js?v=" in response.text
+        assert revalidated.status_code == 304
+        assert revalidated.content == b""
+
+    def test_fingerprinted_assets_are_immutable(self):
+        """Test that assets linked from the page get long-lived cache headers"""
+        import re
+
+        from fastapi.testclient import TestClient
+
+        from app import app
+
+        client = TestClient(app)
+        page = client.get("/").text
+        url = re.search(r'src="(/static/brandbook\.js\?v=\w+)"', page).group(1)
+
+        fingerprinted = client.get(url, headers={"Accept-Encoding": "gzip"})
+        plain = client.get("/static/brandbook.js")
+        # Only the current content hash is immutable, not any query with "v="
+        unrelated = client.get("/static/brandbook.js?nov=1")
+        stale = client.get("/static/brandbook.js?v=000000000000")
+
+        with open("static/brandbook.js", "rb") as handle:
+            assert fingerprinted.content == handle.read()
+        assert fingerprinted.headers["Cache-Control"] == "public, max-age=31536000, immutable"
+        assert fingerprinted.headers["Content-Encoding"] == "gzip"
+        assert plain.headers["Cache-Control"] == "no-cache"
+        assert unrelated.headers["Cache-Control"] == "no-cache"
+        assert stale.headers["Cache-Control"] == "no-cache"
+
+    def test_healthz_and_uncompressed_event_stream(self):
+        """Test the probe endpoint and that SSE is never buffered by compression"""
+        from fastapi.testclient import TestClient
+
+        from app import app
+
+        async def events(request, company_name, website_url, entry=None):
+            yield 'data: {"content": "' + "x" * 2000 + '"}\n\n'
+
+        client = TestClient(app)
+        with patch('app.brochure_event_stream', events):
+            stream = client.post("/api/generate-brochure",
+                                 data={"company_name": "Example", "website_url": "https://example.com"},
+                                 headers={"Accept-Encoding": "gzip"})
+
+        assert client.get("/healthz").json() == {"status": "ok"}
+        assert stream.headers["content-type"].startswith("text/event-stream")
+        assert "content-encoding" not in stream.headers
@@ -4,15 +4,140 @@ Uses LangChain and web search to automatically find company website URLs
 """
 
 import os
-import re
-from dotenv import load_dotenv
+from functools import lru_cache
+from urllib.parse import urlsplit
+
 from ddgs import DDGS
-from langchain_openai import ChatOpenAI
+from dotenv import load_dotenv
 from langchain_core.prompts import PromptTemplate
+from langchain_openai import ChatOpenAI
+
+from company_index import get_company_index
+from domain_index import get_blocked_domains, get_public_suffixes
 
 load_dotenv(override=True)
 
 
+# Score bonus by public suffix (prefer .com, then .co, then .ai/.io)
+TLD_BONUS = {'com': 10, 'co': 7, 'ai': 3, 'io': 3}
+
+SKIPPED_EXTENSIONS = ('.html', '.htm', '.php')
+
+
+@lru_cache(maxsize=8192)
+def parse_result_url(href):
+    """
+    Parse a search result URL once into the fields used for scoring
+
+    Args:
+        href: Result URL
+
+    Returns:
+        tuple: (base_url, host, path_depth, clean_url) or None if not a web URL
+    """
+    if not href or not href.startswith('http'):
+        return None
+    try:
+        parts = urlsplit(href)
+    except ValueError:
+        return None
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        return None
+    path = parts.path.rstrip('/')
+    path_depth = path.count('/')
+    clean_url = f"{parts.scheme}://{parts.netloc}{path}"
+    base_url = f"{parts.scheme}://{parts.netloc}"
+    return base_url, parts.hostname, path_depth, clean_url
+
+
+@lru_cache(maxsize=8192)
+def tld_bonus(host):
+    """
+    Score bonus for the host's public suffix
+
+    Country variants of .com such as .com.tr count as .com; a '.com' label in
+    front of another suffix ('foo.com.evil.top') does not.
+    """
+    suffix = get_public_suffixes().public_suffix(host)
+    first_label = suffix.split('.', 1)[0]
+    if first_label == 'com':
+        return TLD_BONUS['com']
+    return TLD_BONUS.get(suffix, 0)
+
+
+class SearchResultStore:
+    """
+    Compact, deduplicated store of search results
+
+    Each distinct href is parsed once; scoring fields are kept in parallel
+    column lists so thousands of candidates can be ranked in a single pass.
+    Hosts are checked against a DomainIndex block list (the shared one by default).
+    """
+
+    def __init__(self, blocked_domains=None):
+        self.blocked_domains = (get_blocked_domains() if blocked_domains is None
+                                else blocked_domains)
+        self.results = []        # first occurrence of each distinct href
+        self._index = {}         # href -> row
+        self._base_urls = []
+        self._clean_urls = []
+        self._static_scores = []
+        self._is_com = []
+
+    def __len__(self):
+        return len(self._index)
+
+    def add(self, result):
+        """Add one search result dict; duplicates and unusable URLs are ignored"""
+        href = result.get('href', '')
+        if href in self._index:
+            return
+        self._index[href] = len(self.results)
+        self.results.append(result)
+        self._add_candidate(href)
+
+    def extend(self, results):
+        for result in results:
+            self.add(result)
+
+    def _add_candidate(self, href):
+        parsed = parse_result_url(href)
+        if parsed is None:
+            return
+        base_url, host, path_depth, clean_url = parsed
+        if self.blocked_domains.match(host) is not None:
+            return
+        if clean_url.endswith(SKIPPED_EXTENSIONS):
+            return
+        # path_count mirrors the slash count of the URL: 2 for a bare domain
+        path_count = path_depth + 2
+        score = 10 if path_count == 2 else 5 if path_count == 3 else 0
+        bonus = tld_bonus(host)
+        score += bonus - path_count
+        self._base_urls.append(base_url)
+        self._clean_urls.append(clean_url)
+        self._static_scores.append(score)
+        self._is_com.append(bonus == TLD_BONUS['com'])
+
+    def scores(self):
+        """Return the score of every candidate, in insertion order"""
+        return list(self._static_scores)
+
+    def ranked(self):
+        """Return candidate row numbers, best first (stable for equal scores)"""
+        rows = range(len(self._static_scores))
+        com_rows = [row for row in rows if self._is_com[row]]
+        # If we have a .com domain, strongly prefer it
+        return sorted(com_rows or rows, key=self._static_scores.__getitem__, reverse=True)
+
+    def best_url(self):
+        """Return the base URL of the best candidate, or None"""
+        ranked = self.ranked()
+        if not ranked:
+            return None
+        return self._base_urls[ranked[0]]
+
+
 def extract_domain_from_results(results):
     """
     Extract the most likely company domain from search results
@@ -23,78 +148,9 @@ def extract_domain_from_results(results):
     Returns:
         str: Best matching domain URL or None
     """
-    # Common patterns for official websites
-    potential_urls = []
-
-    # Skip these domains
-    skip_domains = ['wikipedia.org', 'twitter.com', 'x.com', 'facebook.com',
-                    'linkedin.com', 'youtube.com', 'stackoverflow.com',
-                    'github.com', 'reddit.com', 'instagram.com', 'tiktok.com',
-                    'sotwe.com', '1319lm.top', 'medium.com', 'quora.com']
-
-    for result in results:
-        href = result.get('href', '')
-        title = result.get('title', '').lower()
-
-        # Skip unwanted domains
-        if any(skip in href for skip in skip_domains):
-            continue
-
-        # Check if URL looks like a main domain
-        if href and href.startswith('http'):
-            # Extract base domain
-            match = re.search(r'https?://(?:www\.)?([^/]+)', href)
-            if match:
-                domain = match.group(1)
-                # Count path segments - prefer URLs with fewer segments (likely homepage)
-                path_count = href.rstrip('/').count('/')
-
-                # Calculate a score for this URL
-                score = 0
-
-                # Prefer root domain URLs
-                if path_count == 2:  # https://domain.com (has 2 slashes)
-                    score += 10
-                elif path_count == 3:  # https://domain.com/something
-                    score += 5
-
-                # Prefer .com and .co domains (higher priority)
-                if '.com' in href:
-                    score += 10  # Highest priority for .com
-                elif '.co/' in href or href.endswith('.co'):
-                    score += 7
-                elif '.ai' in href:
-                    score += 3
-                elif '.io' in href:
-                    score += 3
-
-                # Penalize deep paths
-                score -= path_count
-
-                # Clean URL
-                clean_url = href.split('?')[0].rstrip('/')
-                if not clean_url.endswith(('.html', '.htm', '.php')):
-                    potential_urls.append((score, clean_url, href))
-
-    # Sort by score (descending)
-    potential_urls.sort(reverse=True, key=lambda x: x[0])
-
-    # Additional filtering: if we have a .com domain, strongly prefer it
-    com_urls = [url for url in potential_urls if '.com' in url[1]]
-    if com_urls:
-        potential_urls = com_urls
-
-    # Return the highest scored URL
-    if potential_urls:
-        best_url = potential_urls[0][1]
-        # Always return base domain for cleaner results
-        match = re.search(r'(https?://(?:www\.)?[^/]+)', best_url)
-        if match:
-            base = match.group(1)
-            return base
-        return best_url
-
-    return None
+    store = SearchResultStore()
+    store.extend(results)
+    return store.best_url()
 
 
 def find_company_url(company_name, model_provider="openai", model_name="gpt-5.1", client=None):
@@ -112,12 +168,20 @@ def find_company_url(company_name, model_provider="openai", model_name="gpt-5.1"
     """
     print(f"\n🔍 Searching for {company_name}'s website...")
 
+    # Well-known and previously resolved companies are answered offline
+    company_index = get_company_index()
+    indexed_url = company_index.lookup(company_name)
+    if indexed_url:
+        print(f"✅ Found website (local index): {indexed_url}")
+        return indexed_url
+
     try:
         # Initialize DuckDuckGo search with the correct API
         ddgs = DDGS()
 
         # Search for the company - try multiple search strategies
-        all_results = []
+        # (the same href often comes back from several queries; store it once)
+        all_results = SearchResultStore()
 
         # Strategy 1: Try with common domain extensions FIRST
         company_clean = company_name.lower().replace(' ', '').replace('-', '')
@@ -160,15 +224,16 @@ def find_company_url(company_name, model_provider="openai", model_name="gpt-5.1"
             raise ValueError("No search results found")
 
         # First, try to extract a good URL directly from results
-        direct_url = extract_domain_from_results(all_results)
+        direct_url = all_results.best_url()
         if direct_url:
             print(f"✅ Found website: {direct_url}")
+            company_index.learn(company_name, direct_url)
             return direct_url
 
         # If direct extraction fails, use LLM
         # Format search results for LLM
         search_results = ""
-        for idx, result in enumerate(all_results[:8], 1):
+        for idx, result in enumerate(all_results.results[:8], 1):
             search_results += f"{idx}. {result.get('title', 'No title')}\n"
             search_results += f"   URL: {result.get('href', 'No URL')}\n"
             search_results += f"   Description: {result.get('body', 'No description')[:150]}\n\n"
@@ -179,12 +244,15 @@ def find_company_url(company_name, model_provider="openai", model_name="gpt-5.1"
             llm = ChatOpenAI(model=model_name, temperature=0)
         elif model_provider == "ollama":
             from langchain_community.llms import Ollama
-            llm = Ollama(model=model_name, base_url="http://localhost:11434")
+
+            from ollama_lifecycle import get_ollama_lifecycle, ollama_base_url
+            get_ollama_lifecycle().touch(model_name)
+            llm = Ollama(model=model_name, base_url=ollama_base_url())
         elif model_provider == "gemini":
             # For Gemini, use direct approach without LangChain LLM
             # Just return the first result's URL
             if all_results and len(all_results) > 0:
-                url = all_results[0].get('href', '')
+                url = all_results.results[0].get('href', '')
                 if url:
                     print(f"✅ Found website: {url}")
                     return url
@@ -239,6 +307,7 @@ Official Website URL:"""
                 raise ValueError("Invalid URL format")
 
         print(f"✅ Found website: {url}")
+        company_index.learn(company_name, url)
         return url
 
     except Exception as e:
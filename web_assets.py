@@ -0,0 +1,161 @@
+"""
+Web Assets Module
+Fingerprinted static files and responses compressed once, served from memory
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+from urllib.parse import parse_qs
+
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+STATIC_DIR = "static"
+# Fingerprinted URLs change whenever the file does, so browsers may keep them
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Everything else is revalidated (a cheap 304 while the ETag matches)
+REVALIDATE = "no-cache"
+# Smaller bodies are not worth compressing (same threshold as GZipMiddleware)
+MIN_COMPRESS_BYTES = 500
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+
+
+def compress_variants(body):
+    """body in every encoding we can serve, keyed by Content-Encoding"""
+    variants = {"identity": body}
+    if len(body) >= MIN_COMPRESS_BYTES:
+        variants["gzip"] = gzip.compress(body, compresslevel=9, mtime=0)
+        if brotli is not None:
+            variants["br"] = brotli.compress(body, quality=11)
+    return variants
+
+
+def accepted_encodings(accept_encoding):
+    """Encodings an Accept-Encoding header allows (q=0 means refused)"""
+    accepted = set()
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = params.strip()
+        if quality.startswith("q=") and quality[2:].strip() in ("0", "0.0", "0.00", "0.000"):
+            continue
+        if name:
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+class CompressedBody:
+    """
+    A response body compressed once, in every encoding we can serve
+
+    Each request only picks a variant (br, then gzip, then identity) or
+    answers 304 when the client already has it.
+    """
+
+    def __init__(self, body, media_type):
+        self.media_type = media_type
+        # Weak: the variants differ in bytes but not in meaning
+        self.etag = f'W/"{hashlib.sha256(body).hexdigest()[:20]}"'
+        self.variants = compress_variants(body)
+
+    def response(self, request_headers, cache_control=REVALIDATE):
+        headers = {"ETag": self.etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+        if self.matches(request_headers.get("if-none-match", "")):
+            return Response(status_code=304, headers=headers)
+        accepted = accepted_encodings(request_headers.get("accept-encoding", ""))
+        for encoding in ("br", "gzip"):
+            if encoding in self.variants and (encoding in accepted or "*" in accepted):
+                headers["Content-Encoding"] = encoding
+                return Response(self.variants[encoding], media_type=self.media_type,
+                                headers=headers)
+        return Response(self.variants["identity"], media_type=self.media_type, headers=headers)
+
+    def matches(self, if_none_match):
+        tags = [tag.strip() for tag in if_none_match.split(",") if tag.strip()]
+        opaque = self.etag[2:]
+        return "*" in tags or any(tag.removeprefix("W/") == opaque for tag in tags)
+
+
+_versions = {}
+_versions_lock = threading.Lock()
+
+
+def asset_version(path, directory=STATIC_DIR):
+    """Content hash of a static file, recomputed only when the file changes"""
+    return file_version(os.path.join(directory, path))
+
+
+def file_version(full_path, stat=None):
+    """asset_version() of a file by its full path (stat may be passed in)"""
+    stat = stat or os.stat(full_path)
+    key = (full_path, stat.st_mtime_ns, stat.st_size)
+    with _versions_lock:
+        version = _versions.get(key)
+    if version is None:
+        with open(full_path, "rb") as handle:
+            version = hashlib.sha256(handle.read()).hexdigest()[:12]
+        with _versions_lock:
+            _versions[key] = version
+    return version
+
+
+def static_url(path):
+    """URL of a static file with its content fingerprint (for templates)"""
+    return f"/static/{path}?v={asset_version(path)}"
+
+
+class FingerprintedStaticFiles(StaticFiles):
+    """
+    StaticFiles with cache headers and precompressed text assets
+
+    Requests made through static_url (with ?v= the current content hash)
+    are cached for a year; plain URLs and stale or unknown versions are
+    revalidated. Text assets are read and compressed once
+    per file version and then served from memory.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._bodies = {}
+        self._lock = threading.Lock()
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        cache_control = REVALIDATE
+        if status_code == 200:
+            query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+            if query.get("v") == [file_version(full_path, stat_result)]:
+                cache_control = IMMUTABLE
+        media_type = self._media_type(full_path)
+        if status_code != 200 or not media_type.startswith(COMPRESSIBLE_TYPES):
+            response = super().file_response(full_path, stat_result, scope, status_code)
+            response.headers["Cache-Control"] = cache_control
+            return response
+        return self._body(full_path, stat_result, media_type).response(
+            Headers(scope=scope), cache_control)
+
+    def _body(self, full_path, stat_result, media_type):
+        version = (stat_result.st_mtime_ns, stat_result.st_size)
+        with self._lock:
+            cached = self._bodies.get(full_path)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        with open(full_path, "rb") as handle:
+            body = CompressedBody(handle.read(), media_type)
+        with self._lock:
+            self._bodies[full_path] = (version, body)
+        return body
+
+    @staticmethod
+    def _media_type(full_path):
+        media_type = mimetypes.guess_type(str(full_path))[0] or "application/octet-stream"
+        if media_type.startswith("text/") or media_type == "application/javascript":
+            media_type += "; charset=utf-8"
+        return media_type